@@ -0,0 +1,185 @@
+from ddi.cli import cli, offline
+from ddi.credentials import (agent_request, agent_socket_path,
+                             get_keyring_password)
+
+import click
+import ddi
+import jsend
+import json
+import logging
+import os
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def peer_is_owner(conn: object):
+    """
+    Check that the process on the other end of a Unix socket belongs to the
+    same user as the agent, where the platform allows us to tell.
+
+    :param object conn: The accepted socket.
+    :return: True if the peer may be served.
+    :rtype: bool
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        # Fall back on the permissions of the socket itself.
+        return True
+
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize('3i'))
+    pid, uid, gid = struct.unpack('3i', creds)
+
+    return uid == os.getuid()
+
+
+def serve_agent(credentials: dict, ttl: float, path: str = None):
+    """
+    Serve credentials over a Unix socket readable only by the current user
+    until the ttl expires or a stop request is received.
+
+    :param dict credentials: The passwords keyed by username.
+    :param float ttl: The number of seconds to serve for.
+    :param str path: The socket path, defaults to agent_socket_path().
+    :return: None
+    :rtype: None
+    """
+    path = path or agent_socket_path()
+
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+
+    if os.path.exists(path):
+        if agent_request({'op': 'status'}, path=path):
+            raise click.ClickException(f'An agent is already running on: {path}')
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    umask = os.umask(0o177)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+
+    os.chmod(path, 0o600)
+    server.listen()
+
+    logger.debug('Credential agent listening on: %s for %s seconds.', path, ttl)
+
+    deadline = time.monotonic() + ttl
+
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            server.settimeout(remaining)
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+
+            with conn:
+                if not peer_is_owner(conn):
+                    logger.debug('Refusing credential request from another '
+                                 'user.')
+                    continue
+
+                conn.settimeout(1)
+                try:
+                    request = json.loads(conn.makefile('rb').readline())
+                except (OSError, ValueError):
+                    continue
+
+                op = request.get('op')
+                if op == 'get' and request.get('username') in credentials:
+                    reply = {'password': credentials[request['username']]}
+                elif op == 'status':
+                    reply = {'expires_in': int(remaining),
+                             'usernames': sorted(credentials)}
+                elif op == 'stop':
+                    reply = {'stopped': True}
+                else:
+                    reply = {}
+
+                try:
+                    conn.sendall(json.dumps(reply).encode() + b'\n')
+                except OSError:
+                    pass
+
+                if op == 'stop':
+                    break
+    finally:
+        server.close()
+        os.unlink(path)
+
+    logger.debug('Credential agent stopped.')
+
+
+@offline
+@cli.group()
+@click.pass_context
+def agent(ctx):
+    """Credential agent commands."""
+    pass
+
+
+@agent.command()
+@click.option('--ttl', default=900, type=click.IntRange(min=1),
+              help='Seconds to keep the credential in memory.',
+              show_default=True)
+@click.pass_context
+def start(ctx, ttl):
+    """
+    Serve the password to later ddi invocations.
+
+    The password is read from the keyring (or prompted for) once and held in
+    memory for --ttl seconds, it is served over a Unix socket only accessible
+    to the current user. The agent runs in the foreground, background it with
+    your shell (e.g. 'ddi agent start &').
+    """
+    username = ctx.obj['username']
+
+    password = get_keyring_password(username)
+    if not password:
+        password = click.prompt(f"{ddi.__name__} password for {username}",
+                                hide_input=True, err=True)
+
+    click.echo(f'Credential agent serving user: {username} for {ttl} seconds '
+               f'on: {agent_socket_path()}', err=True)
+
+    serve_agent({username: password}, ttl)
+
+
+@agent.command()
+@click.pass_context
+def status(ctx):
+    """Show whether the credential agent is running."""
+    reply = agent_request({'op': 'status'})
+
+    if ctx.obj['json']:
+        r = jsend.success({'results': [reply]}) if reply else \
+            jsend.fail({'results': []})
+        click.echo(json.dumps(r, indent=2, sort_keys=True))
+    elif reply:
+        click.echo(f"Credential agent serving: {', '.join(reply['usernames'])} "
+                   f"expires in {reply['expires_in']} seconds.")
+    else:
+        click.echo('No credential agent is running.')
+
+    if not reply:
+        ctx.exit(1)
+
+
+@agent.command()
+@click.pass_context
+def stop(ctx):
+    """Stop the credential agent."""
+    if agent_request({'op': 'stop'}):
+        click.echo('Credential agent stopped.')
+    else:
+        click.echo('No credential agent is running.')
+        ctx.exit(1)
@@ -0,0 +1,178 @@
+import jsend
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# The kinds of key, each has its own namespace so e.g. an alias is never
+# mistaken for a host of the same name.
+KINDS = ('alias', 'host', 'ip')
+
+# The status codes of a mutation naming an ip_id the server does not know.
+# The server did nothing, so the key can be looked up and the mutation tried
+# again.
+UNKNOWN_ID = (204, 400, 404)
+
+
+class IdentityCache:
+    """
+    A small cache mapping FQDNs, aliases and IP addresses to their ip_id.
+
+    Every key has a kind, one of KINDS, and is only found again under the
+    same kind. The ip_ids of one server mean nothing to another, so the
+    entries of a file shared between servers are kept apart by server.
+    Entries expire after ttl seconds. If a path is given the cache is loaded
+    from it on creation and written back by save().
+
+    :param str path: The optional JSON file to persist the cache in.
+    :param float ttl: How long in seconds an entry is considered fresh.
+    :param str server: The normalized URL of the server the ip_ids belong to.
+    """
+
+    def __init__(self, path: str = None, ttl: float = 300, server: str = None):
+        self.path = path
+        self.server = server or ''
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        if path:
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+                logger.debug('Loaded %s identity cache entries from: %s',
+                             len(self._entries), path)
+            except (OSError, ValueError):
+                logger.debug('No usable identity cache at: %s', path)
+
+    def discard(self, kind: str, key: str):
+        """
+        Remove an entry from the cache if it is present.
+
+        :param str kind: The kind of key, one of KINDS.
+        :param str key: The FQDN, alias or IP address.
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._entries.pop(self._key(kind, key), None)
+
+    def get(self, kind: str, key: str):
+        """
+        Get the ip_id for a key if there is a fresh entry.
+
+        :param str kind: The kind of key, one of KINDS.
+        :param str key: The FQDN, alias or IP address.
+        :return: The ip_id or None.
+        :rtype: str
+        """
+        with self._lock:
+            entry = self._entries.get(self._key(kind, key))
+
+        if entry and time.time() - entry[1] < self.ttl:
+            logger.debug('Identity cache hit for %s: %s', kind, key)
+            return entry[0]
+
+        return None
+
+    def save(self):
+        """
+        Write the fresh entries of the cache to its path, if it has one.
+
+        :return: None
+        :rtype: None
+        """
+        if not self.path:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entries = {k: v for k, v in self._entries.items()
+                       if now - v[1] < self.ttl}
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+        logger.debug('Saved %s identity cache entries to: %s', len(entries),
+                     self.path)
+
+    def set(self, kind: str, key: str, ip_id: str):
+        """
+        Record the ip_id for a key.
+
+        :param str kind: The kind of key, one of KINDS.
+        :param str key: The FQDN, alias or IP address.
+        :param str ip_id: The ip_id of the host.
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._entries[self._key(kind, key)] = [ip_id, time.time()]
+
+    def _key(self, kind: str, key: str):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown identity cache key kind: {kind}')
+        return f'{self.server} {kind}:{key.lower()}'
+
+
+def cached_mutation(kind: str, key: str, lookup, mutate,
+                    cache: IdentityCache = None):
+    """
+    Run a mutation against the ip_id of key, skipping the lookup when the
+    cache holds a fresh ip_id for a key of the same kind.
+
+    If the server reports that it does not know a cached ip_id the entry is
+    dropped and the mutation is retried once with a freshly looked up ip_id.
+    Any other failure (e.g. a server error) is returned as is, as the
+    mutation may have been carried out and must not be repeated.
+
+    :param str kind: The kind of key, one of KINDS.
+    :param str key: The FQDN, alias or IP address being mutated.
+    :param lookup: A callable returning the JSEND result of the lookup.
+    :param mutate: A callable taking the ip_id and returning a JSEND result.
+    :param IdentityCache cache: The optional identity cache.
+    :return: The JSEND result of the mutation or of the failed lookup.
+    :rtype: dict
+    """
+    ip_id = cache.get(kind, key) if cache else None
+
+    if ip_id:
+        result = mutate(ip_id)
+
+        if not unknown_id(result):
+            return result
+
+        logger.debug('Cached ip_id: %s for: %s is unknown, looking it up.',
+                     ip_id, key)
+        cache.discard(kind, key)
+
+    r = lookup()
+
+    if not jsend.is_success(r):
+        return r
+
+    ip_id = r['data']['results'][0]['ip_id']
+
+    if cache:
+        cache.set(kind, key, ip_id)
+
+    return mutate(ip_id)
+
+
+def unknown_id(result: dict):
+    """
+    Whether a mutation failed because the server does not know its ip_id.
+
+    :param dict result: The JSEND result of the mutation.
+    :return: True if the ip_id was not found.
+    :rtype: bool
+    """
+    return jsend.is_fail(result) and \
+        result['data'].get('status_code') in UNKNOWN_ID
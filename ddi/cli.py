@@ -1,102 +1,207 @@
-import base64
+from ddi.cache import IdentityCache
+from ddi.credentials import CredentialAuth
+from ddi.logs import configure_logging, stop_logging
+from ddi.targets import load_profiles, target_name
+
 import click
 import ddi
 import getpass
-import keyring
 import logging
-import requests
 import url_normalize
 
 logger = logging.getLogger(__name__)
 
 
-# TODO: test all password variations
+class Cli(click.Group):
+    """
+    The top level group, noting before its callback runs whether the command
+    invoked works offline so the callback does not require a server.
+    """
+
+    def resolve_command(self, ctx, args):
+        name, command, rest = super().resolve_command(ctx, args)
+
+        if command is not None and not ctx.resilient_parsing:
+            ctx.meta['ddi.offline'] = is_offline(ctx, command, rest)
+
+        return name, command, rest
+
+
 def cli_password(ctx, param, password):
     """
     This is a callback function that should only be used from the password
     option.
 
-    Because password logic is a bit complex we use this callback to handle the
-    multitude of options.
+    A password given on the command line or via the environment variable is
+    used as is. Otherwise the password is left unresolved until the first
+    request needs it, at which point it is taken from the credential agent or
+    the keyring, see ddi.credentials.
     :param object ctx: The ctx object from click.
     :param object param: The parameter object from click.
     :param str password: The password consumed (or not) by click.
-    :return: The password or a non-zero exit.
+    :return: The password or None.
     :rtype: str
     """
 
-    username = ctx.params['username']
-
-    logger.debug('Establishing password for user %s.', username)
-
     if password:
         logger.debug('Password established via the command line or environment '
                      'variable.')
-        return password
     else:
-        logger.debug('Password not passed in, attempting to extract from '
-                     'keyring location: %s.', ddi.__name__)
+        logger.debug('Password not passed in, deferring to the credential '
+                     'agent or keyring.')
 
-        password = keyring.get_password(ddi.__name__, username)
-        if password:
-            logger.debug('Password obtained from keyring.')
-            return password
-        else:
-            logger.debug('No password was obtained from the keyring.')
+    return password
 
-            click.echo('No password was found in the environment variable, '
-                       'passed in on the command line, or found in the keyring. '
-                       'If you wish to use a password in the keyring please use '
-                       "'ddi password set'.")
-            ctx.exit(code=1)
 
-    # Should never be reached
-    return None
+def cli_log_levels(ctx, param, levels):
+    """
+    This is a callback function that should only be used from the log level
+    option.
+
+    :param object ctx: The ctx object from click.
+    :param object param: The parameter object from click.
+    :param tuple levels: The MODULE=LEVEL values consumed by click.
+    :return: The levels keyed by logger name.
+    :rtype: dict
+    """
+    parsed = {}
+
+    for spec in levels:
+        name, _, level = spec.rpartition('=')
+        if not name or not isinstance(logging.getLevelName(level.upper()), int):
+            raise click.BadParameter(f'Expected MODULE=LEVEL, got: {spec}')
+        parsed[name] = level.upper()
+
+    return parsed
 
 
-def initiate_session(password: str, secure: bool, username: str):
+def initiate_session(password: str, secure: bool, username: str,
+                     rate: float = 0, concurrency: int = 8, timeout: float = 60,
+                     deadline: float = 0, hedge: float = 0):
     """
     This initializes a requests session object with the proper headers for authentication.
 
-    :param str password: The password
+    All requests made through the session are subject to the rate cap and the
+    adaptive concurrency limit, see ddi.scheduler.
+
+    :param str password: The password, None to resolve it on first use.
     :param bool secure: Setting this to False disables verification of TLS
     :param str username: The user name
+    :param float rate: The maximum requests per second, 0 for unlimited.
+    :param int concurrency: The maximum number of requests in flight.
+    :param float timeout: The timeout of each request in seconds.
+    :param float deadline: The seconds all requests must finish within.
+    :param float hedge: The latency percentile after which reads are hedged.
     :return: The requests session object
     :rtype: object
     """
 
-    logger.debug('Initiating session with TLS verification set to: %s.', secure)
-
-    username = base64.b64encode(username.encode()).decode()
-    password = base64.b64encode(password.encode()).decode()
+    # Imported here so commands that never contact the server (e.g. shell
+    # completion) do not pay for importing requests.
+    from ddi.session import ScheduledSession
 
-    headers = {'X-IPM-Username': username,
-               'X-IPM-Password': password}
+    logger.debug('Initiating session with TLS verification set to: %s.', secure)
 
-    session = requests.Session()
+    session = ScheduledSession(rate=rate, max_concurrency=concurrency,
+                               timeout=timeout, deadline=deadline, hedge=hedge)
     session.verify = secure
-    session.headers = headers
+    session.auth = CredentialAuth(username, password)
+    # Large list responses compress well and are decoded as they stream in.
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
 
     logger.debug('Session initiated.')
 
     return session
 
 
-@click.group()
+def is_offline(ctx, command: object, args: list):
+    """
+    Whether a command, or the subcommand of a group named in args, is marked
+    with offline(). Marking a group marks all of its subcommands.
+
+    :param object ctx: The ctx object from click.
+    :param object command: The command about to be invoked.
+    :param list args: The arguments following the command.
+    :return: True if the command never contacts the server.
+    :rtype: bool
+    """
+    while not getattr(command, 'offline', False):
+        if not isinstance(command, click.Group):
+            return False
+
+        # Group options are flags, the first other argument names the
+        # subcommand.
+        names = [a for a in args if not a.startswith('-')]
+        if not names:
+            # Without a subcommand a group only shows its usage.
+            return True
+        command = command.get_command(ctx, names[0])
+        args = args[args.index(names[0]) + 1:]
+
+    return True
+
+
+def offline(command: object):
+    """
+    Mark a command, or every subcommand of a group, as never contacting the
+    server, so it runs without one.
+
+    :param object command: The click command.
+    :return: The command.
+    :rtype: object
+    """
+    command.offline = True
+
+    return command
+
+
+@click.group(cls=Cli)
+@click.option('--cache-file', type=click.Path(dir_okay=False),
+              help='Persist the FQDN/alias/IP to ip_id cache in this file.')
+@click.option('--cache-ttl', default=300, type=click.FloatRange(min=0),
+              help='Seconds a cached ip_id is trusted for.', show_default=True)
+@click.option('--concurrency', '-C', default=8, type=click.IntRange(min=1),
+              help='Maximum number of requests in flight.', show_default=True)
+@click.option('--deadline', default=0, type=click.FloatRange(min=0),
+              help='Seconds the whole command may spend on requests, 0 for '
+                   'no limit.', show_default=True)
 @click.option('--debug', '-D', default=False, help='Enable debug output.',
               is_flag=True, show_default=True)
 @click.option('--secure', '-S', default=True, help='TLS verification.',
               is_flag=True, show_default=True)
+@click.option('--hedge', default=0, type=click.FloatRange(0, 100),
+              help='Repeat a read not answered by this percentile of recent '
+                   'latencies, 0 to never repeat.', show_default=True)
 @click.option('--json', '-J', default=False, help='Output in JSON using the JSEND standard.',
               is_flag=True, show_default=True)
+@click.option('--log-format', default='text', type=click.Choice(['json', 'text']),
+              help='The format of log records.', show_default=True)
+@click.option('--log-level', multiple=True, callback=cli_log_levels,
+              help='The level of one module, e.g. ddi.session=DEBUG, may be '
+                   'given more than once.')
+@click.option('--log-sample', default=1, type=click.IntRange(min=1),
+              help='Keep one in every this many debug records of each log '
+                   'statement.', show_default=True)
 @click.option('--password', '-P', callback=cli_password, help="The DDI user's password.")
-@click.option('--server', '-s', help="The DDI server's URL to connect to.",
-              prompt=True, required=True)
+@click.option('--profile', '-p',
+              help='A profile of several servers and sites to query at once.')
+@click.option('--rate', '-R', default=0, type=click.FloatRange(min=0),
+              help='Maximum requests per second, 0 for unlimited.',
+              show_default=True)
+@click.option('--server', '-s', help="The DDI server's URL to connect to.")
+@click.option('--target-timeout', default=30, type=click.FloatRange(min=0),
+              help='Seconds to wait for each server of a profile.',
+              show_default=True)
+@click.option('--timeout', default=60, type=click.FloatRange(min=0),
+              help='Seconds each request may take, 0 for no limit.',
+              show_default=True)
 @click.option('--username', '-U', default=getpass.getuser(),
               help='The DDI username.', is_eager=True, required=True, show_default=True)
 @click.version_option(version=ddi.__version__)
 @click.pass_context
-def cli(ctx, debug, json, password, secure, server, username):
+def cli(ctx, cache_file, cache_ttl, concurrency, deadline, debug, hedge, json,
+        log_format, log_level, log_sample, password, profile, rate, secure,
+        server, target_timeout, timeout, username):
     """DDI Commands.
 
         All options can either be taken in on the command line or via an
@@ -115,25 +220,80 @@ def cli(ctx, debug, json, password, secure, server, username):
         Credential Locker). In order to use the system keyring the password must
         first be set in the keyring using 'ddi password set'. Ensure that the
         default username is correct, or set it via -u or DDI_USERNAME before
-        setting the password.
+        setting the password. The keyring is only consulted once a command
+        first contacts the server, and not at all while 'ddi agent start' is
+        serving the password.
+
+        Requests to the server are capped at --rate requests per second and
+        the number in flight adapts between one and --concurrency based on
+        the observed latency and server errors. Each request times out after
+        --timeout seconds and with --deadline the whole command gives up once
+        its budget is spent. --hedge 95 resends a read that has not been
+        answered within the 95th percentile of recent latencies and uses
+        whichever copy answers first.
+
+        Mutations remember the ip_id of the hosts and CNAMEs they touch so
+        later mutations can skip the lookup, use --cache-file to keep these
+        between invocations. Entries are kept apart by server, so one file
+        can be shared by several.
+
+        A profile names several server and site pairs in profiles.yaml in the
+        ddi application directory. With --profile the info and list commands
+        query every server concurrently and tag each result with the server
+        (and site) it came from in ddi_target, mutations go to the first server
+        and site. A server may be listed more than once with different sites.
+
+        Log records are written to stderr by a background thread. Use
+        --log-format json for machine readable records, --log-level to debug
+        a single module and --log-sample to thin out debug records in bulk
+        runs.
     """
-    logger = logging.getLogger()
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    if debug:
-        logger.setLevel(logging.DEBUG)
-    else:
-        logger.setLevel(logging.INFO)
+    configure_logging(debug=debug, log_format=log_format, levels=log_level,
+                      sample=log_sample)
+    # Write out the queued records before the command returns.
+    ctx.call_on_close(stop_logging)
+
+    targets = []
+    if profile:
+        profiles = load_profiles()
+        if profile not in profiles:
+            raise click.BadParameter(f'No such profile: {profile}',
+                                     param_hint='--profile')
+        for entry in profiles[profile]:
+            url = url_normalize.url_normalize(entry['server'])
+            targets.append({'name': target_name(url, entry.get('site')),
+                            'site': entry.get('site'), 'url': url})
+    elif not server and not ctx.meta.get('ddi.offline'):
+        server = click.prompt('Server')
+
+    session = initiate_session(password, secure, username, rate=rate,
+                               concurrency=concurrency, timeout=timeout,
+                               deadline=deadline, hedge=hedge)
+
+    for target in targets:
+        target['session'] = initiate_session(
+            password, secure, username, rate=rate, concurrency=concurrency,
+            timeout=timeout, deadline=deadline, hedge=hedge)
+        # Share the credentials so the password is only resolved once.
+        target['session'].auth = session.auth
+    if targets:
+        server = targets[0]['url']
+        session = targets[0]['session']
+    server = url_normalize.url_normalize(server) if server else None
 
-    session = initiate_session(password, secure, username)
+    # Mutations only go to the one server, see query_targets().
+    cache = IdentityCache(path=cache_file, ttl=cache_ttl, server=server)
+    if cache_file:
+        ctx.call_on_close(cache.save)
 
     ctx.ensure_object(dict)
+    ctx.obj['cache'] = cache
     ctx.obj['debug'] = debug
     ctx.obj['json'] = json
-    ctx.obj['server'] = url_normalize.url_normalize(server)
+    ctx.obj['server'] = server
     ctx.obj['session'] = session
+    ctx.obj['site'] = targets[0]['site'] if targets else None
+    ctx.obj['target_timeout'] = target_timeout
+    ctx.obj['targets'] = targets
     ctx.obj['url'] = ctx.obj['server']
     ctx.obj['username'] = username
@@ -1,11 +1,19 @@
+from ddi.cache import cached_mutation
 from ddi.cli import cli
+from ddi.completion import ALIAS, complete
 from ddi.host import get_host
-from ddi.utilites import get_exceptions
+from ddi.scheduler import run_concurrently
+from ddi.targets import query_targets
+from ddi.utilites import (ResultError, app_path, get_exceptions,
+                          get_paged_results, is_not_found)
 
 import click
+import functools
+import hashlib
 import jsend
 import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +22,29 @@ class NotFoundError(Exception):
     pass
 
 
-def add_cname(cname: str, host: str, session: object, url: str):
+def add_alias(ip_id: str, cname: str, session: object, url: str):
+    """
+    Add a cname to the host with the given ip_id.
+
+    :param str ip_id: The ip_id of the host.
+    :param str cname: The CNAME to add.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The response as JSON
+    :rtype: dict
+    """
+    payload = {'ip_id': ip_id, 'ip_name': cname}
+    r = session.put(url + 'rest/ip_alias_add', json=payload)
+
+    result = get_exceptions(r)
+
+    logger.debug('Add cname result code: %s, JSON: %s', r.status_code, result)
+
+    return result
+
+
+def add_cname(cname: str, host: str, session: object, url: str,
+              cache: object = None):
     """
     Add a cname to a given host.
 
@@ -22,137 +52,413 @@ def add_cname(cname: str, host: str, session: object, url: str):
     :param str host: The host FQDN.
     :param object session: The requests session object.
     :param str url: The full URL of the DDI server.
+    :param IdentityCache cache: The optional identity cache.
     :return: The response as JSON
     :rtype: list
 
     """
-    logger.debug('Add CNAME: %s called on host: %s', cname, host)
+    return add_cnames([cname], host, session, url, cache=cache)[cname]
 
-    host_data = get_host(host, session, url)
 
-    if jsend.is_success(host_data):
-        entry = host_data['data']['results'][0]
+def add_cnames(cnames: list, host: str, session: object, url: str,
+               cache: object = None):
+    """
+    Add many cnames to a given host, resolving the host only once.
 
-        payload = {'ip_id': entry['ip_id'], 'ip_name': cname}
-        r = session.put(url + 'rest/ip_alias_add', json=payload)
+    :param list cnames: The CNAMEs to add.
+    :param str host: The host FQDN.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param IdentityCache cache: The optional identity cache, a fresh entry
+                                for the host skips its lookup.
+    :return: The JSEND result for each CNAME keyed by CNAME.
+    :rtype: dict
+    """
+    logger.debug('Add CNAMEs: %s called on host: %s', cnames, host)
 
-        result = get_exceptions(r)
+    results = {}
+    pending = list(cnames)
 
-        logger.debug('Add cname result code: %s, JSON: %s', r.status_code, result)
+    def add(ip_id):
+        for cname, r in run_concurrently(
+                lambda c: add_alias(ip_id, c, session, url), list(pending),
+                session=session):
+            results[cname] = r
+            if jsend.is_success(r):
+                pending.remove(cname)
+                if cache:
+                    cache.set('alias', cname, ip_id)
 
-        return result
-    else:
-        return host_data
+        # Only fully successful batches are final, a failure with a cached
+        # ip_id is retried for the remaining aliases after a fresh lookup.
+        return results[pending[0]] if pending else jsend.success({})
+
+    r = cached_mutation('host', host, lambda: get_host(host, session, url),
+                        add, cache=cache)
+
+    return {cname: results.get(cname, r) for cname in cnames}
+
+
+def alias_index_path(server: str = None):
+    """
+    The default location of the local alias index of a server.
+
+    The ip_ids of one server mean nothing to another, so every server has its
+    own index.
+
+    :param str server: The normalized URL of the server.
+    :return: The path to the alias index file.
+    :rtype: str
+    """
+    if not server:
+        return app_path('alias_index.json')
 
+    digest = hashlib.blake2b(server.encode(), digest_size=8).hexdigest()
 
-def delete_cname(cname: str, session: object, url: str):
+    return app_path(os.path.join('alias_indexes', f'{digest}.json'))
+
+
+def build_alias_index(session: object, url: str):
+    """
+    Build a mapping of every alias in DDI to the ip_id of its host.
+
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: A dictionary of lower case alias to ip_id.
+    :rtype: dict
+    """
+    logger.debug('Building alias index.')
+
+    index = {}
+    payload = {'WHERE': "ip_alias!=''", 'ORDERBY': 'ip_id'}
+
+    for entry in get_paged_results('rest/ip_address_list', payload, session,
+                                   url):
+        for alias in split_aliases(entry.get('ip_alias', '')):
+            index[alias] = entry['ip_id']
+
+    logger.debug('Alias index built with %s entries.', len(index))
+
+    return index
+
+
+def delete_alias(ip_id: str, cname: str, session: object, url: str):
+    """
+    Delete a cname from the host with the given ip_id.
+
+    :param str ip_id: The ip_id of the host.
+    :param str cname: The CNAME to delete.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The response as JSON
+    :rtype: dict
+    """
+    payload = {'ip_id': ip_id, 'ip_name': cname}
+
+    r = session.delete(url + 'rest/ip_alias_delete', json=payload)
+
+    result = get_exceptions(r)
+
+    logger.debug('Delete cname result code: %s, JSON: %s', r.status_code, result)
+
+    return result
+
+
+def delete_cname(cname: str, session: object, url: str,
+                 alias_index: dict = None, cache: object = None):
     """
     Delete a CNAME from a host.
 
     :param str cname: The CNAME to add.
-    :param str host: The host FQDN.
     :param object session: The requests session object.
     :param str url: The full URL of the DDI server.
+    :param dict alias_index: An optional alias to ip_id index.
+    :param IdentityCache cache: The optional identity cache.
     :return: The response as JSON
     :rtype: list
     """
     logger.debug('Delete cname: %s called.', cname)
 
-    host_data = get_cname_info(cname, session, url)
+    result = cached_mutation(
+        'alias', cname,
+        lambda: get_cname_info(cname, session, url, alias_index=alias_index),
+        lambda ip_id: delete_alias(ip_id, cname, session, url), cache=cache)
 
-    if jsend.is_success(host_data):
-        entry = host_data['data']['results'][0]
+    if cache and jsend.is_success(result):
+        cache.discard('alias', cname)
+
+    return result
 
-        payload = {'ip_id': entry['ip_id'], 'ip_name': cname}
 
-        r = session.delete(url + 'rest/ip_alias_delete', json=payload)
+def delete_cnames(cnames: list, session: object, url: str,
+                  alias_index: dict = None, cache: object = None):
+    """
+    Delete many CNAMEs concurrently, each from whichever host carries it.
 
-        result = get_exceptions(r)
+    :param list cnames: The CNAMEs to delete.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param dict alias_index: An optional alias to ip_id index.
+    :param IdentityCache cache: The optional identity cache.
+    :return: The JSEND result for each CNAME keyed by CNAME.
+    :rtype: dict
+    """
+    logger.debug('Delete CNAMEs: %s called.', cnames)
 
-        logger.debug('Delete cname result code: %s, JSON: %s', r.status_code, result)
+    results = run_concurrently(
+        lambda cname: delete_cname(cname, session, url, alias_index, cache),
+        cnames, session=session)
 
-        return result
-    else:
-        return host_data
+    return dict(results)
 
 
-def get_cname_info(cname: str, session: object, url: str):
+def get_cname_info(cname: str, session: object, url: str,
+                   alias_index: dict = None):
     """
     Get host information associated with a given CNAME.
 
+    Only hosts carrying exactly the given alias are returned, if an alias index
+    is given and knows the alias the host is fetched by its ip_id instead.
+    Otherwise, or if the index entry is stale, an alias that is not the first
+    of its host costs a second query scanning every host.
+
     :param str cname: The CNAME to search for.
     :param object session: The requests session object.
     :param str url: The full URL of the DDI server.
+    :param dict alias_index: An optional alias to ip_id index.
     :return: The response as JSON.
     :rtype: list
     """
     logger.debug('Get CNAME called for: %s', cname)
 
-    payload = {'WHERE': f"ip_alias like '%{cname}%'"}
+    ip_id = (alias_index or {}).get(cname.lower())
+
+    if ip_id:
+        logger.debug('CNAME: %s found in the alias index as ip_id: %s', cname,
+                     ip_id)
+
+        payload = {'WHERE': f"ip_id='{ip_id}'"}
+        r = session.get(url + 'rest/ip_address_list', params=payload)
+
+        result = match_alias(cname, get_exceptions(r))
+
+        if jsend.is_success(result):
+            return result
+
+        logger.debug('Alias index entry for CNAME: %s is stale.', cname)
+
+    # Equality and prefix matches can use the ip_alias index, they find hosts
+    # where the alias is the only or the first one.
+    payload = {'WHERE': f"ip_alias='{cname}' OR ip_alias like '{cname},%'"}
 
     r = session.get(url + 'rest/ip_address_list', params=payload)
 
-    result = get_exceptions(r)
+    result = match_alias(cname, get_exceptions(r))
+
+    if not is_not_found(result):
+        return result
+
+    # Later aliases can only be found by a leading wildcard, which scans
+    # every host. An up to date alias index (--index) avoids it.
+    logger.debug('CNAME: %s is not a leading alias, scanning for it.', cname)
+
+    payload = {'WHERE': f"ip_alias like '%,{cname}' OR "
+                        f"ip_alias like '%,{cname},%'"}
+
+    r = session.get(url + 'rest/ip_address_list', params=payload)
+
+    result = match_alias(cname, get_exceptions(r))
 
     return result
 
 
+def load_alias_index(path: str = None, server: str = None):
+    """
+    Load the local alias index.
+
+    :param str path: The index file, defaults to alias_index_path(server).
+    :param str server: The normalized URL of the server the index is for.
+    :return: The alias index or an empty dictionary if there is none.
+    :rtype: dict
+    """
+    path = path or alias_index_path(server)
+
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.debug('No usable alias index at: %s', path)
+        return {}
+
+
+def match_alias(cname: str, result: dict):
+    """
+    Narrow a JSEND result down to the hosts carrying exactly the given alias.
+
+    :param str cname: The CNAME to match.
+    :param dict result: A JSEND result from rest/ip_address_list.
+    :return: The JSEND result, a failure if no host matches.
+    :rtype: dict
+    """
+    if not jsend.is_success(result):
+        return result
+
+    matches = [entry for entry in result['data']['results']
+               if cname.lower() in split_aliases(entry.get('ip_alias', ''))]
+
+    if matches:
+        return jsend.success({'results': matches})
+    else:
+        logger.debug('No host carries the exact CNAME: %s', cname)
+        # As the server would answer an exact query.
+        return jsend.fail({'results': [], 'status_code': 204})
+
+
+def save_alias_index(index: dict, path: str = None, server: str = None):
+    """
+    Write the alias index to disk.
+
+    :param dict index: The alias index.
+    :param str path: The index file, defaults to alias_index_path(server).
+    :param str server: The normalized URL of the server the index is for.
+    :return: The path written.
+    :rtype: str
+    """
+    path = path or alias_index_path(server)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, path)
+
+    return path
+
+
+def split_aliases(ip_alias: str):
+    """
+    Split the ip_alias field of a host into its individual aliases.
+
+    :param str ip_alias: The comma separated ip_alias field.
+    :return: The lower case aliases.
+    :rtype: list
+    """
+    return [a.strip().lower() for a in ip_alias.split(',') if a.strip()]
+
+
 @cli.group()
+@click.option('--index', '-i', 'use_index', default=False, is_flag=True,
+              help='Resolve CNAMEs using the local alias index.',
+              show_default=True)
 @click.pass_context
-def cname(ctx):
+def cname(ctx, use_index):
     """CNAME based commands."""
+    ctx.ensure_object(dict)
+    ctx.obj['alias_index'] = load_alias_index(server=ctx.obj.get('server')) \
+        if use_index else None
 
 
 @cname.command()
 @click.argument('host', envvar='DDI_CNAME_ADD_HOST', nargs=1)
-@click.argument('cname', envvar='DDI_CNAME_ADD_CNAME', nargs=1)
+@click.argument('cnames', envvar='DDI_CNAME_ADD_CNAME', nargs=-1,
+                required=True)
 @click.pass_context
-def add(ctx, host, cname):
-    """Add a single CNAME entry to an existing host."""
+def add(ctx, host, cnames):
+    """Add CNAME entries to an existing host."""
 
-    r = add_cname(cname, host, ctx.obj['session'], ctx.obj['url'])
+    results = add_cnames(cnames, host, ctx.obj['session'], ctx.obj['url'],
+                         cache=ctx.obj.get('cache'))
 
-    if ctx.obj['json']:
-        click.echo(json.dumps(r, indent=2, sort_keys=True))
-    elif jsend.is_success(r):
-        click.echo(f'CNAME: {cname} added to host: {host}.')
-    else:
-        click.echo(f'CNAME: {cname} addition to host {host} failed.')
+    failed = False
+    for cname in cnames:
+        r = results[cname]
+        if ctx.obj['json']:
+            click.echo(json.dumps(r, indent=2, sort_keys=True))
+        elif jsend.is_success(r):
+            click.echo(f'CNAME: {cname} added to host: {host}.')
+        else:
+            click.echo(f'CNAME: {cname} addition to host {host} failed.')
+
+        failed = failed or not jsend.is_success(r)
+
+    if failed:
+        ctx.exit(1)
+
+
+@cname.command()
+@click.confirmation_option(prompt='Are you sure you want to delete the CNAME(s)?')
+@click.argument('cnames', envvar='DDI_CNAME_DELETE_CNAME', nargs=-1,
+                required=True)
+@click.pass_context
+def delete(ctx, cnames):
+    """Delete CNAME entries from their hosts."""
+
+    results = delete_cnames(cnames, ctx.obj['session'], ctx.obj['url'],
+                            alias_index=ctx.obj.get('alias_index'),
+                            cache=ctx.obj.get('cache'))
+
+    failed = False
+    for cname in cnames:
+        r = results[cname]
+        if ctx.obj['json']:
+            click.echo(json.dumps(r, indent=2, sort_keys=True))
+        elif jsend.is_success(r):
+            click.echo(f'CNAME: {cname} deleted.')
+        else:
+            click.echo(f'CNAME delete failed for: {cname}')
+
+        failed = failed or not jsend.is_success(r)
+
+    if failed:
         ctx.exit(1)
 
 
 @cname.command()
-@click.confirmation_option(prompt='Are you sure you want to delete this CNAME?')
-@click.argument('cname', envvar='DDI_CNAME_DELETE_CNAME', nargs=1)
+@click.argument('cname', envvar='DDI_CNAME_INFO_CNAME', nargs=1,
+                shell_complete=complete(ALIAS))
 @click.pass_context
-def delete(ctx, cname):
-    """Delete a single CNAME entry for a host."""
+def info(ctx, cname):
+    """Retrieve the host info associated with a CNAME."""
 
-    r = delete_cname(cname, ctx.obj['session'], ctx.obj['url'])
+    if ctx.obj.get('targets'):
+        r = query_targets(ctx, functools.partial(get_cname_info, cname))
+    else:
+        r = get_cname_info(cname, ctx.obj['session'], ctx.obj['url'],
+                           alias_index=ctx.obj.get('alias_index'))
 
     if ctx.obj['json']:
         click.echo(json.dumps(r, indent=2, sort_keys=True))
     elif jsend.is_success(r):
-        click.echo(f'CNAME: {cname} deleted.')
+        for host_data in r['data']['results']:
+            if 'ddi_target' in host_data:
+                click.echo(f"Server: {host_data['ddi_target']}")
+            click.echo(f"Hostname: {host_data['name']}.")
+            click.echo(f"CNAMES: {host_data['ip_alias']}")
     else:
-        click.echo(f'CNAME delete failed for: {cname}')
+        click.echo(f'CNAME info for {cname} failed.')
         ctx.exit(1)
 
 
 @cname.command()
-@click.argument('cname', envvar='DDI_CNAME_INFO_CNAME', nargs=1)
 @click.pass_context
-def info(ctx, cname):
-    """Retrieve the host info associated with a CNAME."""
+def index(ctx):
+    """Rebuild the server's local alias index used by --index."""
+
+    try:
+        alias_index = build_alias_index(ctx.obj['session'], ctx.obj['url'])
+    except ResultError as e:
+        if ctx.obj['json']:
+            click.echo(json.dumps(e.result, indent=2, sort_keys=True))
+        else:
+            click.echo('Request failed, enable debugging for more.')
+        ctx.exit(1)
 
-    r = get_cname_info(cname, ctx.obj['session'], ctx.obj['url'])
+    path = save_alias_index(alias_index, server=ctx.obj['server'])
 
     if ctx.obj['json']:
+        r = jsend.success({'results': [{'count': len(alias_index),
+                                        'path': path}]})
         click.echo(json.dumps(r, indent=2, sort_keys=True))
-    elif jsend.is_success(r):
-        host_data = r['data']['results'][0]
-        click.echo(f"Hostname: {host_data['name']}.")
-        click.echo(f"CNAMES: {host_data['ip_alias']}")
     else:
-        click.echo(f'CNAME info for {cname} failed.')
-        ctx.exit(1)
+        click.echo(f'Alias index of {len(alias_index)} CNAMEs written to: {path}')
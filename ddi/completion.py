@@ -0,0 +1,217 @@
+from ddi.cli import cli
+from ddi.utilites import ResultError, app_path, unhexlify_address
+
+import click
+import jsend
+import json
+import logging
+import mmap
+import os
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# The kinds of entry kept in the index, each line is '<kind>\t<value>'.
+ADDRESS = 'a'
+ALIAS = 'c'
+HOST = 'h'
+
+
+def complete(kind: str):
+    """
+    Build a click shell_complete callback answering from the local index.
+
+    The callback never contacts the server, if the index is stale a refresh is
+    started in the background for the next completion.
+
+    :param str kind: The kind of entry to complete, ADDRESS, ALIAS or HOST.
+    :return: The callback.
+    :rtype: function
+    """
+
+    def callback(ctx, param, incomplete):
+        refresh_in_background()
+        return search_index(kind, incomplete)
+
+    return callback
+
+
+def index_path():
+    """
+    The location of the completion index.
+
+    :return: The path of the index file.
+    :rtype: str
+    """
+    return app_path('completion_index')
+
+
+def refresh_in_background(max_age: float = 3600, path: str = None):
+    """
+    Start 'ddi completion refresh' in a detached process if the index is
+    older than max_age, at most once a minute.
+
+    :param float max_age: The age in seconds after which the index is stale.
+    :param str path: The index file, defaults to index_path().
+    :return: True if a refresh was started.
+    :rtype: bool
+    """
+    path = path or index_path()
+    marker = path + '.refreshing'
+    now = time.time()
+
+    for p, age in ((path, max_age), (marker, 60)):
+        try:
+            if now - os.path.getmtime(p) < age:
+                return False
+        except OSError:
+            pass
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(marker, 'w'):
+        pass
+
+    env = {k: v for k, v in os.environ.items() if k != '_DDI_COMPLETE'}
+    try:
+        subprocess.Popen([sys.executable, '-c',
+                          'from ddi.main import main; main()',
+                          'completion', 'refresh'],
+                         env=env, start_new_session=True,
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL)
+    except OSError:
+        return False
+
+    return True
+
+
+def search_index(kind: str, prefix: str, path: str = None, limit: int = 100):
+    """
+    Find the entries of a kind starting with a prefix.
+
+    The index is a sorted UTF-8 file, it is memory mapped and the prefix is
+    found with a binary search over byte offsets, so only the few pages the
+    search and the matches fall in are read however large the index grows.
+
+    :param str kind: The kind of entry, ADDRESS, ALIAS or HOST.
+    :param str prefix: The prefix to complete.
+    :param str path: The index file, defaults to index_path().
+    :param int limit: The most entries to return.
+    :return: The matching entries in sorted order.
+    :rtype: list
+    """
+    try:
+        with open(path or index_path(), 'rb') as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # ValueError as an empty file can not be mapped.
+        return []
+
+    key = f'{kind}\t{prefix.lower()}'.encode()
+    matches = []
+
+    with index:
+        size = len(index)
+
+        def line_at(position):
+            # The start and end of the first line starting at or after
+            # position.
+            start = 0
+            if position:
+                start = index.find(b'\n', position - 1) + 1 or size
+            end = index.find(b'\n', start)
+            return start, size if end < 0 else end
+
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            start, end = line_at(middle)
+            if start < size and index[start:end] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        start, end = line_at(low)
+        while start < size and len(matches) < limit:
+            line = index[start:end]
+            if not line.startswith(key):
+                break
+            matches.append(line[2:].decode())
+            start, end = line_at(end + 1)
+
+    return matches
+
+
+def write_index(hosts, path: str = None):
+    """
+    Write the completion index from host records.
+
+    :param hosts: An iterable of host records from ip_address_list.
+    :param str path: The index file, defaults to index_path().
+    :return: The number of entries written.
+    :rtype: int
+    """
+    # Imported here as the CNAME commands themselves use this module.
+    from ddi.cname import split_aliases
+
+    path = path or index_path()
+    entries = set()
+
+    for host in hosts:
+        entries.add(f"{HOST}\t{host['name'].lower()}")
+        entries.add(f"{ADDRESS}\t{unhexlify_address(host['ip_addr'])}")
+        entries.update(f'{ALIAS}\t{a}' for a in
+                       split_aliases(host.get('ip_alias', '')))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='\n') as f:
+        f.writelines(f'{e}\n' for e in sorted(entries))
+    os.replace(tmp, path)
+
+    logger.debug('Wrote %s completion entries to: %s', len(entries), path)
+
+    return len(entries)
+
+
+@cli.group()
+@click.pass_context
+def completion(ctx):
+    """
+    Shell completion commands.
+
+    Host names, CNAMEs and addresses are completed from a local index that is
+    refreshed in the background once it is an hour old. To enable completion
+    in bash add the following to ~/.bashrc (use zsh_source or fish_source for
+    those shells):
+
+    \b
+        eval "$(_DDI_COMPLETE=bash_source ddi)"
+    """
+    pass
+
+
+@completion.command()
+@click.pass_context
+def refresh(ctx):
+    """Rebuild the completion index from the server."""
+    # Imported here as the host commands themselves use this module.
+    from ddi.host import find_hosts
+
+    try:
+        count = write_index(find_hosts(ctx.obj['session'], ctx.obj['url']))
+    except ResultError as e:
+        r = e.result
+    else:
+        r = jsend.success({'results': [{'entries': count,
+                                        'path': index_path()}]})
+
+    if ctx.obj['json']:
+        click.echo(json.dumps(r, indent=2, sort_keys=True))
+    elif jsend.is_success(r):
+        click.echo(f'Completion index of {count} entries written.')
+    else:
+        click.echo('Request failed, enable debugging for more.')
+        ctx.exit(1)
@@ -0,0 +1,156 @@
+import base64
+import click
+import ddi
+import json
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialAuth:
+    """
+    A requests authentication callable adding the DDI credential headers.
+
+    The password is only resolved, from the agent or the keyring, when the
+    first request is made so commands that never contact the server never
+    touch the keyring.
+
+    :param str username: The DDI username.
+    :param str password: The password if it was given explicitly.
+    """
+
+    def __init__(self, username: str, password: str = None):
+        self.username = username
+        self._password = password
+        self._headers = None
+        self._lock = threading.Lock()
+
+    @property
+    def password(self):
+        """The password, resolved on first access."""
+        with self._lock:
+            if self._password is None:
+                self._password = resolve_password(self.username)
+            return self._password
+
+    @property
+    def headers(self):
+        """The DDI authentication headers."""
+        if self._headers is None:
+            username = base64.b64encode(self.username.encode()).decode()
+            password = base64.b64encode(self.password.encode()).decode()
+
+            self._headers = {'X-IPM-Username': username,
+                             'X-IPM-Password': password}
+
+        return self._headers
+
+    def __call__(self, r):
+        r.headers.update(self.headers)
+        return r
+
+
+def agent_socket_path():
+    """
+    The default location of the credential agent's socket.
+
+    :return: The socket path.
+    :rtype: str
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or click.get_app_dir('ddi')
+
+    return os.path.join(runtime_dir, 'ddi-agent.sock')
+
+
+def agent_request(request: dict, path: str = None):
+    """
+    Send a request to the credential agent.
+
+    :param dict request: The request, e.g. {'op': 'get', 'username': 'foo'}.
+    :param str path: The socket path, defaults to agent_socket_path().
+    :return: The agent's reply or None if no agent is listening.
+    :rtype: dict
+    """
+    path = path or agent_socket_path()
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(1)
+            s.connect(path)
+            s.sendall(json.dumps(request).encode() + b'\n')
+            reply = s.makefile('rb').readline()
+    except OSError as e:
+        logger.debug('Credential agent at: %s is not usable: %s', path, e)
+        return None
+
+    try:
+        return json.loads(reply)
+    except ValueError:
+        return None
+
+
+def get_agent_password(username: str, path: str = None):
+    """
+    Get a password from the credential agent.
+
+    :param str username: The DDI username.
+    :param str path: The socket path, defaults to agent_socket_path().
+    :return: The password or None.
+    :rtype: str
+    """
+    reply = agent_request({'op': 'get', 'username': username}, path=path)
+
+    return (reply or {}).get('password')
+
+
+def get_keyring_password(username: str):
+    """
+    Get a password from the system keyring.
+
+    :param str username: The DDI username.
+    :return: The password or None.
+    :rtype: str
+    """
+    # Importing keyring initialises its backends which is slow, only pay for
+    # it when a password is actually needed.
+    import keyring
+
+    logger.debug('Attempting to extract password from keyring location: %s.',
+                 ddi.__name__)
+
+    return keyring.get_password(ddi.__name__, username)
+
+
+def resolve_password(username: str):
+    """
+    Find the password for a user from the credential agent or the keyring.
+
+    :param str username: The DDI username.
+    :return: The password.
+    :rtype: str
+    :raises click.ClickException: If no password could be found.
+    """
+    logger.debug('Establishing password for user %s.', username)
+
+    password = get_agent_password(username)
+    if password:
+        logger.debug('Password obtained from the credential agent.')
+        return password
+
+    password = get_keyring_password(username)
+    if password:
+        logger.debug('Password obtained from keyring.')
+        return password
+
+    logger.debug('No password was obtained from the keyring.')
+
+    raise click.ClickException(
+        'No password was found in the environment variable, passed in on the '
+        'command line, or found in the keyring. If you wish to use a password '
+        "in the keyring please use 'ddi password set'.")
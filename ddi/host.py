@@ -1,11 +1,25 @@
+from ddi.cache import cached_mutation
 from ddi.cli import cli
-from ddi.utilites import echo_host_info, get_exceptions
-from ddi.ipv4 import get_free_ipv4
+from ddi.completion import HOST, complete
+from ddi.utilites import (ResultError, batched, cidr_to_hex_range,
+                          echo_host_info, echo_lookups, get_exceptions,
+                          get_paged_results, read_targets, stream_lookups)
+from ddi.ipv4 import (POLICIES, find_free_ipv4, get_ipv4_info,
+                      load_subnet_groups)
+from ddi.journal import Journal, journal_path
+from ddi.pool import PoolEmptyError
+from ddi.scheduler import run_concurrently
+from ddi.search import MODES, NameIndex
+from ddi.targets import query_targets
 
 import click
+import functools
+import itertools
 import jsend
 import json
 import logging
+import os
+import sys
 import urllib.parse
 
 logger = logging.getLogger(__name__)
@@ -18,7 +32,8 @@ class NotFoundError(Exception):
 def add_host(building: str, department: str, contact: str,
              phone: str, name: str, session: object,  url: str,
              comment: str = None, ip: str = None, site_name: str = "UCB",
-             subnet: str = None):
+             subnet: str = None, cache: object = None,
+             policy: str = 'least-utilized', pool: object = None):
     """
     Add a host to DDI.
 
@@ -32,7 +47,11 @@ def add_host(building: str, department: str, contact: str,
     :param str comment: An optional comment.
     :param str ip: The optional IP address to give to the host, either ip or subnet must be defined.
     :param str site_name: The site name to use, defaults to UCB.
-    :param str subnet: The optional subnet to use (e.g. 172.23.23.0) either ip or subnet must be defined.
+    :param str subnet: The optional subnet to use (e.g. 172.23.23.0) either ip or subnet must be defined,
+                       a list of subnets may be given to pick from.
+    :param IdentityCache cache: The optional identity cache to record the new ip_id in.
+    :param str policy: How to pick between several subnets, see find_free_ipv4().
+    :param FreeAddressPool pool: An optional pool of prefetched free addresses used when a single subnet is given.
     :return: The JSON result of the operation.
     :rtype: str
     """
@@ -49,6 +68,8 @@ def add_host(building: str, department: str, contact: str,
 
     ip_class_parameters = urllib.parse.urlencode(ip_class_parameters)
 
+    pooled = False
+
     # If an IP is specified that is more specific than a subnet, if neither
     # we fail.
     if ip:
@@ -58,15 +79,27 @@ def add_host(building: str, department: str, contact: str,
     elif subnet:
         logger.debug('Subnet: %s specified, automatic IP discover started.', subnet)
 
-        r = get_free_ipv4(subnet, session, url)
+        subnets = [subnet] if isinstance(subnet, str) else list(subnet)
+
+        if pool and len(subnets) == 1:
+            try:
+                ip = pool.take(subnets[0])
+            except PoolEmptyError:
+                return jsend.fail({'results': []})
 
-        if jsend.success(r):
-            # Get the first free IP address offered.
-            ip = r['data']['results'][0]['hostaddr']
+            pooled = True
 
-            logger.debug('IP: %s, automatically obtained.', ip)
+            logger.debug('IP: %s, taken from the free address pool.', ip)
         else:
-            return r
+            r = find_free_ipv4(subnets, session, url, policy=policy)
+
+            if jsend.is_success(r):
+                # Get the first free IP address offered.
+                ip = r['data']['results'][0]['hostaddr']
+
+                logger.debug('IP: %s, automatically obtained.', ip)
+            else:
+                return r
     else:
         return jsend.fail({})
 
@@ -81,35 +114,152 @@ def add_host(building: str, department: str, contact: str,
 
     result = get_exceptions(r)
 
+    # A pooled address may have been taken since it was verified, if so drop
+    # it and try again with the next one.
+    if pooled and not jsend.is_success(result) and \
+            jsend.is_success(get_ipv4_info(ip, session, url)):
+        logger.debug('Pooled IP: %s is already taken, retrying.', ip)
+        pool.invalidate(subnets[0], ip)
+
+        return add_host(building, department, contact, phone, name, session,
+                        url, comment=comment, site_name=site_name,
+                        subnet=subnet, cache=cache, policy=policy, pool=pool)
+
+    if cache and jsend.is_success(result):
+        ip_id = result['data']['results'][0]['ret_oid']
+        cache.set('host', name, ip_id)
+        cache.set('ip', ip, ip_id)
+
     return result
 
 
-def delete_host(fqdn: str, session: object, url: str):
+def delete_host(fqdn: str, session: object, url: str, cache: object = None):
     """
     Delete a given host by ip_id.
 
     :param str fqdn: The FQDN of the host object to delete.
     :param object session: The requests session object.
     :param str url: The URL of the DDI server.
+    :param IdentityCache cache: The optional identity cache used to skip the
+                                ip_id lookup.
     :return: The JSON result of the operation.
     :rtype: str
     """
 
-    h = get_host(fqdn, session, url)
+    def delete(ip_id):
+        logger.debug('Deleting host: %s with ip_id: %s', fqdn, ip_id)
+        return delete_host_by_id(ip_id, session, url)
 
-    if jsend.is_success(h):
-        ip_id = h['data']['results'][0]['ip_id']
+    result = cached_mutation('host', fqdn,
+                             lambda: get_host(fqdn, session, url), delete,
+                             cache=cache)
 
-        logger.debug('Deleting host: %s with ip_id: %s', fqdn, ip_id)
+    if cache and jsend.is_success(result):
+        cache.discard('host', fqdn)
 
-        payload = {'ip_id': ip_id}
-        r = session.delete(url + 'rest/ip_delete', params=payload)
+    return result
 
-        result = get_exceptions(r)
 
-        return result
-    else:
-        return h
+def delete_host_by_id(ip_id: str, session: object, url: str):
+    """
+    Delete a given host by ip_id.
+
+    :param str ip_id: The ip_id of the host object to delete.
+    :param object session: The requests session object.
+    :param str url: The URL of the DDI server.
+    :return: The JSON result of the operation.
+    :rtype: dict
+    """
+    payload = {'ip_id': ip_id}
+    r = session.delete(url + 'rest/ip_delete', params=payload)
+
+    result = get_exceptions(r)
+
+    return result
+
+
+def delete_hosts_by_id(ip_ids, session: object, url: str):
+    """
+    Delete many hosts by ip_id concurrently.
+
+    :param ip_ids: An iterable of ip_ids.
+    :param object session: The requests session object.
+    :param str url: The URL of the DDI server.
+    :return: A generator of (ip_id, result) tuples in the order given.
+    :rtype: generator
+    """
+    return run_concurrently(lambda ip_id: delete_host_by_id(ip_id, session, url),
+                            ip_ids, session=session)
+
+
+def find_hosts(session: object, url: str, cidr: str = None,
+               where: str = None, order_by: str = 'ip_addr'):
+    """
+    Find every host within a CIDR and/or matching a WHERE clause.
+
+    The records are decoded as they stream in so arbitrarily large result sets
+    can be processed in constant memory.
+
+    :param object session: The requests session object.
+    :param str url: The URL of the DDI server.
+    :param str cidr: The optional CIDR the hosts must be within.
+    :param str where: The optional raw DDI WHERE clause the hosts must match.
+    :param str order_by: The field to order the hosts by.
+    :return: A generator of host records.
+    :rtype: generator
+    """
+    logger.debug('Finding hosts in CIDR: %s matching: %s', cidr, where)
+
+    clauses = []
+
+    if cidr:
+        start, end = cidr_to_hex_range(cidr)
+        clauses.append(f"ip_addr>='{start}' AND ip_addr<='{end}'")
+    if where:
+        clauses.append(f'({where})')
+
+    payload = {'ORDERBY': order_by}
+    if clauses:
+        payload['WHERE'] = ' AND '.join(clauses)
+
+    for entry in get_paged_results('rest/ip_address_list', payload, session,
+                                   url):
+        # Free space within the range carries no ip_id.
+        if entry.get('ip_id', '0') != '0':
+            yield entry
+
+
+def get_hosts(fqdns, session: object, url: str, batch_size: int = 100):
+    """
+    Get the host information for many FQDNs using batched queries.
+
+    :param fqdns: An iterable of FQDNs.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param int batch_size: The number of FQDNs to look up per query.
+    :return: A generator of host records, FQDNs that do not exist are skipped.
+    :rtype: generator
+    """
+    for batch in batched(fqdns, batch_size):
+        yield from get_host_batch(batch, session, url)
+
+
+def get_host_batch(fqdns: list, session: object, url: str):
+    """
+    Get the host information for a batch of FQDNs in a single query.
+
+    :param list fqdns: The FQDNs.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The host records found.
+    :rtype: list
+    """
+    logger.debug('Getting host info for a batch of %s hosts.', len(fqdns))
+
+    payload = {'WHERE': ' OR '.join(f"name='{fqdn}'" for fqdn in fqdns)}
+
+    return list(get_paged_results('rest/ip_address_list', payload, session,
+                                  url))
 
 
 def get_host(fqdn: str, session: object, url: str):
@@ -132,6 +282,44 @@ def get_host(fqdn: str, session: object, url: str):
     return result
 
 
+def put_host(name: str, ip: str, parameters: dict, session: object, url: str,
+             site_name: str = 'UCB', ip_id: str = None):
+    """
+    Create a host, or update an existing one, with the given class parameters.
+
+    :param str name: The FQDN for the host.
+    :param str ip: The IPv4 address of the host.
+    :param dict parameters: The ip_class_parameters (e.g. ucb_buildings), the
+                            hostname is derived from the FQDN if not given.
+    :param object session: The requests session object.
+    :param str url: The URL of the DDI server.
+    :param str site_name: The site name to use, defaults to UCB.
+    :param str ip_id: The ip_id of the host to update, None to create it.
+    :return: The JSON result of the operation.
+    :rtype: dict
+    """
+    parameters = dict({'hostname': name.split('.')[0]}, **parameters)
+
+    payload = {'hostaddr': ip, 'name': name, 'site_name': site_name,
+               'ip_class_parameters': urllib.parse.urlencode(parameters)}
+
+    if ip_id:
+        logger.debug('Update operation invoked on Host: %s with ip_id: %s and '
+                     'Payload: %s', name, ip_id, payload)
+
+        payload['ip_id'] = ip_id
+        r = session.put(url + 'rest/ip_add', json=payload)
+    else:
+        logger.debug('Add operation invoked on Host: %s with Payload: %s',
+                     name, payload)
+
+        r = session.post(url + 'rest/ip_add', json=payload)
+
+    result = get_exceptions(r)
+
+    return result
+
+
 @cli.group()
 @click.pass_context
 def host(ctx):
@@ -154,23 +342,45 @@ def host(ctx):
 @click.option('--phone', '-p',
               help='The UCB phone number associated with the host.',
               prompt=True, required=True)
-@click.option('--subnet', '-s',
-              help='The subnet to automatically choose an IP from.',
+@click.option('--policy', default='least-utilized', type=click.Choice(POLICIES),
+              help='How to pick between several subnets.', show_default=True)
+@click.option('--subnet', '-s', multiple=True,
+              help='The subnet to automatically choose an IP from, may be '
+                   'given more than once.',
               prompt=False, required=False)
+@click.option('--site', help="The site to add the host to, defaults to the "
+                             "profile's first site or UCB.")
+@click.option('--subnet-group', '-g',
+              help='A named group of subnets to choose an IP from.')
 @click.argument('host', envvar='DDI_HOST_ADD_HOST', nargs=1)
 @click.pass_context
-def add(ctx, building, comment, contact, department, ip, phone, subnet, host):
+def add(ctx, building, comment, contact, department, ip, phone, policy, site,
+        subnet, subnet_group, host):
     """
     Add a single host entry into DDI. Specify the subnet (-s) using the
     subnet ID (e.g. 172.23.23.0) to automatically receive a free ip, otherwise
     specify the exact IP to use.
+
+    Several subnets, or a subnet group (-g) defined in subnet_groups.yaml in
+    the ddi application directory, may be given. They are all queried at once
+    and one with a free IP is picked according to --policy.
     """
 
+    subnet = list(subnet)
+
+    if subnet_group:
+        groups = load_subnet_groups()
+        if subnet_group not in groups:
+            raise click.BadParameter(f'Unknown subnet group: {subnet_group}',
+                                     param_hint='--subnet-group')
+        subnet.extend(groups[subnet_group])
+
     logger.debug('Add operation called for host: %s at ip %s', host, ip)
 
     r = add_host(building, department, contact, phone, host,
                  ctx.obj['session'], ctx.obj['url'], comment=comment, ip=ip,
-                 subnet=subnet)
+                 site_name=site or ctx.obj.get('site') or 'UCB', subnet=subnet,
+                 cache=ctx.obj.get('cache'), policy=policy)
 
     if ctx.obj['json']:
         click.echo(json.dumps(r, indent=2, sort_keys=True))
@@ -182,16 +392,48 @@ def add(ctx, building, comment, contact, department, ip, phone, subnet, host):
 
 
 @host.command()
-@click.confirmation_option(prompt='Are you sure you want to delete the host?')
-@click.argument('hosts', envvar='DDI_HOST_DELETE_HOSTS', nargs=-1)
+@click.option('--cidr', help='Delete every host within the CIDR '
+                             '(e.g. 10.1.0.0/22).')
+@click.option('--from-file', type=click.File('r'),
+              help='Delete the hosts listed one FQDN per line in the file, '
+                   '- for stdin.')
+@click.option('--resume', is_flag=True,
+              help='Continue an interrupted bulk deletion, skipping the hosts '
+                   'it already deleted.')
+@click.option('--where', help='Delete every host matching a raw DDI WHERE '
+                              'clause (e.g. "name like \'lab-%\'").')
+@click.option('--yes', is_flag=True, help='Confirm the action without prompting.')
+@click.argument('hosts', envvar='DDI_HOST_DELETE_HOSTS', nargs=-1,
+                shell_complete=complete(HOST))
 @click.pass_context
-def delete(ctx, hosts):
-    """Delete the host(s) from DDI."""
+def delete(ctx, cidr, from_file, resume, where, yes, hosts):
+    """
+    Delete the host(s) from DDI.
+
+    Hosts are either given by FQDN or selected in bulk with --cidr and/or
+    --where or listed in a file with --from-file. Bulk deletions report the
+    number of matching hosts before asking for confirmation and are then
+    carried out concurrently.
+
+    Bulk deletions are journaled, if one is interrupted or some hosts fail
+    run the same command again with --resume to continue where it stopped.
+    """
+
+    if cidr or from_file or where:
+        bulk_delete(ctx, cidr, from_file, where, yes, resume=resume)
+        return None
+
+    if resume:
+        raise click.UsageError('--resume only applies to bulk deletions.')
+
+    if not yes:
+        click.confirm('Are you sure you want to delete the host?', abort=True)
 
     logger.debug('Delete operation called on hosts: %s.', hosts)
 
     for host in hosts:
-        r = delete_host(host, ctx.obj['session'], ctx.obj['url'])
+        r = delete_host(host, ctx.obj['session'], ctx.obj['url'],
+                        cache=ctx.obj.get('cache'))
         if ctx.obj['json']:
             click.echo(json.dumps(r, indent=2, sort_keys=True))
         elif jsend.is_success(r):
@@ -201,16 +443,248 @@ def delete(ctx, hosts):
             ctx.exit(1)
 
 
+def bulk_delete(ctx, cidr: str, from_file: object, where: str, yes: bool,
+                resume: bool = False):
+    """
+    Carry out a bulk host deletion for the delete command.
+
+    Every deleted host is recorded in a journal so an interrupted deletion
+    can be continued with resume, which reuses the hosts selected by the
+    first run and skips those already deleted without contacting the server.
+
+    :param object ctx: The ctx object from click.
+    :param str cidr: The CIDR the hosts must be within.
+    :param object from_file: The open file of FQDNs.
+    :param str where: The raw DDI WHERE clause the hosts must match.
+    :param bool yes: Whether the deletion is already confirmed.
+    :param bool resume: Continue the journal of a previous run.
+    :return: None
+    :rtype: None
+    """
+    session = ctx.obj['session']
+    url = ctx.obj['url']
+    cache = ctx.obj.get('cache')
+
+    if from_file and (cidr or where):
+        raise click.UsageError('--from-file can not be combined with --cidr '
+                               'or --where.')
+
+    if from_file and from_file.name == '<stdin>' and not yes:
+        raise click.UsageError('--yes is required when reading hosts from '
+                               'stdin.')
+
+    if from_file:
+        return stream_delete(ctx, from_file, yes, resume=resume)
+
+    journal = Journal(journal_path('host delete', url, cidr, where),
+                      resume=resume)
+
+    fresh = journal.plan is None
+
+    if fresh:
+        try:
+            entries = [{'ip_id': e['ip_id'], 'name': e['name']} for e in
+                       find_hosts(session, url, cidr=cidr, where=where)]
+        except ResultError as e:
+            journal.remove()
+            if ctx.obj['json']:
+                click.echo(json.dumps(e.result, indent=2, sort_keys=True))
+            else:
+                click.echo('Request failed, enable debugging for more.')
+            ctx.exit(1)
+    else:
+        entries = journal.plan
+
+    remaining = [e for e in entries if e['ip_id'] not in journal]
+
+    click.echo(f'Found {len(entries)} host(s) to delete.', err=True)
+    if len(remaining) < len(entries):
+        click.echo(f'{len(entries) - len(remaining)} already deleted, '
+                   f'{len(remaining)} left to do.', err=True)
+
+    if not remaining:
+        journal.remove()
+        return None
+
+    if not yes:
+        try:
+            click.confirm(f'Are you sure you want to delete {len(remaining)} '
+                          'host(s)?', abort=True)
+        except click.Abort:
+            # A declined run leaves nothing to resume.
+            if fresh:
+                journal.remove()
+            else:
+                journal.close()
+            raise
+
+    if fresh:
+        journal.start(entries)
+
+    names = {entry['ip_id']: entry['name'] for entry in remaining}
+    results = []
+    failures = []
+
+    with journal, click.progressbar(length=len(remaining),
+                                    label='Deleting hosts',
+                                    file=sys.stderr) as bar:
+        try:
+            for ip_id, r in delete_hosts_by_id(names, session, url):
+                success = jsend.is_success(r)
+                results.append({'ip_id': ip_id, 'name': names[ip_id],
+                                'status': r['status']})
+
+                if success:
+                    journal.record(ip_id)
+                    if cache:
+                        cache.discard('host', names[ip_id])
+                else:
+                    failures.append(names[ip_id])
+
+                bar.update(1)
+        except KeyboardInterrupt:
+            click.echo(f'\nInterrupted, {len(remaining) - len(results)} '
+                       'host(s) left to delete, continue with --resume.',
+                       err=True)
+            raise
+
+    if ctx.obj['json']:
+        summary = jsend.fail if failures else jsend.success
+        click.echo(json.dumps(summary({'results': results}), indent=2,
+                              sort_keys=True))
+    else:
+        click.echo(f'Deleted {len(remaining) - len(failures)} of '
+                   f'{len(remaining)} host(s).')
+        for name in failures:
+            click.echo(f'Deletion of host: {name} failed.')
+
+    if failures:
+        click.echo(f'{len(failures)} host(s) left to delete, retry them with '
+                   '--resume.', err=True)
+        ctx.exit(1)
+
+    journal.remove()
+
+
+def stream_delete(ctx, from_file: object, yes: bool, resume: bool = False):
+    """
+    Delete the hosts listed in a file as they are read.
+
+    The FQDNs are looked up in batches and each host found is deleted while
+    later batches are still being looked up, so only a bounded number of
+    hosts is ever held in memory. Hosts deleted or not found are recorded in
+    a journal, with resume they are skipped before being looked up.
+
+    :param object ctx: The ctx object from click.
+    :param object from_file: The open file of FQDNs.
+    :param bool yes: Whether the deletion is already confirmed.
+    :param bool resume: Continue the journal of a previous run.
+    :return: None
+    :rtype: None
+    """
+    session = ctx.obj['session']
+    url = ctx.obj['url']
+    cache = ctx.obj.get('cache')
+
+    source = from_file.name
+    if source != '<stdin>':
+        source = os.path.abspath(source)
+    journal = Journal(journal_path('host delete', url, source), resume=resume)
+
+    if resume:
+        click.echo(f'{len(journal.done)} host(s) already done.', err=True)
+
+    if not yes:
+        try:
+            click.confirm(f'Delete the hosts listed in {from_file.name}?',
+                          abort=True)
+        except click.Abort:
+            # A declined run leaves nothing to resume.
+            if resume:
+                journal.close()
+            else:
+                journal.remove()
+            raise
+
+    counts = {'deleted': 0, 'failed': 0, 'missing': 0}
+
+    def found():
+        targets = (t for t in read_targets(from_file)
+                   if t.lower() not in journal)
+        for fqdn, records in stream_lookups(targets, get_host_batch,
+                                            lambda e: e['name'].lower(),
+                                            session, url):
+            if records is None:
+                counts['failed'] += 1
+                click.echo(f'Lookup of host: {fqdn} failed.', err=True)
+            elif not records:
+                counts['missing'] += 1
+                journal.record(fqdn.lower())
+                logger.debug('Host: %s not found.', fqdn)
+            yield from records or ()
+
+    with journal:
+        try:
+            for entry, r in run_concurrently(
+                    lambda e: delete_host_by_id(e['ip_id'], session, url),
+                    found(), session=session):
+                if jsend.is_success(r):
+                    counts['deleted'] += 1
+                    journal.record(entry['name'].lower())
+                    if cache:
+                        cache.discard('host', entry['name'])
+                else:
+                    counts['failed'] += 1
+
+                if ctx.obj['json']:
+                    click.echo(json.dumps({'ip_id': entry['ip_id'],
+                                           'name': entry['name'],
+                                           'status': r['status']},
+                                          sort_keys=True))
+                elif not jsend.is_success(r):
+                    click.echo(f"Deletion of host: {entry['name']} failed.")
+        except KeyboardInterrupt:
+            click.echo(f"\nInterrupted after deleting {counts['deleted']} "
+                       'host(s), continue with --resume.', err=True)
+            raise
+
+    click.echo(f"Deleted {counts['deleted']} host(s), {counts['failed']} "
+               f"failed, {counts['missing']} not found.", err=True)
+
+    if counts['failed']:
+        click.echo(f"{counts['failed']} host(s) left to delete, retry them "
+                   'with --resume.', err=True)
+        ctx.exit(1)
+
+    journal.remove()
+
+
 @host.command()
-@click.argument('hosts', envvar='DDI_HOST_INFO_HOSTS', nargs=-1)
+@click.option('--from-file', type=click.File('r'),
+              help='Also look up the hosts listed one FQDN per line in the '
+                   'file, - for stdin.')
+@click.argument('hosts', envvar='DDI_HOST_INFO_HOSTS', nargs=-1,
+                shell_complete=complete(HOST))
 @click.pass_context
-def info(ctx, hosts):
-    """Provide information on the given host(s)."""
+def info(ctx, from_file, hosts):
+    """
+    Provide information on the given host(s).
+
+    Hosts read with --from-file are streamed through batched concurrent
+    queries and answered as they arrive, one line of JSON each with --json.
+    """
 
     logger.debug('Info operation called on hosts: %s.', hosts)
 
+    if from_file:
+        echo_lookups(ctx, stream_lookups(
+            itertools.chain(hosts, read_targets(from_file)), get_host_batch,
+            lambda e: e['name'].lower(), ctx.obj['session'], ctx.obj['url']),
+            echo_host_info)
+        return None
+
     for host in hosts:
-        r = get_host(host, ctx.obj['session'], ctx.obj['url'])
+        r = query_targets(ctx, functools.partial(get_host, host))
         if ctx.obj['json']:
             click.echo(json.dumps(r, indent=2, sort_keys=True))
         elif jsend.is_success(r):
@@ -218,3 +692,92 @@ def info(ctx, hosts):
         else:
             click.echo('Request failed, enable debugging for more.')
             ctx.exit(1)
+
+
+@host.command()
+@click.option('--cidr', help='Export only the hosts within the CIDR.')
+@click.option('--order-by', default='ip_id',
+              type=click.Choice(['ip_addr', 'ip_id', 'name']),
+              help='The field to sort the export by.', show_default=True)
+@click.option('--where', help='Export only the hosts matching a raw DDI WHERE '
+                              'clause.')
+@click.pass_context
+def export(ctx, cidr, order_by, where):
+    """
+    Export hosts as newline delimited JSON.
+
+    The hosts are written one raw DDI record per line as they are received,
+    sorted by --order-by, making the output suitable for snapshots.
+    """
+
+    logger.debug('Export operation called for CIDR: %s matching: %s', cidr,
+                 where)
+
+    try:
+        for entry in find_hosts(ctx.obj['session'], ctx.obj['url'], cidr=cidr,
+                                where=where, order_by=order_by):
+            click.echo(json.dumps(entry, sort_keys=True))
+    except ResultError:
+        click.echo('Request failed, enable debugging for more.', err=True)
+        ctx.exit(1)
+
+
+@host.command()
+@click.option('--limit', '-l', default=50, type=click.IntRange(min=1),
+              help='The most matches to show.', show_default=True)
+@click.option('--mode', '-m', default='prefix', type=click.Choice(MODES),
+              help='How to match the pattern.', show_default=True)
+@click.option('--rebuild', is_flag=True,
+              help='Rebuild the index from every host on the server.')
+@click.option('--refresh', is_flag=True,
+              help='Add the hosts created since the index was last updated.')
+@click.argument('pattern', envvar='DDI_HOST_SEARCH_PATTERN', nargs=1)
+@click.pass_context
+def search(ctx, limit, mode, rebuild, refresh, pattern):
+    """
+    Search host names and CNAMEs using a local index.
+
+    The index is built from the server on first use and kept in
+    search_index.json in the ddi application directory. --refresh only
+    fetches hosts newer than the index, --rebuild is needed to pick up
+    renamed and deleted hosts. Matching is case insensitive, glob patterns
+    use shell wildcards (e.g. 'web*.example.com') and fuzzy matches are
+    ranked by trigram similarity.
+    """
+
+    index = NameIndex()
+
+    if rebuild or refresh or not index.built:
+        where = None
+        if rebuild or not index.built:
+            index.clear()
+        else:
+            where = f'ip_id>{index.max_id}'
+
+        try:
+            added = index.add(find_hosts(ctx.obj['session'], ctx.obj['url'],
+                                         where=where, order_by='ip_id'))
+        except ResultError:
+            click.echo('Request failed, enable debugging for more.', err=True)
+            ctx.exit(1)
+
+        logger.debug('Added %s hosts to the search index.', added)
+        # A full build indexes every entry, a refresh adds to the tail until
+        # it grows large.
+        index.save(compact=where is None)
+
+    matches = index.search(pattern, mode=mode, limit=limit)
+
+    if ctx.obj['json']:
+        r = jsend.success({'results': matches}) if matches else \
+            jsend.fail({'results': []})
+        click.echo(json.dumps(r, indent=2, sort_keys=True))
+    elif matches:
+        for match in matches:
+            if match['key'] == match['name']:
+                click.echo(match['name'])
+            else:
+                click.echo(f"{match['key']} -> {match['name']}")
+    else:
+        click.echo(f'No hosts match: {pattern}')
+        ctx.exit(1)
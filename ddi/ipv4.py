@@ -1,14 +1,54 @@
-from ddi.cli import cli
-from ddi.subnet import get_subnet_info
-from ddi.utilites import echo_host_info, get_exceptions, hexlify_address
+from ddi.cli import cli, offline
+from ddi.completion import ADDRESS, complete
+from ddi.scheduler import run_concurrently
+from ddi.subnet import get_subnet_info, subnet_usage
+from ddi.table import (FIELDS, AddressTable, AddressTableError, parse_address,
+                       table_path, write_table)
+from ddi.targets import query_targets
+from ddi.utilites import (ResultError, address_range, app_path,
+                          echo_host_info, echo_lookups, get_exceptions,
+                          get_paged_results, hexlify_address, int_to_address,
+                          read_targets, stream_lookups, unhexlify_address)
 
 import click
+import collections
+import functools
+import itertools
 import jsend
 import json
 import logging
+import netaddr
+import sys
 
 logger = logging.getLogger(__name__)
 
+POLICIES = ('first-fit', 'least-utilized', 'round-robin')
+
+# The next index into the viable subnets for each round-robin subnet list.
+ROUND_ROBIN = collections.Counter()
+
+
+def find_free_ipv4(subnets: list, session: object, url: str,
+                   policy: str = 'least-utilized'):
+    """
+    Get a free IP address from one of several subnets.
+
+    See pick_free_subnet() for how the subnet is chosen.
+
+    :param list subnets: The subnet IDs to choose from (e.g. 172.23.23.0).
+    :param object session: the requests session object
+    :param url: The full URL of the DDI server.
+    :param str policy: One of POLICIES.
+    :return: The JSON response of the chosen subnet in JSEND format.
+    :rtype: dict
+    """
+    logger.debug('Getting free IP from subnets: %s using policy: %s', subnets,
+                 policy)
+
+    subnet, r = pick_free_subnet(subnets, session, url, policy=policy)
+
+    return r
+
 
 def get_free_ipv4(subnet: str, session: object, url: str):
     """
@@ -21,22 +61,39 @@ def get_free_ipv4(subnet: str, session: object, url: str):
     """
     logger.debug('Getting free IP for subnet: %s', subnet)
 
+    info, result = get_free_ipv4_candidate(subnet, session, url)
+
+    if info is None:
+        logger.debug('Failed: Getting free IP for subnet: %s', subnet)
+
+    return result
+
+
+def get_free_ipv4_candidate(subnet: str, session: object, url: str):
+    """
+    Get the subnet information and the free IP addresses of a subnet.
+
+    :param str subnet: The subnet ID (e.g. 172.23.23.0).
+    :param object session: the requests session object
+    :param url: The full URL of the DDI server.
+    :return: The subnet record (None if the subnet lookup failed) and the
+             JSEND result of the free address search or failed lookup.
+    :rtype: tuple
+    """
     r = get_subnet_info(subnet, session, url)
 
-    if jsend.is_success(r):
-        subnet_id = r['data']['results'][0]['subnet_id']
+    if not jsend.is_success(r):
+        return None, r
 
-        payload = {'subnet_id': subnet_id}
+    info = r['data']['results'][0]
 
-        r = session.get(url + '/rpc/ip_find_free_address', params=payload)
+    payload = {'subnet_id': info['subnet_id']}
 
-        result = get_exceptions(r)
+    r = session.get(url + '/rpc/ip_find_free_address', params=payload)
 
-        return result
+    result = get_exceptions(r)
 
-    else:
-        logger.debug('Failed: Getting free IP for subnet: %s', subnet)
-        return r
+    return info, result
 
 
 def get_ipv4_info(ip: str, session: object, url: str):
@@ -61,6 +118,142 @@ def get_ipv4_info(ip: str, session: object, url: str):
     return result
 
 
+def get_ipv4_batch(ips: list, session: object, url: str):
+    """
+    Get the host information for a batch of addresses in a single query.
+
+    :param list ips: The IPv4 addresses as dotted quads.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The host records found.
+    :rtype: list
+    """
+    logger.debug('Getting IP info for a batch of %s addresses.', len(ips))
+
+    payload = {'WHERE': ' OR '.join(f"ip_addr='{hexlify_address(ip).decode()}'"
+                                    for ip in ips)}
+
+    return [e for e in get_paged_results('rest/ip_address_list', payload,
+                                         session, url)
+            if e.get('ip_id', '0') != '0']
+
+
+def get_ipv4_range_info(first: int, last: int, session: object, url: str):
+    """
+    Get the host information for every used address in a range with a single
+    (paged) query.
+
+    :param int first: The first address of the range.
+    :param int last: The last address of the range.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: A generator of host records ordered by address.
+    :rtype: generator
+    """
+    logger.debug('Getting IP info for: %s-%s', int_to_address(first),
+                 int_to_address(last))
+
+    payload = {'WHERE': f"ip_addr>='{first:08x}' AND ip_addr<='{last:08x}'",
+               'ORDERBY': 'ip_addr'}
+
+    for entry in get_paged_results('rest/ip_address_list', payload, session,
+                                   url):
+        # Free space within the range carries no ip_id.
+        if entry.get('ip_id', '0') != '0':
+            yield entry
+
+
+def load_subnet_groups(path: str = None):
+    """
+    Load the named subnet groups.
+
+    The file maps each group name to a list of subnet IDs, e.g.:
+
+        vlan-pool:
+          - 172.23.23.0
+          - 172.23.24.0
+
+    :param str path: The YAML file, defaults to subnet_groups.yaml in the ddi
+                     application directory.
+    :return: The subnet groups.
+    :rtype: dict
+    """
+    import yaml
+
+    path = path or app_path('subnet_groups.yaml')
+
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    except OSError:
+        logger.debug('No subnet groups at: %s', path)
+        return {}
+
+
+def pick_free_subnet(subnets: list, session: object, url: str,
+                     policy: str = 'least-utilized'):
+    """
+    Choose one of several subnets that has a free IP address.
+
+    All candidate subnets are queried concurrently and one of those with a
+    free address is picked according to the policy:
+
+    * first-fit: the first subnet in the order given.
+    * least-utilized: the subnet with the lowest used percentage.
+    * round-robin: rotate through the subnets over successive calls within
+      this process.
+
+    :param list subnets: The subnet IDs to choose from (e.g. 172.23.23.0).
+    :param object session: the requests session object
+    :param url: The full URL of the DDI server.
+    :param str policy: One of POLICIES.
+    :return: The chosen subnet (None if none has a free address) and the
+             JSON response of its free address search in JSEND format.
+    :rtype: tuple
+    """
+    candidates = run_concurrently(
+        lambda subnet: get_free_ipv4_candidate(subnet, session, url), subnets,
+        session=session)
+
+    viable = [(subnet, info, r) for subnet, (info, r) in candidates
+              if info and jsend.is_success(r) and r['data']['results']]
+
+    if not viable:
+        logger.debug('Failed: No free IP in subnets: %s', subnets)
+        return None, jsend.fail({'results': []})
+
+    if policy == 'least-utilized':
+        subnet, info, r = min(
+            viable, key=lambda c: subnet_usage(c[1])['used_percent'])
+    elif policy == 'round-robin':
+        key = tuple(subnets)
+        subnet, info, r = viable[ROUND_ROBIN[key] % len(viable)]
+        ROUND_ROBIN[key] += 1
+    else:
+        subnet, info, r = viable[0]
+
+    logger.debug('Subnet: %s chosen for a free IP.', subnet)
+
+    return subnet, r
+
+
+def unused_ranges(first: int, last: int, used: list):
+    """
+    Compute the unused addresses of a range.
+
+    :param int first: The first address of the range.
+    :param int last: The last address of the range.
+    :param list used: The used addresses as hex, as returned by DDI.
+    :return: The unused addresses collapsed into ranges.
+    :rtype: list
+    """
+    unused = netaddr.IPSet(netaddr.IPRange(first, last)) - \
+        netaddr.IPSet(netaddr.IPAddress(int(a, 16)) for a in used)
+
+    return [str(r) if r.first != r.last else int_to_address(r.first)
+            for r in unused.iter_ipranges()]
+
+
 @cli.group()
 @click.pass_context
 def ipv4(ctx):
@@ -69,18 +262,167 @@ def ipv4(ctx):
 
 
 @ipv4.command()
-@click.argument('ips', envvar='DDI_IP_INFO_IPS', nargs=-1)
+@click.option('--from-file', type=click.File('r'),
+              help='Also look up the addresses listed one per line in the '
+                   'file, - for stdin.')
+@click.option('--unused', '-u', default=False, is_flag=True,
+              help='List the unused addresses of ranges, every address given '
+                   'must then be a CIDR or range.', show_default=True)
+@click.argument('ips', envvar='DDI_IP_INFO_IPS', nargs=-1,
+                shell_complete=complete(ADDRESS))
 @click.pass_context
-def info(ctx, ips):
-    """Provide information on the given IPv4 address(es)."""
+def info(ctx, from_file, unused, ips):
+    """
+    Provide information on the given IPv4 address(es).
+
+    Whole ranges can be given either as a CIDR (e.g. 10.1.0.0/22) or as a
+    dash separated range (e.g. 10.1.0.10-10.1.0.50), each range is answered
+    with a single query.
+
+    Addresses read with --from-file are streamed through batched concurrent
+    queries and answered as they arrive, one line of JSON each with --json.
+    """
+
+    if unused and (from_file or not all('/' in ip or '-' in ip
+                                         for ip in ips)):
+        raise click.UsageError('--unused only applies to CIDRs and ranges, '
+                               'not single addresses or --from-file.')
+
+    if from_file:
+        echo_lookups(ctx, stream_lookups(
+            itertools.chain(ips, read_targets(from_file)), get_ipv4_batch,
+            lambda e: unhexlify_address(e['ip_addr']), ctx.obj['session'],
+            ctx.obj['url']), echo_host_info)
+        return None
 
     logger.debug('Info operation called on IPs: %s.', ips)
     for ip in ips:
-        r = get_ipv4_info(ip, ctx.obj['session'], ctx.obj['url'])
+        if '/' in ip or '-' in ip:
+            first, last = address_range(ip)
+
+            try:
+                results = list(get_ipv4_range_info(first, last,
+                                                   ctx.obj['session'],
+                                                   ctx.obj['url']))
+            except ResultError as e:
+                r = e.result
+            else:
+                data = {'results': results}
+                if unused:
+                    data['unused'] = unused_ranges(
+                        first, last, [e['ip_addr'] for e in results])
+                r = jsend.success(data)
+        else:
+            r = query_targets(ctx, functools.partial(get_ipv4_info, ip))
+
         if ctx.obj['json']:
             click.echo(json.dumps(r, indent=2, sort_keys=True))
         elif jsend.is_success(r):
             echo_host_info(r)
+            if 'unused' in r['data']:
+                click.echo(f'Unused Addresses in {ip}:')
+                for address in r['data']['unused']:
+                    click.echo(address)
         else:
             click.echo('Request failed, enable debugging for more.')
             ctx.exit(1)
+
+
+@offline
+@ipv4.command()
+@click.option('--field', '-f', default=1, type=click.IntRange(min=1),
+              help='The whitespace separated column holding the address.',
+              show_default=True)
+@click.option('--table', '-t', type=click.Path(exists=True, dir_okay=False),
+              help='The address table, by default the one written by '
+                   "'ddi ipv4 table'.")
+@click.argument('input', type=click.File('rb'), default='-')
+@click.pass_context
+def lookup(ctx, field, table, input):
+    """
+    Enrich lines of addresses from the local address table.
+
+    Every line of INPUT (stdin by default) is written back followed by the
+    tab separated name, subnet, building, department and responsible person
+    of the address in column --field, or empty fields if it is unknown. With
+    --json each line is written as a JSON object instead. The server is
+    never contacted, see 'ddi ipv4 table'.
+    """
+
+    try:
+        addresses = AddressTable(table)
+    except (AddressTableError, OSError) as e:
+        raise click.ClickException(f"{e}, build one with 'ddi ipv4 table'.")
+
+    as_json = ctx.obj['json']
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    missing = b'\t' * (len(FIELDS) - 1)
+    seen = {}
+
+    with addresses:
+        while True:
+            # Work through the input a block at a time, writing each block's
+            # lines at once rather than one write per line.
+            lines = input.readlines(1 << 20)
+            if not lines:
+                break
+            output = []
+
+            for line in lines:
+                line = line.rstrip(b'\r\n')
+                columns = line.split(None, field)
+                token = columns[field - 1] if len(columns) >= field else b''
+
+                # Logs repeat the same addresses, only search for each once.
+                values = seen.get(token)
+                if values is None:
+                    address = parse_address(token)
+                    values = (address is not None and
+                              addresses.lookup(address)) or missing
+                    if len(seen) >= 1000000:
+                        seen.clear()
+                    seen[token] = values
+
+                if as_json:
+                    record = dict(zip(FIELDS, values.decode().split('\t')))
+                    record['address'] = token.decode(errors='replace')
+                    output.append(json.dumps(record, sort_keys=True).encode())
+                else:
+                    output.append(line + b'\t' + values)
+
+            output.append(b'')
+            out.write(b'\n'.join(output))
+
+    out.flush()
+
+
+@ipv4.command()
+@click.option('--output', '-o', type=click.Path(dir_okay=False),
+              help='Where to write the table, by default where '
+                   "'ddi ipv4 lookup' looks for it.")
+@click.pass_context
+def table(ctx, output):
+    """
+    Write the local address table used by 'ddi ipv4 lookup'.
+
+    Every used address is fetched in a few large paged queries and written,
+    sorted, to a compact binary file that lookups memory map.
+    """
+
+    try:
+        count = write_table(get_ipv4_range_info(0, 0xffffffff,
+                                                ctx.obj['session'],
+                                                ctx.obj['url']), path=output)
+    except ResultError as e:
+        r = e.result
+    else:
+        r = jsend.success({'results': [{'addresses': count,
+                                        'path': output or table_path()}]})
+
+    if ctx.obj['json']:
+        click.echo(json.dumps(r, indent=2, sort_keys=True))
+    elif jsend.is_success(r):
+        click.echo(f'Address table of {count} addresses written.')
+    else:
+        click.echo('Request failed, enable debugging for more.')
+        ctx.exit(1)
@@ -0,0 +1,165 @@
+from ddi.utilites import app_path
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    An append only record of the operations a bulk job has completed.
+
+    Each line is a JSON object, either the job's plan or a completed
+    operation with its result. Lines are flushed as they are written but only
+    fsynced every sync_every operations or sync_interval seconds, a crash can
+    therefore lose the last few records and those operations are simply
+    carried out again on resume. A torn final line is ignored when loading.
+
+    :param str path: The journal file.
+    :param bool resume: Load an existing journal rather than starting afresh.
+    :param int sync_every: Fsync after this many records.
+    :param float sync_interval: Fsync at least every this many seconds.
+    """
+
+    def __init__(self, path: str, resume: bool = False, sync_every: int = 100,
+                 sync_interval: float = 1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.plan = None
+        self.done = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._synced = time.monotonic()
+
+        if resume:
+            self._load()
+        elif os.path.exists(path):
+            logger.info('Starting over, discarding the journal of an '
+                        'unfinished run: %s', path)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a' if resume else 'w')
+
+        # Records appended after a torn line must start on a line of their own.
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write('\n')
+
+    def __contains__(self, key: str):
+        return key in self.done
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Fsync and close the journal.
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def record(self, key: str, result: dict = None):
+        """
+        Record a completed operation.
+
+        :param str key: The operation, e.g. an FQDN or ip_id.
+        :param dict result: The JSEND result, kept for use on resume.
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self.done[key] = result
+            self._write({'key': key, 'result': result})
+            self._pending += 1
+
+            if self._pending >= self.sync_every or \
+                    time.monotonic() - self._synced >= self.sync_interval:
+                self._sync()
+
+    def remove(self):
+        """
+        Close and delete the journal once its job is complete.
+
+        :return: None
+        :rtype: None
+        """
+        self.close()
+        os.remove(self.path)
+        logger.debug('Removed completed journal: %s', self.path)
+
+    def start(self, plan):
+        """
+        Record the plan of the job, synced immediately.
+
+        :param plan: Anything JSON serializable needed to resume the job
+                     without planning it again.
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self.plan = plan
+            self._write({'plan': plan})
+            self._sync()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        logger.debug('Skipping a torn journal line.')
+                        continue
+                    if 'plan' in entry:
+                        self.plan = entry['plan']
+                    else:
+                        self.done[entry['key']] = entry['result']
+        except OSError:
+            logger.debug('No journal to resume at: %s', self.path)
+            return None
+
+        logger.debug('Loaded %s completed operations from: %s',
+                     len(self.done), self.path)
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._synced = time.monotonic()
+
+    def _write(self, entry: dict):
+        self._file.write(json.dumps(entry, sort_keys=True) + '\n')
+        self._file.flush()
+
+
+def journal_path(*job):
+    """
+    The journal of a bulk job, in the ddi application directory.
+
+    :param job: Strings identifying the job, e.g. the command and its
+                arguments. Running the same job again finds the same journal.
+    :return: The path of the journal file.
+    :rtype: str
+    """
+    digest = hashlib.blake2b('\0'.join(str(j) for j in job).encode(),
+                             digest_size=8).hexdigest()
+
+    return app_path(os.path.join('journals', f'{digest}.ndjson'))
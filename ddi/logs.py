@@ -0,0 +1,135 @@
+import atexit
+import collections
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+
+TEXT_FORMAT = '%(asctime)s %(name)-12s %(levelname)-8s %(message)s'
+
+# The queue handler and listener currently installed on the root logger.
+_installed = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    A queue handler that leaves formatting to the listener's thread.
+
+    The stock QueueHandler merges the message and its arguments before
+    queueing, which is exactly the work that slows down the request path when
+    debugging. Records are queued untouched instead, so arguments must not be
+    mutated after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as single line JSON objects."""
+
+    def format(self, record):
+        entry = {'level': record.levelname,
+                 'message': record.getMessage(),
+                 'name': record.name,
+                 'thread': record.threadName,
+                 'time': datetime.datetime.fromtimestamp(
+                     record.created, datetime.timezone.utc).isoformat()}
+
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str, sort_keys=True)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep one in every n debug records logged from the same call site.
+
+    The first record of each call site is always kept so no kind of message
+    disappears entirely. Records above debug are never dropped.
+
+    :param int n: Keep one record in every n.
+    """
+
+    def __init__(self, n: int):
+        super().__init__()
+        self.n = n
+        self._seen = collections.Counter()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        site = (record.pathname, record.lineno)
+        count = self._seen[site]
+        self._seen[site] = count + 1
+
+        return count % self.n == 0
+
+
+def configure_logging(debug: bool = False, log_format: str = 'text',
+                      levels: dict = None, sample: int = 1):
+    """
+    Send log records through a queue to a background thread writing them to
+    stderr.
+
+    Calling this again replaces the previous configuration rather than adding
+    a second handler, so cli() may be invoked repeatedly in one process.
+
+    :param bool debug: Log at debug level rather than info.
+    :param str log_format: Either text or json.
+    :param dict levels: Levels for individual loggers keyed by logger name
+                        (e.g. {'ddi.session': 'DEBUG'}).
+    :param int sample: Keep one in every sample debug records per call site.
+    :return: The handler installed on the root logger.
+    :rtype: object
+    """
+    global _installed
+
+    root = logging.getLogger()
+    stop_logging()
+
+    output = logging.StreamHandler()
+    output.setFormatter(JSONFormatter() if log_format == 'json' else
+                        logging.Formatter(TEXT_FORMAT))
+
+    records = queue.SimpleQueue()
+    handler = DeferredQueueHandler(records)
+    if sample > 1:
+        handler.addFilter(SamplingFilter(sample))
+
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+
+    for name, level in (levels or {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    _installed = (handler, listener)
+
+    return handler
+
+
+def stop_logging():
+    """
+    Remove the installed handler and write out any queued records.
+
+    :return: None
+    :rtype: None
+    """
+    global _installed
+
+    if _installed is None:
+        return None
+
+    handler, listener = _installed
+    logging.getLogger().removeHandler(handler)
+    listener.stop()
+    _installed = None
+
+
+atexit.register(stop_logging)
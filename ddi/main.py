@@ -1,10 +1,23 @@
 from ddi.cli import cli
+from ddi.scheduler import DeadlineExceeded
+import click
+import ddi.agent
 import ddi.cname
+import ddi.completion
 import ddi.host
 import ddi.ipv4
+import ddi.metrics
 import ddi.password
+import ddi.snapshot
 import ddi.subnet
+import ddi.sync
+import ddi.watch
+import sys
 
 
 def main():
-    cli(auto_envvar_prefix='DDI', obj={})
+    try:
+        cli(auto_envvar_prefix='DDI', obj={})
+    except DeadlineExceeded as e:
+        click.echo(f'Deadline exceeded: {e}', err=True)
+        sys.exit(1)
@@ -0,0 +1,128 @@
+from ddi.cli import cli
+from ddi.subnet import list_subnets, subnet_usage
+from ddi.utilites import ResultError
+
+import click
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# The per subnet gauges, the field of subnet_usage() and their help text.
+GAUGES = (('ddi_subnet_free_addresses', 'free',
+           'Number of free addresses in the subnet.'),
+          ('ddi_subnet_size_addresses', 'size',
+           'Number of addresses in the subnet.'),
+          ('ddi_subnet_used_addresses', 'used',
+           'Number of used addresses in the subnet.'),
+          ('ddi_subnet_used_ratio', 'used_percent',
+           'Fraction of the usable addresses of the subnet in use.'))
+
+
+def escape_label(value: str):
+    """
+    Escape a label value for the Prometheus text format.
+
+    :param str value: The label value.
+    :return: The escaped value.
+    :rtype: str
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics(usages: list, duration: float, timestamp: float):
+    """
+    Render subnet utilization in the Prometheus text exposition format.
+
+    :param list usages: The subnet_usage() of every subnet.
+    :param float duration: The seconds it took to collect the subnets.
+    :param float timestamp: When the subnets were collected (Unix time).
+    :return: The metrics text.
+    :rtype: str
+    """
+    lines = []
+
+    for name, field, description in GAUGES:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} gauge')
+        for u in usages:
+            labels = ','.join(f'{k}="{escape_label(str(u[k]))}"' for k in
+                              ('cidr', 'site_name', 'subnet_name'))
+            value = u[field] / 100 if field == 'used_percent' else u[field]
+            lines.append(f'{name}{{{labels}}} {value}')
+
+    lines.append('# HELP ddi_metrics_collect_duration_seconds Seconds taken '
+                 'to collect the subnets.')
+    lines.append('# TYPE ddi_metrics_collect_duration_seconds gauge')
+    lines.append(f'ddi_metrics_collect_duration_seconds {duration:.3f}')
+    lines.append('# HELP ddi_metrics_last_success_timestamp_seconds When the '
+                 'subnets were last collected.')
+    lines.append('# TYPE ddi_metrics_last_success_timestamp_seconds gauge')
+    lines.append(f'ddi_metrics_last_success_timestamp_seconds {timestamp:.0f}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(text: str, path: str):
+    """
+    Atomically replace a textfile collector file.
+
+    The file is written next to its destination and renamed into place so
+    the collector never reads a partial file.
+
+    :param str text: The metrics text.
+    :param str path: The .prom file.
+    :return: None
+    :rtype: None
+    """
+    tmp = f'{path}.{os.getpid()}.tmp'
+
+    with open(tmp, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@cli.command()
+@click.option('--block', '-b', help='Only subnets within this block CIDR.')
+@click.option('--interval', default=0, type=click.FloatRange(min=0),
+              help='Collect again every this many seconds, 0 to collect once.',
+              show_default=True)
+@click.option('--site', help='Only subnets in this site.')
+@click.argument('output', envvar='DDI_METRICS_OUTPUT',
+                type=click.Path(dir_okay=False, writable=True))
+@click.pass_context
+def metrics(ctx, block, interval, site, output):
+    """
+    Write subnet utilization metrics for the Prometheus textfile collector.
+
+    Every subnet is fetched in a few large paged queries and its size, used
+    and free address counts and used ratio are written to OUTPUT (e.g.
+    /var/lib/node_exporter/subnets.prom), replacing it atomically. With
+    --interval the collection repeats using the same connection. A failed
+    collection leaves the previous file in place.
+    """
+
+    while True:
+        start = time.monotonic()
+
+        try:
+            usages = [subnet_usage(s) for s in
+                      list_subnets(ctx.obj['session'], ctx.obj['url'],
+                                   site=site, block=block)]
+        except ResultError:
+            click.echo('Request failed, enable debugging for more.', err=True)
+            if not interval:
+                ctx.exit(1)
+        else:
+            write_textfile(render_metrics(usages, time.monotonic() - start,
+                                          time.time()), output)
+            logger.debug('Wrote metrics for %s subnets to: %s', len(usages),
+                         output)
+
+        if not interval:
+            return None
+
+        time.sleep(max(0, interval - (time.monotonic() - start)))
@@ -1,12 +1,12 @@
-from ddi.cli import cli
+from ddi.cli import cli, offline
 import click
 import ddi
-import keyring
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+@offline
 @cli.group()
 @click.pass_context
 def password(ctx):
@@ -18,6 +18,8 @@ def password(ctx):
 @click.pass_context
 def set_(ctx):
     """Set the password in the system keyring."""
+    import keyring
+
     logger.debug('Setting password for user: %s', ctx.obj['username'])
     p = click.prompt(f"{ddi.__name__} password for {ctx.obj['username']}",
                      hide_input=True, confirmation_prompt=True)
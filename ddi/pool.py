@@ -0,0 +1,218 @@
+from ddi.subnet import get_subnet_info
+from ddi.utilites import (ResultError, get_exceptions, hexlify_address,
+                          int_to_address, is_not_found, unhexlify_address)
+
+import collections
+import jsend
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PoolEmptyError(Exception):
+    pass
+
+
+class FreeAddressPool:
+    """
+    Keep verified free IPv4 addresses prefetched for a number of subnets so
+    host additions do not wait on the subnet and free address lookups.
+
+    A background thread keeps up to size addresses per subnet. Addresses are
+    handed out only once, addresses found to be taken are dropped and
+    replaced. Until hosts are added the server keeps offering the same first
+    free addresses, so each refill of a subnet searches on from where the
+    last one stopped, starting over once the end of the subnet is reached.
+
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param int size: The number of addresses to keep ready per subnet.
+    """
+
+    def __init__(self, session: object, url: str, size: int = 5):
+        self.session = session
+        self.url = url
+        self.size = size
+        self._begin = {}
+        self._pools = {}
+        self._subnet_ids = {}
+        self._handed_out = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def invalidate(self, subnet: str, address: str):
+        """
+        Drop an address that turned out to be taken and refill the pool.
+
+        :param str subnet: The subnet ID the address came from.
+        :param str address: The address as a dotted quad.
+        :return: None
+        :rtype: None
+        """
+        logger.debug('Invalidating pooled address: %s of subnet: %s', address,
+                     subnet)
+
+        with self._condition:
+            pool = self._pools.get(subnet)
+            if pool and address in pool:
+                pool.remove(address)
+            self._handed_out.add(address)
+            self._condition.notify_all()
+
+    def stop(self):
+        """
+        Stop the background refill thread.
+
+        :return: None
+        :rtype: None
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+        self._thread.join()
+
+    def take(self, subnet: str, timeout: float = 30):
+        """
+        Take a free address of a subnet, waiting for the pool to be filled if
+        it is empty.
+
+        :param str subnet: The subnet ID (e.g. 172.23.23.0).
+        :param float timeout: The longest to wait in seconds.
+        :return: The address as a dotted quad.
+        :rtype: str
+        :raises PoolEmptyError: If no address became available in time.
+        """
+        with self._condition:
+            pool = self._pools.setdefault(subnet, collections.deque())
+            self._condition.notify_all()
+
+            if not self._condition.wait_for(lambda: pool or self._stopped,
+                                            timeout=timeout) or not pool:
+                raise PoolEmptyError(f'No free address in subnet: {subnet}')
+
+            address = pool.popleft()
+            self._handed_out.add(address)
+            self._condition.notify_all()
+
+        logger.debug('Took pooled address: %s of subnet: %s', address, subnet)
+
+        return address
+
+    def _needy_subnets(self):
+        return [s for s, pool in self._pools.items() if len(pool) < self.size]
+
+    def _refill(self, subnet: str):
+        subnet_id = self._subnet_ids.get(subnet)
+
+        if subnet_id is None:
+            r = get_subnet_info(subnet, self.session, self.url)
+            if not jsend.is_success(r):
+                logger.debug('Pool failed to find subnet: %s', subnet)
+                return False
+            subnet_id = self._subnet_ids[subnet] = \
+                r['data']['results'][0]['subnet_id']
+
+        payload = {'subnet_id': subnet_id, 'max_find': self.size * 2}
+        if subnet in self._begin:
+            payload['begin_addr'] = self._begin[subnet]
+
+        r = get_exceptions(self.session.get(
+            self.url + '/rpc/ip_find_free_address', params=payload))
+
+        if not jsend.is_success(r):
+            # Nothing free past where the last refill stopped, start over.
+            self._begin.pop(subnet, None)
+            return False
+
+        offered = [a['hostaddr'] for a in r['data']['results']]
+
+        with self._condition:
+            pool = self._pools[subnet]
+            candidates = [a for a in offered
+                          if a not in self._handed_out and a not in pool]
+
+        free = set(verify_free(candidates, self.session, self.url))
+
+        added = False
+        last = None
+        for address in offered:
+            with self._condition:
+                if address in free and address not in pool and \
+                        address not in self._handed_out:
+                    if len(pool) >= self.size:
+                        # Offered again by the next refill.
+                        break
+                    pool.append(address)
+                    added = True
+                    self._condition.notify_all()
+            last = address
+
+        if last is not None:
+            self._begin[subnet] = int_to_address(
+                int(hexlify_address(last), 16) + 1)
+
+        return added
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopped or self._needy_subnets())
+                if self._stopped:
+                    return None
+                subnets = self._needy_subnets()
+
+            refilled = False
+            for subnet in subnets:
+                try:
+                    refilled = self._refill(subnet) or refilled
+                except Exception:
+                    logger.debug('Pool refill of subnet: %s failed.', subnet,
+                                 exc_info=True)
+
+            if not refilled:
+                # Avoid hammering the server while it has nothing to offer.
+                with self._condition:
+                    self._condition.wait(timeout=5)
+
+
+def verify_free(addresses: list, session: object, url: str):
+    """
+    Check which of the given addresses are not in use, using one query.
+
+    :param list addresses: The addresses as dotted quads.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The addresses that are free.
+    :rtype: list
+    :raises ResultError: If the query failed.
+    """
+    if not addresses:
+        return []
+
+    where = ' OR '.join(f"ip_addr='{hexlify_address(a).decode()}'"
+                        for a in addresses)
+    r = get_exceptions(session.get(url + 'rest/ip_address_list',
+                                   params={'WHERE': where}))
+
+    if jsend.is_success(r):
+        used = {unhexlify_address(e['ip_addr']) for e in r['data']['results']
+                if e.get('ip_id', '0') != '0'}
+    elif is_not_found(r):
+        # None of the addresses are in use.
+        used = set()
+    else:
+        # The addresses may well be in use, so none can be handed out.
+        raise ResultError(r)
+
+    return [a for a in addresses if a not in used]
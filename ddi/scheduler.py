@@ -0,0 +1,208 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class LatencyTracker:
+    """
+    Track the latency of recent requests to estimate its percentiles.
+
+    :param int window: The number of recent latencies kept.
+    :param int minimum: The number of latencies needed before estimating.
+    """
+
+    def __init__(self, window: int = 200, minimum: int = 10):
+        self.minimum = minimum
+        self._latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def percentile(self, p: float):
+        """
+        Estimate a percentile of the recent latencies.
+
+        :param float p: The percentile, between 0 and 100.
+        :return: The latency in seconds, or None with too few samples.
+        :rtype: float
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+        if len(latencies) < self.minimum:
+            return None
+
+        return latencies[min(len(latencies) - 1,
+                             int(len(latencies) * p / 100))]
+
+    def record(self, latency: float):
+        """
+        Record the latency of a completed request.
+
+        :param float latency: The latency in seconds.
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket used to cap the number of requests per second.
+
+    :param float rate: The number of tokens added per second, 0 disables the cap.
+    :param float burst: The maximum number of tokens that may accumulate,
+                        defaults to the rate.
+    """
+
+    def __init__(self, rate: float = 0, burst: float = None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and consume it.
+
+        :return: None
+        :rtype: None
+        """
+        if self.rate <= 0:
+            return None
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return None
+
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """
+    Limit the number of in-flight requests using additive increase and
+    multiplicative decrease.
+
+    Every successful request that completes under the latency target grows the
+    limit by roughly one slot per window of requests, a server error or a slow
+    response cuts the limit by the decrease factor. At most one decrease is
+    applied per observed round trip so a burst of failures from the same window
+    does not collapse the limit to the minimum.
+
+    :param int initial: The starting concurrency limit.
+    :param int minimum: The lowest the limit may fall.
+    :param int maximum: The highest the limit may grow.
+    :param float latency_target: Responses slower than this (seconds) count as
+                                 congestion.
+    :param float decrease: The multiplicative decrease factor.
+    """
+
+    def __init__(self, initial: int = 2, minimum: int = 1, maximum: int = 8,
+                 latency_target: float = 2.0, decrease: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self._limit = float(max(minimum, min(initial, maximum)))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        """The current whole number concurrency limit."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """The number of requests currently holding a slot."""
+        return self._in_flight
+
+    def acquire(self):
+        """
+        Block until a slot is available under the current limit.
+
+        :return: None
+        :rtype: None
+        """
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency: float, error: bool):
+        """
+        Release a slot and adjust the limit based on the outcome.
+
+        :param float latency: How long the request took in seconds.
+        :param bool error: Whether the server signalled overload.
+        :return: None
+        :rtype: None
+        """
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+
+            if error or latency > self.latency_target:
+                if now - self._last_decrease >= latency:
+                    self._limit = max(self.minimum, self._limit * self.decrease)
+                    self._last_decrease = now
+                    logger.debug('Concurrency limit decreased to: %s',
+                                 self.limit)
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+            self._condition.notify_all()
+
+
+def run_concurrently(func, items, session: object = None, workers: int = None):
+    """
+    Apply func to every item using a pool of threads, yielding the results in
+    the order of the items.
+
+    Only a bounded window of items is submitted at any time so arbitrarily long
+    iterables can be consumed with constant memory.
+
+    :param func: A callable taking a single item.
+    :param items: An iterable of items.
+    :param object session: The requests session, used to size the pool when it
+                           is a ScheduledSession.
+    :param int workers: The number of threads, overrides the session.
+    :return: A generator of (item, result) tuples.
+    :rtype: generator
+    """
+    if workers is None:
+        limiter = getattr(session, 'limiter', None)
+        workers = limiter.maximum if limiter else 4
+
+    window = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            window.append((item, executor.submit(func, item)))
+
+            if len(window) >= workers * 2:
+                item, future = window.popleft()
+                yield item, future.result()
+
+        while window:
+            item, future = window.popleft()
+            yield item, future.result()
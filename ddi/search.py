@@ -0,0 +1,249 @@
+from array import array
+from ddi.utilites import app_path
+
+import collections
+import fnmatch
+import json
+import logging
+import mmap
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+MODES = ('fuzzy', 'glob', 'prefix', 'substring')
+
+
+def trigrams(text: str):
+    """
+    The distinct three character substrings of a string.
+
+    :param str text: The string.
+    :return: The trigrams.
+    :rtype: set
+    """
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class NameIndex:
+    """
+    A persisted trigram index over host names and aliases.
+
+    Entries are (key, host name, ip_id) where the key is the lower case FQDN
+    or alias. The trigram postings are stored as a flat array of entry
+    positions in a separate file that is memory mapped, so a search only
+    reads the postings of its trigrams. The entries and the offsets of each
+    trigram's postings are parsed from JSON on load, which takes time in
+    proportion to the number of entries. Entries added since the postings
+    were last built form a tail that is scanned directly, save() rebuilds the
+    postings once the tail grows large.
+
+    :param str path: The index file, defaults to search_index.json in the ddi
+                     application directory.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or app_path('search_index.json')
+        self.built = 0.0
+        self.entries = []
+        self.indexed = 0
+        self.max_id = 0
+        self._grams = {}
+        self._postings = None
+
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            logger.debug('No usable search index at: %s', self.path)
+            return None
+
+        self.built = state['built']
+        self.entries = state['entries']
+        self.max_id = state['max_id']
+
+        try:
+            with open(self.path + '.grams', 'rb') as f:
+                if os.fstat(f.fileno()).st_size == state['grams_size'] > 0:
+                    self._postings = mmap.mmap(f.fileno(), 0,
+                                               access=mmap.ACCESS_READ)
+                    self._grams = state['grams']
+                    self.indexed = state['indexed']
+        except OSError:
+            pass
+
+        logger.debug('Loaded %s search entries, %s indexed, from: %s',
+                     len(self.entries), self.indexed, self.path)
+
+    def add(self, hosts):
+        """
+        Add host records to the index.
+
+        :param hosts: An iterable of host records from ip_address_list.
+        :return: The number of hosts added.
+        :rtype: int
+        """
+        # Imported here as the CNAME commands depend on the host commands.
+        from ddi.cname import split_aliases
+
+        count = 0
+
+        for host in hosts:
+            name = host['name'].lower()
+            ip_id = int(host['ip_id'])
+            self.entries.append([name, name, ip_id])
+            self.entries.extend([alias, name, ip_id] for alias in
+                                split_aliases(host.get('ip_alias', '')))
+            self.max_id = max(self.max_id, ip_id)
+            count += 1
+
+        return count
+
+    def clear(self):
+        """
+        Remove every entry, ahead of a rebuild.
+
+        :return: None
+        :rtype: None
+        """
+        self.entries = []
+        self.indexed = 0
+        self.max_id = 0
+        self._grams = {}
+        self._postings = None
+
+    def save(self, compact: bool = False):
+        """
+        Write the index, rebuilding the trigram postings when the tail of
+        unindexed entries is large or compact is set.
+
+        :param bool compact: Rebuild the postings whatever the size of the
+                             tail, otherwise they are only rebuilt once the
+                             tail exceeds a tenth of the entries.
+        :return: None
+        :rtype: None
+        """
+        tail = len(self.entries) - self.indexed
+        compact = compact or tail > max(1000, len(self.entries) // 10)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        if compact:
+            self._write_postings()
+        else:
+            self.built = self.built or time.time()
+
+        state = {'built': self.built, 'entries': self.entries,
+                 'grams': self._grams, 'grams_size': len(self._postings or b''),
+                 'indexed': self.indexed, 'max_id': self.max_id}
+
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+        logger.debug('Saved %s search entries to: %s', len(self.entries),
+                     self.path)
+
+    def search(self, pattern: str, mode: str = 'prefix', limit: int = 50):
+        """
+        Find the entries matching a pattern.
+
+        :param str pattern: The pattern, matched case insensitively.
+        :param str mode: One of prefix, substring, glob or fuzzy.
+        :param int limit: The most matches to return.
+        :return: The matches, dictionaries with the matching key, host name,
+                 ip_id and for fuzzy searches the similarity score. Fuzzy
+                 matches are best first, the rest are sorted by key.
+        :rtype: list
+        """
+        pattern = pattern.lower()
+
+        if mode == 'fuzzy':
+            return self._fuzzy(pattern, limit)
+
+        if mode == 'glob':
+            regex = re.compile(fnmatch.translate(pattern))
+            literals = re.split(r'\[[^\]]*\]|[*?]', pattern)
+        elif mode == 'prefix':
+            regex = re.compile(re.escape(pattern))
+            literals = [pattern]
+        else:
+            regex = re.compile('.*' + re.escape(pattern))
+            literals = [pattern]
+
+        grams = set().union(*(trigrams(l) for l in literals))
+        if grams and self._postings is not None:
+            candidates = set.intersection(*(set(self._lookup(g))
+                                            for g in grams))
+        else:
+            candidates = range(self.indexed)
+
+        matches = [self.entries[i] for i in candidates
+                   if regex.match(self.entries[i][0])]
+        matches.extend(e for e in self.entries[self.indexed:]
+                       if regex.match(e[0]))
+        matches.sort()
+
+        return [{'ip_id': str(e[2]), 'key': e[0], 'name': e[1]}
+                for e in matches[:limit]]
+
+    def _fuzzy(self, pattern: str, limit: int):
+        grams = trigrams(pattern)
+        if not grams:
+            return self.search(pattern, mode='prefix', limit=limit)
+
+        hits = collections.Counter()
+        if self._postings is not None:
+            for g in grams:
+                hits.update(self._lookup(g))
+        for i in range(self.indexed, len(self.entries)):
+            common = len(grams & trigrams(self.entries[i][0]))
+            if common:
+                hits[i] = common
+
+        scored = []
+        for i, common in hits.items():
+            key = self.entries[i][0]
+            # The Dice coefficient of the two trigram sets.
+            score = 2 * common / (len(grams) + max(len(key) - 2, 1))
+            if score >= 0.3:
+                scored.append((-score, key, i))
+        scored.sort()
+
+        return [{'ip_id': str(self.entries[i][2]), 'key': key,
+                 'name': self.entries[i][1], 'score': round(-score, 3)}
+                for score, key, i in scored[:limit]]
+
+    def _lookup(self, gram: str):
+        if gram not in self._grams:
+            return array('I')
+        offset, count = self._grams[gram]
+        postings = array('I')
+        postings.frombytes(self._postings[offset * 4:(offset + count) * 4])
+        return postings
+
+    def _write_postings(self):
+        postings = collections.defaultdict(lambda: array('I'))
+        for i, entry in enumerate(self.entries):
+            for g in trigrams(entry[0]):
+                postings[g].append(i)
+
+        grams = {}
+        offset = 0
+        tmp = f'{self.path}.grams.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            for g in sorted(postings):
+                postings[g].tofile(f)
+                grams[g] = [offset, len(postings[g])]
+                offset += len(postings[g])
+        os.replace(tmp, self.path + '.grams')
+
+        with open(self.path + '.grams', 'rb') as f:
+            self._postings = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if offset else None
+
+        self._grams = grams
+        self.built = time.time()
+        self.indexed = len(self.entries)
@@ -0,0 +1,205 @@
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from ddi.scheduler import (AIMDLimiter, DeadlineExceeded, LatencyTracker,
+                           TokenBucket)
+
+import collections
+import json
+import logging
+import requests
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledSession(requests.Session):
+    """
+    A requests session that routes every request through a rate cap and an
+    AIMD concurrency limit.
+
+    Identical GETs made while one is already in flight share its response and
+    successful responses are memoized for the life of the session, so composed
+    operations repeating the same lookup only reach the server once. Any other
+    method clears the memo since it may have changed what the reads return.
+    Streamed and RPC requests are never memoized.
+
+    Every request is given a timeout, cut down to what remains of the
+    session's deadline if it has one. Those same GETs may be hedged: if the
+    server has not answered by the given percentile of recently observed
+    latencies an identical request is sent and whichever answers first is
+    used.
+
+    :param float rate: Maximum requests per second, 0 for unlimited.
+    :param int max_concurrency: The most requests allowed in flight at once.
+    :param float latency_target: Responses slower than this (seconds) reduce
+                                 concurrency.
+    :param bool memoize: Whether to keep GET responses for the life of the
+                         session, in flight requests are merged regardless.
+    :param int memo_size: The most responses kept.
+    :param float timeout: The timeout of each request in seconds, 0 for none.
+    :param float deadline: The seconds from now by which every request must
+                           be done, 0 for no deadline.
+    :param float hedge: The latency percentile after which a read is hedged,
+                        0 to never hedge.
+    """
+
+    # Keyword arguments that do not change what a GET returns.
+    MERGEABLE = {'allow_redirects', 'params', 'timeout'}
+
+    def __init__(self, rate: float = 0, max_concurrency: int = 8,
+                 latency_target: float = 2.0, memoize: bool = True,
+                 memo_size: int = 1024, timeout: float = 60,
+                 deadline: float = 0, hedge: float = 0):
+        super().__init__()
+        self.bucket = TokenBucket(rate)
+        self.limiter = AIMDLimiter(maximum=max_concurrency,
+                                   latency_target=latency_target)
+        self.memoize = memoize
+        self.memo_size = memo_size
+        self._memo = collections.OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self._memo_lock = threading.Lock()
+        self.timeout = timeout
+        self.deadline = time.monotonic() + deadline if deadline else None
+        self.hedge = hedge
+        self.latencies = LatencyTracker()
+        self._hedges = None
+
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def close(self):
+        if self._hedges:
+            self._hedges.shutdown(wait=False)
+        super().close()
+
+    def forget(self):
+        """
+        Drop every memoized response.
+
+        :return: None
+        :rtype: None
+        """
+        with self._memo_lock:
+            self._memo.clear()
+            self._generation += 1
+
+    def request(self, method, url, *args, **kwargs):
+        if method.upper() != 'GET':
+            self.forget()
+            return self._scheduled_request(method, url, *args, **kwargs)
+
+        if args or kwargs.get('stream') or set(kwargs) - self.MERGEABLE:
+            return self._scheduled_request(method, url, *args, **kwargs)
+
+        key = (url, json.dumps(kwargs.get('params'), sort_keys=True,
+                               default=str))
+
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                logger.debug('Memoized response for: %s', url)
+                return self._memo[key]
+
+            future = self._pending.get(key)
+            leader = future is None
+            if leader:
+                future = self._pending[key] = Future()
+                generation = self._generation
+
+        if not leader:
+            logger.debug('Merged with in flight request for: %s', url)
+            return future.result()
+
+        r = None
+        try:
+            r = self._hedged_request(method, url, **kwargs)
+            future.set_result(r)
+            return r
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._memo_lock:
+                del self._pending[key]
+                if r is not None and r.ok and self.memoize and \
+                        '/rpc/' not in url and \
+                        generation == self._generation:
+                    self._memo[key] = r
+                    while len(self._memo) > self.memo_size:
+                        self._memo.popitem(last=False)
+
+    def remaining(self):
+        """
+        The seconds left until the deadline.
+
+        :return: The remaining seconds, or None without a deadline.
+        :rtype: float
+        """
+        if self.deadline is None:
+            return None
+
+        return self.deadline - time.monotonic()
+
+    def _hedged_request(self, method, url, **kwargs):
+        delay = self.latencies.percentile(self.hedge) if self.hedge else None
+
+        if delay is None:
+            return self._scheduled_request(method, url, **kwargs)
+
+        if self._hedges is None:
+            self._hedges = ThreadPoolExecutor(
+                max_workers=self.limiter.maximum * 2)
+
+        first = self._hedges.submit(self._scheduled_request, method, url,
+                                    **kwargs)
+        if wait([first], timeout=delay).done:
+            return first.result()
+
+        logger.debug('Hedging request for: %s after %.3f seconds.', url, delay)
+
+        pending = {first, self._hedges.submit(self._scheduled_request, method,
+                                              url, **kwargs)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None or not pending:
+                    # The slower copy is of no use, release its connection.
+                    for p in pending:
+                        p.add_done_callback(
+                            lambda p: p.exception() or p.result().close())
+                    return f.result()
+
+    def _scheduled_request(self, method, url, *args, **kwargs):
+        self.limiter.acquire()
+        self.bucket.acquire()
+
+        start = time.monotonic()
+        error = True
+        try:
+            timeout = kwargs.get('timeout') or self.timeout or None
+            remaining = self.remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise DeadlineExceeded(f'Deadline passed before: {url}')
+                timeout = min(timeout, remaining) if timeout else remaining
+            kwargs['timeout'] = timeout
+
+            try:
+                r = super().request(method, url, *args, **kwargs)
+            except requests.exceptions.Timeout as e:
+                if remaining is not None and self.remaining() <= 0:
+                    raise DeadlineExceeded(f'Deadline passed during: {url}') \
+                        from e
+                raise
+
+            error = r.status_code >= 500 or r.status_code == 429
+            if method.upper() == 'GET' and not kwargs.get('stream') and \
+                    not error:
+                self.latencies.record(time.monotonic() - start)
+            return r
+        finally:
+            self.limiter.release(time.monotonic() - start, error)
@@ -0,0 +1,255 @@
+from ddi.cli import cli, offline
+from ddi.utilites import batched
+
+import click
+import heapq
+import itertools
+import json
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotOrderError(Exception):
+    pass
+
+
+def check_order(records, key: str):
+    """
+    Pass records through, checking that they are strictly sorted by key.
+
+    :param records: An iterable of records.
+    :param str key: The field the records are sorted by.
+    :return: A generator of the records.
+    :rtype: generator
+    :raises SnapshotOrderError: If the records are not sorted by key.
+    """
+    previous = None
+
+    for number, record in enumerate(records, 1):
+        value = sort_value(record, key)
+
+        if previous is not None and value <= previous:
+            raise SnapshotOrderError(f'Snapshot is not sorted by {key} at '
+                                     f'record {number}.')
+        previous = value
+
+        yield record
+
+
+def diff_groups(old: list, new: list, key: str, ignore: tuple = ()):
+    """
+    Compare the records of two snapshots that share a key value.
+
+    Keys other than ip_id need not be unique (e.g. two hosts with the same
+    name), records sharing one are matched up by ip_id.
+
+    :param list old: The records of the older snapshot.
+    :param list new: The records of the newer snapshot.
+    :param str key: The field the snapshots are joined on.
+    :param tuple ignore: Fields to leave out of the comparison.
+    :return: A generator of added, removed and changed events.
+    :rtype: generator
+    """
+    if len(old) == 1 and len(new) == 1:
+        pairs = [(old[0], new[0])]
+        old = new = []
+    else:
+        ids = {r.get('ip_id') for r in old} & {r.get('ip_id') for r in new}
+        matched = {r.get('ip_id'): r for r in new if r.get('ip_id') in ids}
+        pairs = [(r, matched[r.get('ip_id')]) for r in old
+                 if r.get('ip_id') in ids]
+        old = [r for r in old if r.get('ip_id') not in ids]
+        new = [r for r in new if r.get('ip_id') not in ids]
+
+    for record in old:
+        yield {'event': 'removed', 'key': record[key], 'record': record}
+
+    for o, n in pairs:
+        changes = diff_records(o, n, ignore=ignore)
+        if changes:
+            yield {'event': 'changed', 'key': n[key], 'name': n.get('name', ''),
+                   'changes': changes}
+
+    for record in new:
+        yield {'event': 'added', 'key': record[key], 'record': record}
+
+
+def diff_records(old: dict, new: dict, ignore: tuple = ()):
+    """
+    Compare two versions of a record field by field.
+
+    :param dict old: The old record.
+    :param dict new: The new record.
+    :param tuple ignore: Fields to leave out of the comparison.
+    :return: The changed fields mapped to their old and new values.
+    :rtype: dict
+    """
+    fields = (old.keys() | new.keys()) - set(ignore)
+
+    return {f: [old.get(f), new.get(f)] for f in sorted(fields)
+            if old.get(f) != new.get(f)}
+
+
+def diff_snapshots(old, new, key: str = 'ip_id', ignore: tuple = ()):
+    """
+    Merge join two snapshots in key order, yielding the differences.
+
+    Only the records sharing one key value are held at a time when joining,
+    see read_snapshot() for the cost of getting the snapshots in order.
+
+    :param old: The older snapshot, an iterable of NDJSON lines.
+    :param new: The newer snapshot, an iterable of NDJSON lines.
+    :param str key: The field the snapshots are joined on.
+    :param tuple ignore: Fields to leave out of the comparison.
+    :return: A generator of added, removed and changed events.
+    :rtype: generator
+    :raises SnapshotOrderError: If a snapshot joined on ip_id is not sorted
+                                by it.
+    """
+    old = read_snapshot(old, key)
+    new = read_snapshot(new, key)
+
+    o = next(old, None)
+    n = next(new, None)
+
+    while o is not None or n is not None:
+        if n is None or (o is not None and o[0] < n[0]):
+            yield from diff_groups(o[1], [], key)
+            o = next(old, None)
+        elif o is None or n[0] < o[0]:
+            yield from diff_groups([], n[1], key)
+            n = next(new, None)
+        else:
+            yield from diff_groups(o[1], n[1], key, ignore=ignore)
+            o = next(old, None)
+            n = next(new, None)
+
+
+def read_snapshot(lines, key: str):
+    """
+    Read an NDJSON snapshot in key order, grouping the records sharing a key
+    value.
+
+    ip_id keys are unique and compare numerically, the snapshot must already
+    be sorted by them and is streamed. Names and addresses are sorted here
+    instead as the order of the export follows the server's collation, which
+    need not match Python's, see sort_records().
+
+    :param lines: An iterable of NDJSON lines.
+    :param str key: The field to order by.
+    :return: A generator of (sort key, records) tuples.
+    :rtype: generator
+    :raises SnapshotOrderError: If the snapshot is not sorted by ip_id.
+    """
+    records = (json.loads(line) for line in lines if line.strip())
+
+    if key == 'ip_id':
+        records = check_order(records, key)
+    else:
+        records = sort_records(records, key)
+
+    for sort_key, group in itertools.groupby(
+            records, key=lambda r: sort_value(r, key)):
+        yield sort_key, list(group)
+
+
+def sort_records(records, key: str, run_size: int = 100000):
+    """
+    Sort records by key in bounded memory.
+
+    Records are sorted in runs of run_size, if there is more than one run
+    each is spilled to a temporary file and the runs are merged.
+
+    :param records: An iterable of records.
+    :param str key: The field to sort by.
+    :param int run_size: The most records held in memory.
+    :return: A generator of the records in key order.
+    :rtype: generator
+    """
+    runs = []
+
+    def value(r):
+        return sort_value(r, key)
+
+    try:
+        for batch in batched(records, run_size):
+            batch.sort(key=value)
+
+            if not runs and len(batch) < run_size:
+                # Everything fits in a single run.
+                yield from batch
+                return None
+
+            run = tempfile.TemporaryFile('w+')
+            run.writelines(json.dumps(r) + '\n' for r in batch)
+            run.seek(0)
+            runs.append(run)
+
+        logger.debug('Merging %s sorted runs of the snapshot.', len(runs))
+
+        yield from heapq.merge(*((json.loads(line) for line in run)
+                                 for run in runs), key=value)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def sort_value(record: dict, key: str):
+    """
+    The value a record is ordered by.
+
+    :param dict record: The record.
+    :param str key: The field to order by.
+    :return: The integer ip_id or the lower case value of other fields.
+    """
+    value = record.get(key, '')
+
+    return int(value) if key == 'ip_id' else str(value).lower()
+
+
+@cli.group()
+@click.pass_context
+def snapshot(ctx):
+    """IPAM snapshot commands."""
+    pass
+
+
+@offline
+@snapshot.command()
+@click.option('--ignore', '-i', multiple=True,
+              help='A field to leave out of the comparison, may be given more '
+                   'than once.')
+@click.option('--key', '-k', default='ip_id',
+              type=click.Choice(['ip_addr', 'ip_id', 'name']),
+              help='The field the snapshots are sorted and joined on.',
+              show_default=True)
+@click.argument('old', type=click.File('r'))
+@click.argument('new', type=click.File('r'))
+@click.pass_context
+def diff(ctx, ignore, key, old, new):
+    """
+    Show what changed between two snapshots.
+
+    The snapshots are NDJSON files as written by 'ddi host export'. Joined
+    on ip_id they must be sorted by it ('--order-by ip_id') and are streamed,
+    joined on name or ip_addr they are sorted here, spilling to temporary
+    files when large. Hosts sharing a name or address are matched by ip_id.
+    Events are written as NDJSON with --json. The server is not contacted.
+    """
+
+    try:
+        for event in diff_snapshots(old, new, key=key, ignore=ignore):
+            if ctx.obj['json']:
+                click.echo(json.dumps(event, sort_keys=True))
+            elif event['event'] == 'added':
+                click.echo(f"+ {event['key']} {event['record'].get('name', '')}")
+            elif event['event'] == 'removed':
+                click.echo(f"- {event['key']} {event['record'].get('name', '')}")
+            else:
+                click.echo(f"~ {event['key']} {event['name']}")
+                for field, (was, now) in event['changes'].items():
+                    click.echo(f"    {field}: {was!r} -> {now!r}")
+    except SnapshotOrderError as e:
+        raise click.ClickException(str(e))
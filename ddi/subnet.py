@@ -1,14 +1,59 @@
 from ddi.cli import cli
-from ddi.utilites import echo_host_info, get_exceptions, hexlify_address
+from ddi.targets import query_targets
+from ddi.utilites import (ResultError, cidr_to_hex_range, echo_lookups,
+                          get_exceptions, get_paged_results, hexlify_address,
+                          read_targets, stream_lookups, unhexlify_address)
 
 import click
+import functools
+import itertools
 import jsend
 import json
 import logging
+import netaddr
 
 logger = logging.getLogger(__name__)
 
 
+def echo_subnet_info(subnet_info: dict):
+    """
+    Echo out subnet info.
+
+    :param dict subnet_info: A JSEND success object.
+    :return: None
+    :rtype: None
+    """
+    for s in subnet_info['data']['results']:
+        if 'ddi_target' in s:
+            click.echo(f"Server: {s['ddi_target']}")
+        click.echo(f"Subnet Name: {s['subnet_name']}")
+        click.echo(f"Subnet ID: {s['subnet_id']}")
+        click.echo(f"Subnet Size: {s['subnet_size']}")
+        click.echo(f"Subnet Percent Used: {s['subnet_used_percent']}")
+
+    return None
+
+
+def get_subnet_batch(subnets: list, session: object, url: str):
+    """
+    Get information about a batch of subnets in a single query.
+
+    :param list subnets: The subnet IDs (e.g. 192.168.127.0).
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The subnet records found.
+    :rtype: list
+    """
+    logger.debug('Getting subnet info for a batch of %s subnets.',
+                 len(subnets))
+
+    payload = {'WHERE': ' OR '.join(
+        f"start_ip_addr='{hexlify_address(s).decode()}'" for s in subnets)}
+
+    return list(get_paged_results('rest/ip_block_subnet_list', payload,
+                                  session, url))
+
+
 def get_subnet_info(subnet: str, session:object, url:str):
     """
     Get information about a given subnet.
@@ -32,6 +77,61 @@ def get_subnet_info(subnet: str, session:object, url:str):
     return result
 
 
+def list_subnets(session: object, url: str, site: str = None,
+                 block: str = None):
+    """
+    Page through every terminal subnet, optionally limited to a site and/or
+    a block.
+
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param str site: The optional site name (e.g. UCB).
+    :param str block: The optional block CIDR the subnets must be within.
+    :return: A generator of subnet records ordered by start address.
+    :rtype: generator
+    """
+    logger.debug('Listing subnets for site: %s within block: %s', site, block)
+
+    clauses = ["is_terminal='1'"]
+
+    if site:
+        clauses.append(f"site_name='{site}'")
+    if block:
+        start, end = cidr_to_hex_range(block)
+        clauses.append(f"start_ip_addr>='{start}' AND end_ip_addr<='{end}'")
+
+    payload = {'WHERE': ' AND '.join(clauses), 'ORDERBY': 'start_ip_addr'}
+
+    yield from get_paged_results('rest/ip_block_subnet_list', payload,
+                                 session, url)
+
+
+def subnet_usage(subnet: dict):
+    """
+    Compute the utilization of a subnet from its record.
+
+    :param dict subnet: A subnet record from ip_block_subnet_list.
+    :return: The subnet's name, CIDR, size, used and free address counts and
+             the used percentage.
+    :rtype: dict
+    """
+    start = netaddr.IPAddress(int(subnet['start_ip_addr'], 16))
+    end = netaddr.IPAddress(int(subnet['end_ip_addr'], 16))
+
+    used = int(subnet.get('subnet_ip_used_size') or 0)
+    free = int(subnet.get('subnet_ip_free_size') or 0)
+    usable = used + free
+
+    return {'cidr': str(netaddr.iprange_to_cidrs(start, end)[0]),
+            'free': free,
+            'site_name': subnet.get('site_name', ''),
+            'size': int(subnet.get('subnet_size') or 0),
+            'subnet_id': subnet['subnet_id'],
+            'subnet_name': subnet.get('subnet_name', ''),
+            'used': used,
+            'used_percent': round(100 * used / usable, 1) if usable else 0.0}
+
+
 @cli.group()
 @click.pass_context
 def subnet(ctx):
@@ -40,23 +140,112 @@ def subnet(ctx):
 
 
 @subnet.command()
+@click.option('--from-file', type=click.File('r'),
+              help='Also look up the subnets listed one per line in the file, '
+                   '- for stdin.')
 @click.argument('subnets', envvar='DDI_SUBNET_INFO_SUBNETS', nargs=-1)
 @click.pass_context
-def info(ctx, subnets):
-    """Provide the DDI info on the given subnet(s)."""
+def info(ctx, from_file, subnets):
+    """
+    Provide the DDI info on the given subnet(s).
+
+    Subnets read with --from-file are streamed through batched concurrent
+    queries and answered as they arrive, one line of JSON each with --json.
+    """
 
     logger.debug('Info operation called on subnets: %s.', subnets)
 
+    if from_file:
+        echo_lookups(ctx, stream_lookups(
+            itertools.chain(subnets, read_targets(from_file)),
+            get_subnet_batch, lambda s: unhexlify_address(s['start_ip_addr']),
+            ctx.obj['session'], ctx.obj['url']), echo_subnet_info)
+        return None
+
     for subnet in subnets:
-        r = get_subnet_info(subnet, ctx.obj['session'], ctx.obj['url'])
+        r = query_targets(ctx, functools.partial(get_subnet_info, subnet))
         if ctx.obj['json']:
             click.echo(json.dumps(r, indent=2, sort_keys=True))
         elif jsend.is_success(r):
-            s = r['data']['results'][0]
-            click.echo(f"Subnet Name: {s['subnet_name']}")
-            click.echo(f"Subnet ID: {s['subnet_id']}")
-            click.echo(f"Subnet Size: {s['subnet_size']}")
-            click.echo(f"Subnet Percent Used: {s['subnet_used_percent']}")
+            echo_subnet_info(r)
         else:
             click.echo('Request failed, enable debugging for more.')
             ctx.exit(1)
+
+
+@subnet.command(name='list')
+@click.option('--block', '-b', help='Only subnets within this block CIDR.')
+@click.option('--format', '-f', 'format_', default='table',
+              type=click.Choice(['ndjson', 'table']),
+              help='The output format.', show_default=True)
+@click.option('--max-used', type=click.FloatRange(0, 100),
+              help='Only subnets at most this percent used.')
+@click.option('--min-used', type=click.FloatRange(0, 100),
+              help='Only subnets at least this percent used.')
+@click.option('--site', help='Only subnets in this site.')
+@click.option('--sort', type=click.Choice(['cidr', 'free', 'used_percent']),
+              help='Sort the subnets, by default they are streamed in address '
+                   'order.')
+@click.pass_context
+def list_(ctx, block, format_, max_used, min_used, site, sort):
+    """
+    List the utilization of every subnet.
+
+    All subnets are fetched in a few large paged queries and the used and free
+    address counts are computed locally. Fullest subnets come first when
+    sorting by used_percent, subnets with the most free addresses first when
+    sorting by free. With --profile the subnets of every server are listed.
+    """
+
+    def fetch(session, url):
+        return jsend.success({'results': list(list_subnets(
+            session, url, site=site, block=block))})
+
+    def records():
+        if not ctx.obj.get('targets'):
+            yield from list_subnets(ctx.obj['session'], ctx.obj['url'],
+                                    site=site, block=block)
+            return None
+
+        r = query_targets(ctx, fetch)
+        if not jsend.is_success(r):
+            raise ResultError(r)
+        yield from r['data']['results']
+
+    def usage():
+        for s in records():
+            u = subnet_usage(s)
+            if 'ddi_target' in s:
+                u['ddi_target'] = s['ddi_target']
+            if min_used is not None and u['used_percent'] < min_used:
+                continue
+            if max_used is not None and u['used_percent'] > max_used:
+                continue
+            yield u
+
+    subnets = usage()
+
+    try:
+        if sort or ctx.obj['json']:
+            subnets = list(subnets)
+        if sort:
+            subnets.sort(key=lambda u: netaddr.IPNetwork(u[sort]) if
+                         sort == 'cidr' else u[sort], reverse=sort != 'cidr')
+
+        if ctx.obj['json']:
+            r = jsend.success({'results': subnets})
+            click.echo(json.dumps(r, indent=2, sort_keys=True))
+        elif format_ == 'ndjson':
+            for u in subnets:
+                click.echo(json.dumps(u, sort_keys=True))
+        else:
+            click.echo(f"{'CIDR':<18} {'Name':<24} {'Site':<10} {'Size':>8} "
+                       f"{'Used':>8} {'Free':>8} {'Used%':>6}")
+            for u in subnets:
+                click.echo(f"{u['cidr']:<18} {u['subnet_name']:<24} "
+                           f"{u['site_name']:<10} {u['size']:>8} "
+                           f"{u['used']:>8} {u['free']:>8} "
+                           f"{u['used_percent']:>6}")
+    except ResultError:
+        click.echo('Request failed, enable debugging for more.', err=True)
+        ctx.exit(1)
@@ -0,0 +1,477 @@
+from ddi.cli import cli
+from ddi.cname import add_alias, delete_alias, split_aliases
+from ddi.host import delete_host_by_id, get_hosts, put_host
+from ddi.ipv4 import pick_free_subnet
+from ddi.journal import Journal, journal_path
+from ddi.pool import FreeAddressPool, PoolEmptyError
+from ddi.scheduler import run_concurrently
+from ddi.utilites import HostRecord, ResultError
+
+import click
+import hashlib
+import jsend
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def apply_changes(changes: list, session: object, url: str,
+                  site_name: str = 'UCB', journal: Journal = None):
+    """
+    Carry out a change set produced by plan_changes().
+
+    Deletions run first, then host additions and updates, then alias
+    additions (including the aliases of newly added hosts). Each phase runs
+    concurrently, the free addresses of new hosts are assigned beforehand by
+    assign_addresses().
+
+    :param list changes: The change set.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param str site_name: The site name new hosts are added to.
+    :param Journal journal: The optional journal successful changes are
+                            recorded in, changes it already holds are not
+                            carried out again and keep their recorded result.
+    :return: The changes, each with the JSEND result of carrying it out.
+    :rtype: list
+    """
+
+    def run(change):
+        if journal is None:
+            return carry_out(change)
+
+        key = change_key(change)
+        if key in journal:
+            return journal.done[key]
+
+        r = carry_out(change)
+        if jsend.is_success(r):
+            journal.record(key, r)
+
+        return r
+
+    def carry_out(change):
+        action = change['action']
+
+        if action == 'add_host':
+            ip = change.get('ip') or assigned.get(change['name'])
+            if not ip:
+                return jsend.fail({'results': []})
+
+            return put_host(change['name'], ip, change['parameters'], session,
+                            url, site_name=site_name)
+        elif action == 'update_host':
+            return put_host(change['name'], change['ip'],
+                            change['parameters'], session, url,
+                            site_name=site_name, ip_id=change['ip_id'])
+        elif action == 'delete_host':
+            return delete_host_by_id(change['ip_id'], session, url)
+        elif action == 'add_alias':
+            return add_alias(change['ip_id'], change['alias'], session, url)
+        elif action == 'delete_alias':
+            return delete_alias(change['ip_id'], change['alias'], session, url)
+
+    def phase(actions):
+        batch = [c for c in changes if c['action'] in actions]
+        return [dict(change, result=r) for change, r in
+                run_concurrently(run, batch, session=session)]
+
+    applied = phase(('delete_alias', 'delete_host'))
+
+    assigned = assign_addresses(
+        [c for c in changes if c['action'] == 'add_host' and not c.get('ip')
+         and not (journal and change_key(c) in journal)], session, url)
+
+    added = phase(('add_host', 'update_host'))
+    applied.extend(added)
+
+    aliases = [c for c in changes if c['action'] == 'add_alias']
+    for change in added:
+        if change['action'] == 'add_host' and \
+                jsend.is_success(change['result']):
+            ip_id = change['result']['data']['results'][0]['ret_oid']
+            aliases.extend({'action': 'add_alias', 'name': change['name'],
+                            'ip_id': ip_id, 'alias': alias}
+                           for alias in change.get('aliases', []))
+
+    applied.extend(dict(change, result=r) for change, r in
+                   run_concurrently(run, aliases, session=session))
+
+    return applied
+
+
+def assign_addresses(adds: list, session: object, url: str,
+                     timeout: float = 10):
+    """
+    Pick a free address for each host addition that only names subnets.
+
+    The additions run concurrently, if each looked for a free address itself
+    they would all be offered the same first free address of a subnet. The
+    addresses are instead taken one after another from a FreeAddressPool,
+    which never hands out an address twice. Of several subnets the one
+    pick_free_subnet() chooses is used first, falling back to the others in
+    order once it runs dry.
+
+    :param list adds: The add_host changes without an ip.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param float timeout: The longest to wait for a subnet's free address.
+    :return: The address of each addition keyed by host name, additions for
+             which no free address was found are left out.
+    :rtype: dict
+    """
+    assigned = {}
+    dry = set()
+    preferred = {}
+
+    if not adds:
+        return assigned
+
+    with FreeAddressPool(session, url, size=min(len(adds), 20)) as pool:
+        for change in adds:
+            subnets = tuple(change['subnets'])
+            if subnets not in preferred:
+                preferred[subnets] = subnets[0] if len(subnets) == 1 else \
+                    pick_free_subnet(list(subnets), session, url)[0]
+
+            order = [preferred[subnets]] if preferred[subnets] else []
+            order.extend(s for s in subnets if s != preferred[subnets])
+
+            for subnet in order:
+                if subnet in dry:
+                    continue
+                try:
+                    assigned[change['name']] = pool.take(subnet,
+                                                         timeout=timeout)
+                    break
+                except PoolEmptyError:
+                    logger.debug('No free address left in subnet: %s', subnet)
+                    dry.add(subnet)
+
+    return assigned
+
+
+def change_key(change: dict):
+    """
+    A key identifying a change within its change set.
+
+    :param dict change: The change.
+    :return: The key.
+    :rtype: str
+    """
+    return ' '.join(filter(None, (change['action'], change['name'],
+                                  change.get('alias'))))
+
+
+def echo_changes(changes: list):
+    """
+    Echo a change set in a human readable form.
+
+    :param list changes: The change set.
+    :return: None
+    :rtype: None
+    """
+    for change in changes:
+        action = change['action']
+        name = change['name']
+
+        if action == 'add_host':
+            where = change.get('ip') or ', '.join(change['subnets'])
+            click.echo(f'+ host {name} ({where})')
+            for alias in change['aliases']:
+                click.echo(f'+ alias {alias} -> {name}')
+        elif action == 'update_host':
+            for k, v in change['current'].items():
+                click.echo(f"~ host {name} {k}: '{v}' -> "
+                           f"'{change['parameters'][k]}'")
+        elif action == 'delete_host':
+            click.echo(f'- host {name}')
+        elif action == 'add_alias':
+            click.echo(f"+ alias {change['alias']} -> {name}")
+        elif action == 'delete_alias':
+            click.echo(f"- alias {change['alias']} -> {name}")
+
+    click.echo(f'{len(changes)} change(s).')
+
+
+def load_desired_state(path: str):
+    """
+    Load a desired state file.
+
+    The file lists hosts by FQDN with either an ip or a subnet (or list of
+    subnets) to pick a free address from, their ip_class_parameters and
+    optionally their aliases, e.g.:
+
+        site_name: UCB
+        hosts:
+          - name: web1.example.com
+            ip: 172.23.23.4
+            parameters:
+              ucb_buildings: SEEL
+              ucb_dept_aff: TEST
+              ucb_resp_per: Test User
+            aliases:
+              - www.example.com
+          - name: old.example.com
+            state: absent
+
+    Aliases are only managed for hosts that list them.
+
+    :param str path: The YAML file.
+    :return: The desired state.
+    :rtype: dict
+    """
+    import yaml
+
+    with open(path) as f:
+        state = yaml.safe_load(f) or {}
+
+    state.setdefault('hosts', [])
+    state.setdefault('site_name', 'UCB')
+
+    return state
+
+
+def plan_changes(desired: dict, session: object, url: str):
+    """
+    Compute the minimal set of changes bringing DDI in line with the desired
+    state.
+
+    The current state of every referenced host is fetched in batched queries.
+    A host whose address must change is planned as a deletion followed by an
+    addition.
+
+    :param dict desired: The desired state as returned by load_desired_state().
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: The change set, a list of changes each with an action of
+             add_host, update_host, delete_host, add_alias or delete_alias.
+    :rtype: list
+    :raises ResultError: If the current state could not be fetched.
+    """
+    hosts = desired['hosts']
+
+    current = {}
+    for entry in get_hosts((h['name'] for h in hosts), session, url):
+        current[entry['name'].lower()] = entry
+
+    logger.debug('Planning %s desired hosts, %s currently exist.', len(hosts),
+                 len(current))
+
+    changes = []
+
+    for host in hosts:
+        name = host['name']
+        entry = current.get(name.lower())
+        parameters = {k: str(v) for k, v in
+                      (host.get('parameters') or {}).items()}
+        aliases = [a.lower() for a in host.get('aliases') or []]
+
+        if host.get('state', 'present') == 'absent':
+            if entry:
+                changes.append({'action': 'delete_host', 'name': name,
+                                'ip_id': entry['ip_id']})
+            continue
+
+        add = {'action': 'add_host', 'name': name, 'parameters': parameters,
+               'aliases': aliases}
+        if host.get('ip'):
+            add['ip'] = host['ip']
+        else:
+            subnets = host.get('subnet') or []
+            add['subnets'] = [subnets] if isinstance(subnets, str) else subnets
+
+        if not entry:
+            changes.append(add)
+            continue
+
+        record = HostRecord.from_dict(entry)
+
+        moved = (host.get('ip') and host['ip'] != record.address) or \
+            (not host.get('ip') and add['subnets'] and
+             str(record.subnet.network) not in add['subnets'])
+
+        if moved:
+            changes.append({'action': 'delete_host', 'name': name,
+                            'ip_id': record.ip_id})
+            changes.append(add)
+            continue
+
+        changed = {k: v for k, v in parameters.items()
+                   if record.parameter(k) != v}
+        if changed:
+            changes.append({'action': 'update_host', 'name': name,
+                            'ip_id': record.ip_id, 'ip': record.address,
+                            'parameters': parameters,
+                            'current': {k: record.parameter(k)
+                                        for k in changed}})
+
+        if 'aliases' in host:
+            existing = split_aliases(record.ip_alias)
+            changes.extend({'action': 'add_alias', 'name': name,
+                            'ip_id': record.ip_id, 'alias': alias}
+                           for alias in aliases if alias not in existing)
+            changes.extend({'action': 'delete_alias', 'name': name,
+                            'ip_id': record.ip_id, 'alias': alias}
+                           for alias in existing if alias not in aliases)
+
+    return changes
+
+
+def plan_or_exit(ctx, file: str):
+    """
+    Load the desired state and plan the changes, exiting on failure.
+
+    :param object ctx: The ctx object from click.
+    :param str file: The desired state file.
+    :return: The desired state and the change set.
+    :rtype: tuple
+    """
+    desired = load_desired_state(file)
+
+    try:
+        changes = plan_changes(desired, ctx.obj['session'], ctx.obj['url'])
+    except ResultError as e:
+        if ctx.obj['json']:
+            click.echo(json.dumps(e.result, indent=2, sort_keys=True))
+        else:
+            click.echo('Request failed, enable debugging for more.')
+        ctx.exit(1)
+
+    return desired, changes
+
+
+@cli.command()
+@click.argument('file', envvar='DDI_PLAN_FILE',
+                type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def plan(ctx, file):
+    """
+    Show the changes needed to bring DDI in line with a desired state file.
+
+    See 'ddi apply' for the file format. With --json the change set is
+    written in a machine readable form.
+    """
+
+    desired, changes = plan_or_exit(ctx, file)
+
+    if ctx.obj['json']:
+        r = jsend.success({'results': changes})
+        click.echo(json.dumps(r, indent=2, sort_keys=True))
+    else:
+        echo_changes(changes)
+
+
+@cli.command(name='apply')
+@click.option('--resume', is_flag=True,
+              help='Continue an interrupted apply of the same file, skipping '
+                   'the changes already made.')
+@click.option('--yes', is_flag=True, help='Confirm the action without prompting.')
+@click.argument('file', envvar='DDI_APPLY_FILE',
+                type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def apply_(ctx, resume, yes, file):
+    """
+    Bring DDI in line with a desired state file.
+
+    The file is YAML listing hosts by name, for example:
+
+    \b
+        site_name: UCB
+        hosts:
+          - name: web1.example.com
+            ip: 172.23.23.4          # or subnet: 172.23.23.0
+            parameters:
+              ucb_buildings: SEEL
+              ucb_dept_aff: TEST
+              ucb_ph_no: 555-1212
+              ucb_resp_per: Test User
+            aliases:
+              - www.example.com
+          - name: old.example.com
+            state: absent
+
+    Only the changes shown by 'ddi plan' are made, concurrently.
+
+    The plan and every change made are journaled. If an apply is interrupted
+    or some changes fail, run it again with --resume to carry out the rest of
+    the original plan without planning again.
+    """
+
+    with open(file, 'rb') as f:
+        digest = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    journal = Journal(journal_path('apply', ctx.obj['url'],
+                                   os.path.abspath(file), digest),
+                      resume=resume)
+
+    fresh = journal.plan is None
+
+    if fresh:
+        desired, changes = plan_or_exit(ctx, file)
+        site_name = desired['site_name']
+    else:
+        changes = journal.plan['changes']
+        site_name = journal.plan['site_name']
+
+    remaining = [c for c in changes if change_key(c) not in journal]
+
+    if not remaining:
+        journal.remove()
+        if ctx.obj['json']:
+            click.echo(json.dumps(jsend.success({'results': []}), indent=2,
+                                  sort_keys=True))
+        else:
+            click.echo('No changes.')
+        return None
+
+    if not ctx.obj['json']:
+        echo_changes(remaining)
+        if len(remaining) < len(changes):
+            click.echo(f'{len(changes) - len(remaining)} change(s) already '
+                       'applied.')
+
+    if not yes:
+        try:
+            click.confirm(f'Apply {len(remaining)} change(s)?', abort=True)
+        except click.Abort:
+            # A declined run leaves nothing to resume.
+            if fresh:
+                journal.remove()
+            else:
+                journal.close()
+            raise
+
+    if fresh:
+        journal.start({'changes': changes, 'site_name': site_name})
+
+    with journal:
+        try:
+            applied = apply_changes(changes, ctx.obj['session'],
+                                    ctx.obj['url'], site_name=site_name,
+                                    journal=journal)
+        except KeyboardInterrupt:
+            left = sum(change_key(c) not in journal for c in changes)
+            click.echo(f'\nInterrupted, {left} change(s) left to apply, '
+                       'continue with --resume.', err=True)
+            raise
+
+    failures = [c for c in applied if not jsend.is_success(c['result'])]
+
+    if ctx.obj['json']:
+        summary = jsend.fail if failures else jsend.success
+        click.echo(json.dumps(summary({'results': applied}), indent=2,
+                              sort_keys=True))
+    else:
+        click.echo(f'Applied {len(applied) - len(failures)} of {len(applied)} '
+                   'change(s).')
+        for change in failures:
+            click.echo(f"{change['action']} of {change['name']} failed.")
+
+    if failures:
+        click.echo(f'{len(failures)} change(s) left to apply, retry them with '
+                   '--resume.', err=True)
+        ctx.exit(1)
+
+    journal.remove()
@@ -0,0 +1,204 @@
+from array import array
+from ddi.utilites import HostRecord, app_path
+
+import bisect
+import logging
+import mmap
+import os
+import socket
+import struct
+import sys
+
+logger = logging.getLogger(__name__)
+
+# The fields kept for every address, in the order they are stored.
+FIELDS = ('name', 'subnet', 'ucb_buildings', 'ucb_dept_aff', 'ucb_resp_per')
+
+# Magic, version, number of addresses.
+HEADER = struct.Struct('<4sII')
+MAGIC = b'DDIT'
+VERSION = 1
+
+
+class AddressTableError(Exception):
+    pass
+
+
+class AddressTable:
+    """
+    A read only, memory mapped table of the used IPv4 addresses.
+
+    The file holds a header, the sorted addresses as little endian uint32s,
+    count + 1 uint32 offsets into the string table and the string table,
+    where each address has the tab separated FIELDS. Nothing is read up
+    front, the pages touched by lookups are shared through the page cache
+    with every other process using the same table.
+
+    :param str path: The table file, defaults to address_table in the ddi
+                     application directory.
+    :raises AddressTableError: If the file is not an address table or is
+                               truncated.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or table_path()
+
+        with open(self.path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file can not be mapped.
+                raise AddressTableError(f'Empty address table: {self.path}')
+
+        if len(self._map) < HEADER.size:
+            self._map.close()
+            raise AddressTableError(f'Not an address table: {self.path}')
+
+        magic, version, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise AddressTableError(f'Not an address table: {self.path}')
+
+        start = HEADER.size
+        end = start + 4 * self.count
+
+        # The last offset is the length of the string table.
+        strings = end + 4 * (self.count + 1)
+        if len(self._map) < strings or len(self._map) < strings + \
+                struct.unpack_from('<I', self._map, strings - 4)[0]:
+            self._map.close()
+            raise AddressTableError(f'Truncated address table: {self.path}')
+
+        view = memoryview(self._map)
+
+        if sys.byteorder == 'little':
+            self.addresses = view[start:end].cast('I')
+            self.offsets = view[end:end + 4 * (self.count + 1)].cast('I')
+        else:
+            # Only big endian platforms pay for a copy.
+            self.addresses = array('I', view[start:end])
+            self.offsets = array('I', view[end:end + 4 * (self.count + 1)])
+            self.addresses.byteswap()
+            self.offsets.byteswap()
+
+        self._strings = strings
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Unmap the table.
+
+        :return: None
+        :rtype: None
+        """
+        if isinstance(self.addresses, memoryview):
+            self.addresses.release()
+            self.offsets.release()
+        self._map.close()
+
+    def lookup(self, address: int):
+        """
+        Find the fields stored for an address.
+
+        :param int address: The IPv4 address as an integer.
+        :return: The raw tab separated FIELDS, or None if the address is not
+                 in the table.
+        :rtype: bytes
+        """
+        i = bisect.bisect_left(self.addresses, address)
+
+        if i == self.count or self.addresses[i] != address:
+            return None
+
+        return self._map[self._strings + self.offsets[i]:
+                         self._strings + self.offsets[i + 1]]
+
+
+def parse_address(text):
+    """
+    Convert a dotted quad to an integer.
+
+    :param text: The address as str or bytes.
+    :return: The address, or None if it is not a dotted quad.
+    :rtype: int
+    """
+    if isinstance(text, bytes):
+        text = text.decode('ascii', 'replace')
+
+    # inet_aton also accepts the short forms (e.g. 10.1), which never appear
+    # in logs as addresses.
+    if text.count('.') != 3:
+        return None
+
+    try:
+        return int.from_bytes(socket.inet_aton(text), 'big')
+    except OSError:
+        return None
+
+
+def table_path():
+    """
+    The default location of the address table.
+
+    :return: The path of the table file.
+    :rtype: str
+    """
+    return app_path('address_table')
+
+
+def write_table(hosts, path: str = None):
+    """
+    Write an address table from host records.
+
+    :param hosts: An iterable of host records from ip_address_list.
+    :param str path: The table file, defaults to table_path().
+    :return: The number of addresses written.
+    :rtype: int
+    """
+    path = path or table_path()
+
+    rows = {}
+    subnets = {}
+
+    for entry in hosts:
+        host = HostRecord.from_dict(entry)
+
+        # Many hosts share a subnet, only work out each CIDR once.
+        span = (host.subnet_start_ip_addr, host.subnet_end_ip_addr)
+        if span not in subnets:
+            subnets[span] = str(host.subnet)
+
+        values = [host.name, subnets[span]]
+        values.extend(host.parameter(f) for f in FIELDS[2:])
+        rows.setdefault(host.ip_addr, '\t'.join(
+            v.replace('\t', ' ') for v in values).encode())
+
+    addresses = array('I', sorted(rows))
+    offsets = array('I', [0])
+    strings = bytearray()
+
+    for address in addresses:
+        strings += rows[address]
+        offsets.append(len(strings))
+
+    if sys.byteorder != 'little':
+        addresses.byteswap()
+        offsets.byteswap()
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(addresses)))
+        addresses.tofile(f)
+        offsets.tofile(f)
+        f.write(strings)
+    os.replace(tmp, path)
+
+    logger.debug('Wrote %s addresses to: %s', len(addresses), path)
+
+    return len(addresses)
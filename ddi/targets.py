@@ -0,0 +1,156 @@
+from ddi.utilites import app_path, is_not_found
+
+import jsend
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def fan_out(func, targets: list, timeout: float = 30):
+    """
+    Run a query against several targets concurrently.
+
+    Every target gets the same timeout, a target that does not answer in time
+    is reported as failed without holding up the others.
+
+    :param func: A callable taking a session and a URL and returning a JSEND
+                 result.
+    :param list targets: The targets, dictionaries with a name, session and
+                         url. Several targets may share a server (and so a
+                         url) when they differ in site.
+    :param float timeout: The number of seconds to wait for each target.
+    :return: The (target, result) tuples in the order of the targets.
+    :rtype: list
+    """
+    # Keyed by position, as neither the url nor the name need be unique.
+    results = {}
+
+    def run(i, target):
+        try:
+            results[i] = func(target['session'], target['url'])
+        except Exception as e:
+            logger.debug('Target: %s failed: %s', target['name'], e)
+            results[i] = jsend.error(str(e))
+
+    # Daemon threads so a hung target can not keep the process alive.
+    threads = [threading.Thread(target=run, args=(i, t), daemon=True)
+               for i, t in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+
+    # The targets run in parallel, so they all share one deadline.
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+
+    for i, target in enumerate(targets):
+        if i not in results:
+            logger.debug('Target: %s timed out after %s seconds.',
+                         target['name'], timeout)
+
+    return [(t, results.get(i, jsend.error('Timed out.')))
+            for i, t in enumerate(targets)]
+
+
+def load_profiles(path: str = None):
+    """
+    Load the multi target profiles.
+
+    The file maps each profile name to a list of server and site pairs, e.g.:
+
+        campus:
+          - server: https://ddi1.example.com
+            site: UCB
+          - server: https://ddi2.example.com
+            site: DEN
+
+    :param str path: The YAML file, defaults to profiles.yaml in the ddi
+                     application directory.
+    :return: The profiles.
+    :rtype: dict
+    """
+    import yaml
+
+    path = path or app_path('profiles.yaml')
+
+    try:
+        with open(path) as f:
+            return yaml.safe_load(f) or {}
+    except OSError:
+        logger.debug('No profiles at: %s', path)
+        return {}
+
+
+def merge_results(pairs: list):
+    """
+    Merge the results of a fan out into a single JSEND result.
+
+    Every record is tagged with the name of the target it came from in
+    ddi_target and records from a site other than the target's are dropped.
+
+    :param list pairs: The (target, result) tuples from fan_out().
+    :return: A success if any target found something. Targets that found
+             nothing are listed under missing_targets, targets that failed
+             (e.g. could not be reached) under failed_targets.
+    :rtype: dict
+    """
+    results = []
+    failed = []
+    missing = []
+
+    for target, r in pairs:
+        if is_not_found(r):
+            missing.append(target['name'])
+            continue
+        if not jsend.is_success(r):
+            failed.append(target['name'])
+            continue
+
+        for record in r['data']['results']:
+            site = target.get('site')
+            if site and record.get('site_name', site) != site:
+                continue
+            results.append(dict(record, ddi_target=target['name']))
+
+    data = {'results': results, 'failed_targets': failed,
+            'missing_targets': missing}
+
+    return jsend.success(data) if len(failed) + len(missing) < len(pairs) \
+        else jsend.fail(data)
+
+
+def query_targets(ctx, func):
+    """
+    Run a read only query against the targets of the current profile, or just
+    the server when no profile is in use.
+
+    :param object ctx: The ctx object from click.
+    :param func: A callable taking a session and a URL and returning a JSEND
+                 result.
+    :return: The JSEND result, merged across targets when using a profile.
+    :rtype: dict
+    """
+    targets = ctx.obj.get('targets')
+
+    if not targets:
+        return func(ctx.obj['session'], ctx.obj['url'])
+
+    return merge_results(fan_out(func, targets,
+                                 timeout=ctx.obj.get('target_timeout', 30)))
+
+
+def target_name(server: str, site: str = None):
+    """
+    The name a profile entry is known by, tagging the records it returns.
+
+    A profile may list one server several times with different sites, so the
+    site is part of the name.
+
+    :param str server: The normalized server URL.
+    :param str site: The site of the entry, if any.
+    :return: The name.
+    :rtype: str
+    """
+    return f'{server} ({site})' if site else server
@@ -1,15 +1,233 @@
-from requests.exceptions import HTTPError
+from ddi.scheduler import run_concurrently
 from json.decoder import JSONDecodeError
 import binascii
 import click
+import codecs
+import collections
+import itertools
 import jsend
+import json
 import logging
 import netaddr
+import os
+import re
 import socket
-import urllib
+import urllib.parse
 
 logger = logging.getLogger(__name__)
 
+# The status codes the server answers with when there is nothing to return.
+NOT_FOUND = (204, 404)
+# Matched in place by iter_json_array() rather than slicing its buffer.
+SEPARATORS = re.compile(r'[ \t\r\n,]*')
+WHITESPACE = re.compile(r'[ \t\r\n]*')
+
+
+class ResultError(Exception):
+    """
+    Raised when a paged request fails part way through, carries the JSEND
+    failure result.
+    """
+
+    def __init__(self, result: dict):
+        super().__init__('Request failed.')
+        self.result = result
+
+
+class HostRecord:
+    """
+    A compact host record.
+
+    Addresses are held as integers and the class parameter query strings are
+    kept as received, each one is only parsed the first time it is accessed.
+
+    :param str ip_id: The ip_id of the host.
+    :param str name: The FQDN of the host.
+    :param int ip_addr: The IPv4 address of the host.
+    :param str ip_alias: The comma separated aliases of the host.
+    :param int subnet_start_ip_addr: The first address of the host's subnet.
+    :param int subnet_end_ip_addr: The last address of the host's subnet.
+    :param tuple parameters: The raw query strings of PARAMETERS, in order.
+    """
+
+    PARAMETERS = ('ip_class_parameters',
+                  'ip_class_parameters_inheritance_source',
+                  'ip_class_parameters_properties',
+                  'subnet_class_parameters',
+                  'subnet_class_parameters_properties')
+
+    __slots__ = ('ip_id', 'name', 'ip_addr', 'ip_alias',
+                 'subnet_start_ip_addr', 'subnet_end_ip_addr', '_raw',
+                 '_parsed')
+
+    def __init__(self, ip_id: str, name: str, ip_addr: int,
+                 ip_alias: str = '', subnet_start_ip_addr: int = 0,
+                 subnet_end_ip_addr: int = 0, parameters: tuple = None):
+        self.ip_id = ip_id
+        self.name = name
+        self.ip_addr = ip_addr
+        self.ip_alias = ip_alias
+        self.subnet_start_ip_addr = subnet_start_ip_addr
+        self.subnet_end_ip_addr = subnet_end_ip_addr
+        self._raw = parameters or ('',) * len(self.PARAMETERS)
+        self._parsed = None
+
+    @classmethod
+    def from_dict(cls, host_data: dict):
+        """
+        Create a record from a raw DDI ip_address_list result.
+
+        :param dict host_data: The host data as returned by get_host().
+        :return: The host record.
+        :rtype: HostRecord
+        """
+        return cls(host_data.get('ip_id', '0'), host_data.get('name', ''),
+                   int(host_data.get('ip_addr', '0'), 16),
+                   host_data.get('ip_alias', ''),
+                   int(host_data.get('subnet_start_ip_addr', '0'), 16),
+                   int(host_data.get('subnet_end_ip_addr', '0'), 16),
+                   tuple(host_data.get(p, '') for p in cls.PARAMETERS))
+
+    @property
+    def address(self):
+        """The IPv4 address as a dotted quad."""
+        return int_to_address(self.ip_addr)
+
+    @property
+    def ip_class_parameters(self):
+        """The parsed ip_class_parameters."""
+        return self.parameters('ip_class_parameters')
+
+    @property
+    def subnet(self):
+        """
+        The subnet of the host, a /32 if the host is not within a subnet
+        (usually an external host).
+        """
+        if not self.subnet_start_ip_addr or not self.subnet_end_ip_addr:
+            return netaddr.IPNetwork(f'{self.address}/32')
+
+        return netaddr.iprange_to_cidrs(
+            netaddr.IPAddress(self.subnet_start_ip_addr),
+            netaddr.IPAddress(self.subnet_end_ip_addr))[0]
+
+    def parameter(self, name: str, default: str = ''):
+        """
+        Get the first value of an ip_class_parameters entry.
+
+        :param str name: The parameter name (e.g. ucb_buildings).
+        :param str default: The value if the parameter is not set.
+        :return: The parameter value.
+        :rtype: str
+        """
+        return self.ip_class_parameters.get(name, [default])[0]
+
+    def parameters(self, field: str):
+        """
+        Get one of the class parameter fields, parsing it on first access.
+
+        :param str field: One of PARAMETERS.
+        :return: The parsed query string.
+        :rtype: dict
+        """
+        if self._parsed is None:
+            self._parsed = {}
+
+        if field not in self._parsed:
+            raw = self._raw[self.PARAMETERS.index(field)]
+            self._parsed[field] = urllib.parse.parse_qs(raw)
+
+        return self._parsed[field]
+
+    def to_dict(self):
+        """
+        Convert the record into a dictionary with dotted quad addresses, the
+        subnet CIDR and netmask and parsed class parameters.
+
+        :return: The host data.
+        :rtype: dict
+        """
+        subnet = self.subnet
+        external = not self.subnet_start_ip_addr or \
+            not self.subnet_end_ip_addr
+
+        host_data = {
+            'ip_id': self.ip_id,
+            'name': self.name,
+            'ip_addr': self.address,
+            'ip_alias': self.ip_alias,
+            'subnet_start_ip_addr': '0' if external else
+            int_to_address(self.subnet_start_ip_addr),
+            'subnet_end_ip_addr': '0' if external else
+            int_to_address(self.subnet_end_ip_addr),
+            'subnet_cidr': str(subnet),
+            'subnet_netmask': str(subnet.netmask),
+        }
+
+        for field in self.PARAMETERS:
+            host_data[field] = self.parameters(field)
+
+        return host_data
+
+
+def app_path(name: str):
+    """
+    The path to a file in the per user ddi application directory.
+
+    :param str name: The file name.
+    :return: The full path to the file.
+    :rtype: str
+    """
+    return os.path.join(click.get_app_dir('ddi'), name)
+
+
+def address_range(spec: str):
+    """
+    Parse an address, CIDR or dash separated range of IPv4 addresses.
+
+    :param str spec: e.g. 10.1.0.1, 10.1.0.0/22 or 10.1.0.10-10.1.0.50.
+    :return: The first and last address of the range as integers.
+    :rtype: tuple
+    """
+    if '-' in spec:
+        first, last = spec.split('-', 1)
+        r = netaddr.IPRange(first.strip(), last.strip())
+    else:
+        r = netaddr.IPNetwork(spec)
+
+    return (r.first, r.last)
+
+
+def batched(items, size: int):
+    """
+    Group an iterable into lists of up to size items, consuming it lazily.
+
+    :param items: The iterable.
+    :param int size: The most items per batch.
+    :return: A generator of lists.
+    :rtype: generator
+    """
+    items = iter(items)
+
+    while True:
+        batch = list(itertools.islice(items, size))
+        if not batch:
+            return None
+        yield batch
+
+
+def cidr_to_hex_range(cidr: str):
+    """
+    Convert a CIDR into the hex start and end addresses used by DDI.
+
+    :param str cidr: The CIDR (e.g. 10.1.0.0/22).
+    :return: The first and last address of the CIDR as hex.
+    :rtype: tuple
+    """
+    network = netaddr.IPNetwork(cidr)
+
+    return (f'{network.first:08x}', f'{network.last:08x}')
+
 
 def echo_host_info(host_info):
     """
@@ -21,42 +239,81 @@ def echo_host_info(host_info):
     :rtype: None
     """
     logger.debug('Echoing host info.')
-    for host in host_info['data']['results']:
-        host = get_subnets(host)
-        host = query_string_to_dict(host)
+    for entry in host_info['data']['results']:
+        host = HostRecord.from_dict(entry)
+        subnet = host.subnet
         click.echo('')
-        click.echo(f"Hostname: {host['name']}")
-        click.echo('Short Hostname: '
-                   f"{host['ip_class_parameters'].get('hostname', [''])[0]}")
-        click.echo(f"IP Address: {host['ip_addr']}")
-        click.echo(f"CNAMES: {host['ip_alias']}")
-        click.echo(f"Subnet Start: {host['subnet_start_ip_addr']}")
-        click.echo(f"Subnet End: {host['subnet_end_ip_addr']}")
-        click.echo(f"Subnet Netmask: {host['subnet_netmask']}")
-        click.echo(f"Subnet CIDR: {host['subnet_cidr']}")
-        click.echo('UCB Building: '
-                   f"{host['ip_class_parameters'].get('ucb_buildings', [''])[0]}")
-        click.echo('UCB Comment: '
-                   f"{host['ip_class_parameters'].get('ucb_comment', [''])[0]}")
-        click.echo('UCB Department: '
-                   f"{host['ip_class_parameters'].get('ucb_dept_aff', [''])[0]}")
-        click.echo(f"UCB Phone Number: "
-                   f"{host['ip_class_parameters'].get('ucb_ph_no', [''])[0]}")
-        click.echo('UCB Responsible Person: '
-                   f"{host['ip_class_parameters'].get('ucb_resp_per', [''])[0]}")
+        if 'ddi_target' in entry:
+            click.echo(f"Server: {entry['ddi_target']}")
+        click.echo(f"Hostname: {host.name}")
+        click.echo(f"Short Hostname: {host.parameter('hostname')}")
+        click.echo(f"IP Address: {host.address}")
+        click.echo(f"CNAMES: {host.ip_alias}")
+        click.echo(f"Subnet Start: {int_to_address(subnet.first)}")
+        click.echo(f"Subnet End: {int_to_address(subnet.last)}")
+        click.echo(f"Subnet Netmask: {subnet.netmask}")
+        click.echo(f"Subnet CIDR: {subnet}")
+        click.echo(f"UCB Building: {host.parameter('ucb_buildings')}")
+        click.echo(f"UCB Comment: {host.parameter('ucb_comment')}")
+        click.echo(f"UCB Department: {host.parameter('ucb_dept_aff')}")
+        click.echo(f"UCB Phone Number: {host.parameter('ucb_ph_no')}")
+        click.echo(f"UCB Responsible Person: {host.parameter('ucb_resp_per')}")
         click.echo('')
 
     return None
 
 
+def echo_lookups(ctx, lookups, echo):
+    """
+    Echo the results of stream_lookups() as they become available.
+
+    With --json every target is written as a line of JSEND with the target
+    added to its data. Exits with 1 once done if any target was not found.
+
+    :param object ctx: The ctx object from click.
+    :param lookups: The (target, records) tuples.
+    :param echo: A callable echoing a JSEND success in human readable form.
+    :return: None
+    :rtype: None
+    """
+    missing = 0
+
+    for target, records in lookups:
+        if records:
+            r = jsend.success({'results': records, 'target': target})
+        else:
+            r = jsend.fail({'results': [], 'target': target})
+            missing += 1
+
+        if ctx.obj['json']:
+            click.echo(json.dumps(r, sort_keys=True))
+        elif records:
+            echo(r)
+        elif records is None:
+            click.echo(f'Lookup of: {target} failed.')
+        else:
+            click.echo(f'No results for: {target}')
+
+    if missing:
+        click.echo(f'{missing} target(s) had no results.', err=True)
+        ctx.exit(1)
+
+
 def get_exceptions(result: object):
     """
     Catch and return errors from a request result.
 
+    A failure carries the HTTP status code under status_code, see
+    is_not_found().
+
     :param result: A requests session result.
     :return: A jsend formatted result with either success or failure.
     :rtype: dict
     """
+    # Imported here so commands that never contact the server (e.g. shell
+    # completion) do not pay for importing requests.
+    from requests.exceptions import HTTPError
+
     logger.debug('Examining result for exceptions.')
 
     # Determine if they gave us JSON, if not set the data to nothing.
@@ -70,45 +327,82 @@ def get_exceptions(result: object):
         result.raise_for_status()
     except HTTPError:
         logger.debug('HTTP Error Code: %s detected', result.status_code)
+        r_json['status_code'] = result.status_code
         return jsend.fail(r_json)
 
     # 204 is essentially an error, so we catch it.
     if result.status_code == 204:
+        r_json['status_code'] = result.status_code
         return jsend.fail(r_json)
     else:
         return jsend.success(r_json)
 
 
-def get_subnets(host_data: dict):
+def get_paged_results(endpoint: str, params: dict, session: object, url: str,
+                      page_size: int = 1000):
+    """
+    Page through a list endpoint yielding every record.
+
+    :param str endpoint: The endpoint to query (e.g. rest/ip_address_list).
+    :param dict params: The query parameters, WHERE, ORDERBY and so on.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param int page_size: The number of records to request per page.
+    :return: A generator of records.
+    :rtype: generator
+    :raises ResultError: If a page fails with an HTTP error.
+    """
+    offset = 0
+
+    while True:
+        logger.debug('Getting %s page at offset: %s', endpoint, offset)
+
+        page = dict(params, limit=page_size, offset=offset)
+        r = session.get(url + endpoint, params=page, stream=True)
+
+        try:
+            result = get_streamed_exceptions(r)
+
+            if not jsend.is_success(result):
+                # 204 is how the server signals there is nothing (more) to
+                # return.
+                if r.status_code == 204:
+                    return None
+                raise ResultError(result)
+
+            count = 0
+            for record in result['data']['results']:
+                count += 1
+                yield record
+        finally:
+            r.close()
+
+        if count < page_size:
+            return None
+
+        offset += page_size
+
+
+def get_streamed_exceptions(result: object, chunk_size: int = 65536):
     """
-    Get the subnets on which a given host exists.
+    Catch and return errors from a streamed request result.
 
-    :param dict host_data: The host data as returned by get_host().
-    :return: The host data with subnet_cidr and subnet_mask added and all
-             other IPs and subnets converted to dotted quad from hex.
+    The success or failure is decided from the HTTP status alone, on success
+    the results are a generator decoding the records as the body arrives.
+
+    :param result: A requests session result made with stream=True.
+    :param int chunk_size: The number of bytes to read at a time.
+    :return: A jsend formatted result with either success or failure.
     :rtype: dict
     """
+    logger.debug('Examining streamed result for exceptions.')
 
-    host_data['ip_addr'] = unhexlify_address(host_data['ip_addr'])
+    if result.status_code >= 400 or result.status_code == 204:
+        return get_exceptions(result)
 
-    # If there is no start and end to the subnet we are usually dealing with
-    # an external host.
-    if host_data['subnet_start_ip_addr'] == '0' or \
-            host_data['subnet_end_ip_addr'] == '0':
-        host_data['subnet_cidr'] = \
-            str(netaddr.IPNetwork(host_data['ip_addr'] + '/32'))
-        host_data['subnet_mask'] = '255.255.255.255'
-    else:
-        host_data['subnet_start_ip_addr'] = \
-            unhexlify_address(host_data['subnet_start_ip_addr'])
-        host_data['subnet_end_ip_addr'] = \
-            unhexlify_address(host_data['subnet_end_ip_addr'])
-        subnet = netaddr.iprange_to_cidrs(host_data['subnet_start_ip_addr'],
-                                          host_data['subnet_end_ip_addr'])[0]
-        host_data['subnet_cidr'] = str(subnet)
-        host_data['subnet_netmask'] = str(subnet.netmask)
+    results = iter_json_array(result.iter_content(chunk_size=chunk_size))
 
-    return host_data
+    return jsend.success({'results': results})
 
 
 def hexlify_address(ipv4_address: str):
@@ -123,28 +417,154 @@ def hexlify_address(ipv4_address: str):
     return binascii.hexlify(socket.inet_aton(ipv4_address))
 
 
-def query_string_to_dict(host_info):
+def int_to_address(address: int):
     """
-    Turn a URL query string into a dictionary.
+    Convert an integer IPv4 address into a dotted quad address.
 
-    :param dict host_info: Host info from DDI with populated attributes.
-    :return: Host info with attributes translated from query string to dict.
-    :rtype: dict
+    :param int address: The address as an integer.
+    :return: The address as a dotted quad.
+    :rtype: str
+    """
+    return socket.inet_ntoa(address.to_bytes(4, 'big'))
+
+
+def is_not_found(result: dict):
     """
+    Whether a result failed because the server found nothing, as opposed to
+    failing for any other reason (e.g. a server error or bad credentials).
+
+    :param dict result: A JSEND result from get_exceptions().
+    :return: True if the server answered 204 or 404.
+    :rtype: bool
+    """
+    return jsend.is_fail(result) and \
+        result['data'].get('status_code') in NOT_FOUND
+
+
+def iter_json_array(chunks):
+    """
+    Incrementally decode a JSON array, yielding each element as soon as it
+    has been received.
+
+    :param chunks: An iterable of bytes making up the JSON document.
+    :return: A generator of the array's elements, if the document is not an
+             array the whole document is yielded instead.
+    :rtype: generator
+    :raises ResultError: If the document ends before the array does.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    started = False
+
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            buffer += text.decode(b'', final=True)
+        else:
+            buffer += text.decode(chunk)
+
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+
+            if position >= len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != '[':
+                    # Not an array, decode the document as a whole.
+                    rest = buffer[position:] + ''.join(
+                        text.decode(c) for c in chunks) + text.decode(
+                        b'', final=True)
+                    try:
+                        yield json.loads(rest)
+                    except JSONDecodeError:
+                        logger.debug('Results are not JSON.')
+                    return None
+
+                started = True
+                position += 1
+                continue
+
+            if buffer[position] == ']':
+                return None
+
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except JSONDecodeError:
+                break
+
+            # An element must be followed by a ',' or ']', until that arrives
+            # a trailing number may still be incomplete.
+            following = WHITESPACE.match(buffer, end).end()
+            if chunk is not None and buffer[following:following + 1] not in (
+                    ',', ']'):
+                break
+
+            yield element
+            position = end
+
+        # Drop what has been consumed so the buffer stays small.
+        buffer = buffer[position:]
+        position = 0
+
+    if started:
+        # E.g. the connection dropped, the records so far are not all of them.
+        logger.debug('Results ended before the end of the array.')
+        raise ResultError(jsend.error('The response ended part way through.'))
+
+
+def read_targets(file):
+    """
+    Read targets one per line, lazily, skipping blank lines and comments.
+
+    :param object file: The open file.
+    :return: A generator of the stripped lines.
+    :rtype: generator
+    """
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def stream_lookups(targets, lookup_batch, key, session: object, url: str,
+                   batch_size: int = 100):
+    """
+    Look up a stream of targets using batched queries run concurrently.
+
+    Only a bounded number of batches is in flight at any time and the input
+    is only read as batches complete, so arbitrarily long inputs are handled
+    in constant memory.
+
+    :param targets: An iterable of targets, e.g. FQDNs.
+    :param lookup_batch: A callable taking a list of targets, a session and a
+                         URL and returning the records found.
+    :param key: A callable giving the target a record belongs to.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :param int batch_size: The number of targets per query.
+    :return: A generator of (target, records) tuples in input order, records
+             is None if the lookup failed.
+    :rtype: generator
+    """
+
+    def lookup(batch):
+        try:
+            records = lookup_batch(batch, session, url)
+        except ResultError:
+            return [(target, None) for target in batch]
 
-    parameters = [
-        'ip_class_parameters',
-        'ip_class_parameters_inheritance_source',
-        'ip_class_parameters_properties',
-        'subnet_class_parameters',
-        'subnet_class_parameters_properties'
-    ]
+        found = collections.defaultdict(list)
+        for record in records:
+            found[key(record)].append(record)
 
-    for parameter in parameters:
-        p = host_info.get(parameter, '')
-        host_info[parameter] = urllib.parse.parse_qs(p)
+        return [(target, found.get(target.lower(), [])) for target in batch]
 
-    return host_info
+    for _, results in run_concurrently(lookup, batched(targets, batch_size),
+                                       session=session):
+        yield from results
 
 
 def unhexlify_address(hex_address: str):
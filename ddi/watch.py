@@ -0,0 +1,248 @@
+from ddi.cli import cli
+from ddi.host import find_hosts, get_hosts
+from ddi.subnet import list_subnets
+from ddi.utilites import ResultError
+
+import click
+import datetime
+import hashlib
+import json
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def diff_hashes(old: dict, records: dict, ignore: tuple = ()):
+    """
+    Compare freshly polled records against the hashes of the previous poll.
+
+    :param dict old: The record hashes of the previous poll keyed by ip_id.
+    :param dict records: The records of this poll keyed by ip_id.
+    :param tuple ignore: Fields to leave out of the comparison.
+    :return: The added, removed and changed events and the new hashes.
+    :rtype: tuple
+    """
+    new = {k: record_hash(r, ignore=ignore) for k, r in records.items()}
+    events = []
+
+    for key in sorted(new.keys() | old.keys(), key=int):
+        if key not in old:
+            events.append({'event': 'added', 'key': key,
+                           'record': records[key]})
+        elif key not in new:
+            events.append({'event': 'removed', 'key': key})
+        elif old[key] != new[key]:
+            events.append({'event': 'changed', 'key': key,
+                           'record': records[key]})
+
+    return events, new
+
+
+def record_hash(record: dict, ignore: tuple = ()):
+    """
+    A compact hash of a record's content.
+
+    :param dict record: The record.
+    :param tuple ignore: Fields to leave out of the hash.
+    :return: The hex digest.
+    :rtype: str
+    """
+    content = {k: v for k, v in record.items() if k not in ignore}
+
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode(),
+                           digest_size=8).hexdigest()
+
+
+class SubnetProbe:
+    """
+    Decide whether the hosts of a block must be listed again.
+
+    Listing every host of a large block is expensive, so each poll first
+    fetches the block's subnet records, a handful of rows, and only lists the
+    hosts when their used address counts changed or every full_every polls
+    (to catch changes that leave the counts alone, such as renames).
+
+    :param str block: The block CIDR.
+    :param int full_every: List the hosts at least every this many polls.
+    """
+
+    def __init__(self, block: str, full_every: int = 10):
+        self.block = block
+        self.full_every = full_every
+        self._signature = None
+        self._polls = 0
+
+    def changed(self, session: object, url: str):
+        """
+        Check whether the hosts should be listed on this poll.
+
+        :param object session: The requests session object.
+        :param str url: The full URL of the DDI server.
+        :return: True if the hosts may have changed.
+        :rtype: bool
+        :raises ResultError: If the subnets could not be listed.
+        """
+        signature = tuple((s['subnet_id'], s.get('subnet_ip_used_size'))
+                          for s in list_subnets(session, url,
+                                                block=self.block))
+
+        self._polls += 1
+        if signature != self._signature or self._polls >= self.full_every:
+            self._signature = signature
+            self._polls = 0
+            return True
+
+        logger.debug('Subnet usage of: %s unchanged, skipping the host list.',
+                     self.block)
+
+        return False
+
+    def reset(self):
+        """
+        Make the next poll list the hosts.
+
+        :return: None
+        :rtype: None
+        """
+        self._signature = None
+
+
+def watch_events(subnets: tuple, hosts: tuple, session: object, url: str,
+                 interval: float = 60, jitter: float = 0.1, count: int = 0,
+                 full_every: int = 10, ignore: tuple = (),
+                 initial: bool = False):
+    """
+    Poll subnets and hosts, yielding an event for every host added, removed
+    or changed between polls.
+
+    Only a compact hash of each host is kept between polls.
+
+    :param tuple subnets: The CIDRs to watch.
+    :param tuple hosts: The FQDNs to watch.
+    :param object session: The requests session object, kept warm between
+                           polls.
+    :param str url: The full URL of the DDI server.
+    :param float interval: The seconds between polls.
+    :param float jitter: The fraction by which each interval is randomly
+                         lengthened or shortened.
+    :param int count: The number of polls, 0 to poll forever.
+    :param int full_every: See SubnetProbe.
+    :param tuple ignore: Fields to leave out of the comparison.
+    :param bool initial: Report the hosts found by the first poll as added.
+    :return: A generator of events.
+    :rtype: generator
+    """
+    probes = {s: SubnetProbe(s, full_every=full_every) for s in subnets}
+    hashes = {}
+    polls = 0
+
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+        for source, fetch in sources(probes, hosts, session, url):
+            try:
+                records = fetch()
+            except ResultError:
+                logger.debug('Poll of: %s failed.', source)
+                yield {'event': 'error', 'source': source, 'time': now}
+                continue
+
+            if records is None:
+                continue
+
+            events, hashes[source] = diff_hashes(hashes.get(source, {}),
+                                                 records, ignore=ignore)
+
+            if polls or initial:
+                for event in events:
+                    yield dict(event, source=source, time=now)
+
+        polls += 1
+        if count and polls >= count:
+            return None
+
+        delay = interval * (1 + random.uniform(-jitter, jitter))
+        logger.debug('Next poll in %.1f seconds.', delay)
+        time.sleep(max(0, delay))
+
+
+def sources(probes: dict, hosts: tuple, session: object, url: str):
+    """
+    The watched sources with a callable polling each.
+
+    The callables return the records keyed by ip_id, or None if the source
+    is known not to have changed.
+
+    :param dict probes: The SubnetProbe of each watched CIDR.
+    :param tuple hosts: The FQDNs to watch.
+    :param object session: The requests session object.
+    :param str url: The full URL of the DDI server.
+    :return: A list of (source, callable) tuples.
+    :rtype: list
+    """
+
+    def subnet(cidr):
+        if not probes[cidr].changed(session, url):
+            return None
+        try:
+            return {h['ip_id']: h for h in find_hosts(session, url, cidr=cidr)}
+        except ResultError:
+            # List the hosts again on the next poll.
+            probes[cidr].reset()
+            raise
+
+    def named():
+        return {h['ip_id']: h for h in get_hosts(hosts, session, url)}
+
+    watched = [(f'subnet {cidr}', lambda cidr=cidr: subnet(cidr))
+               for cidr in probes]
+    if hosts:
+        watched.append(('hosts', named))
+
+    return watched
+
+
+@cli.command()
+@click.option('--count', '-c', default=0, type=click.IntRange(min=0),
+              help='Stop after this many polls, 0 to poll forever.',
+              show_default=True)
+@click.option('--full-every', default=10, type=click.IntRange(min=1),
+              help='List the hosts of a subnet at least every this many '
+                   'polls.', show_default=True)
+@click.option('--host', 'hosts', multiple=True,
+              help='A host to watch, may be given more than once.')
+@click.option('--ignore', '-i', multiple=True,
+              help='A field to leave out of the comparison, may be given more '
+                   'than once.')
+@click.option('--initial', is_flag=True,
+              help='Report the hosts found by the first poll as added.')
+@click.option('--interval', default=60, type=click.FloatRange(min=0),
+              help='Seconds between polls.', show_default=True)
+@click.option('--jitter', default=0.1, type=click.FloatRange(0, 1),
+              help='Fraction by which each interval randomly varies.',
+              show_default=True)
+@click.option('--subnet', '-s', 'subnets', multiple=True,
+              help='A subnet CIDR to watch, may be given more than once.')
+@click.pass_context
+def watch(ctx, count, full_every, hosts, ignore, initial, interval, jitter,
+          subnets):
+    """
+    Watch subnets and hosts for changes.
+
+    Every added, removed or changed host is written as a line of JSON. The
+    first poll only records the current state unless --initial is given.
+    Each poll of a subnet first checks its used address counts and only lists
+    its hosts again when they changed, or every --full-every polls.
+    """
+
+    if not subnets and not hosts:
+        raise click.UsageError('Give at least one --subnet or --host.')
+
+    for event in watch_events(subnets, hosts, ctx.obj['session'],
+                              ctx.obj['url'], interval=interval,
+                              jitter=jitter, count=count,
+                              full_every=full_every, ignore=ignore,
+                              initial=initial):
+        click.echo(json.dumps(event, sort_keys=True))
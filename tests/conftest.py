@@ -0,0 +1,73 @@
+from json.decoder import JSONDecodeError
+from requests.exceptions import HTTPError
+
+import json
+import pytest
+
+
+class StubResponse:
+    """A canned DDI response, usable both as is and streamed."""
+
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        if self.body is not None:
+            yield json.dumps(self.body).encode()
+
+    def json(self):
+        if self.body is None:
+            raise JSONDecodeError('Expecting value', '', 0)
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(f'{self.status_code} Error')
+
+
+class StubSession:
+    """
+    A session answering requests from a routing callable instead of a server.
+
+    The callable takes the method, the URL and the params (or JSON body) of a
+    request and returns the response body, None for an empty body, or a
+    (body, status_code) tuple. Every request is kept in requests.
+
+    :param route: The routing callable.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.requests = []
+
+    def request(self, method, url, params=None, json=None, stream=False,
+                **kwargs):
+        sent = params if params is not None else json
+        self.requests.append((method, url, sent))
+        answer = self.route(method, url, sent)
+
+        if isinstance(answer, tuple):
+            return StubResponse(*answer)
+        return StubResponse(answer)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+
+@pytest.fixture()
+def stub_session():
+    """A factory of StubSessions, called with the routing callable."""
+    return StubSession
@@ -95,23 +95,36 @@ def test_cname_add(client):
     assert 'fail' in failed_json_cli_result.stdout
 
 
-def test_cname_info(client):
+def cname_server(method, url, params):
+    """A server where ddi_host carries ddi_cname and nothing else exists."""
+    if method == 'DELETE':
+        return {'ret_oid': '389885'}
+
+    if ddi_cname not in params['WHERE']:
+        return None, 204
+
+    return [{'ip_id': '389885', 'name': ddi_host, 'ip_addr': 'ac171704',
+             'ip_alias': ddi_cname, 'subnet_start_ip_addr': 'ac171700',
+             'subnet_end_ip_addr': 'ac1717ff',
+             'ip_class_parameters': 'hostname=ddi-test-host'}]
+
+
+def test_cname_info(stub_session):
 
     runner = CliRunner()
     result = runner.invoke(cname, ['info', '--help'])
     assert result.exit_code == 0
     assert 'Usage:' in result.output
 
-    recorder = Betamax(client)
+    session = stub_session(cname_server)
 
-    obj = {'session': client, 'url': ddi_url, 'json': False}
-    jobj ={'session': client, 'url': ddi_url, 'json': True}
+    obj = {'session': session, 'url': ddi_url, 'json': False}
+    jobj ={'session': session, 'url': ddi_url, 'json': True}
 
-    with recorder.use_cassette('cli_cname_info'):
-        cli_result = runner.invoke(cname, ['info', ddi_cname], obj=obj)
-        cli_json_result = runner.invoke(cname, ['info', ddi_cname], obj=jobj)
-        failed_cli_result = runner.invoke(cname, ['info', errant_ddi_cname], obj=obj)
-        failed_json_cli_result = runner.invoke(cname, ['info', errant_ddi_cname], obj=jobj)
+    cli_result = runner.invoke(cname, ['info', ddi_cname], obj=obj)
+    cli_json_result = runner.invoke(cname, ['info', ddi_cname], obj=jobj)
+    failed_cli_result = runner.invoke(cname, ['info', errant_ddi_cname], obj=obj)
+    failed_json_cli_result = runner.invoke(cname, ['info', errant_ddi_cname], obj=jobj)
 
     assert cli_result.exit_code == 0
     assert f'Hostname: {ddi_host}' in cli_result.stdout
@@ -123,23 +136,22 @@ def test_cname_info(client):
 
     assert 'fail' in failed_json_cli_result.stdout
 
-def test_cname_delete(client):
+def test_cname_delete(stub_session):
 
     runner = CliRunner()
     result = runner.invoke(cname, ['delete', '--help'])
     assert result.exit_code == 0
     assert 'Usage:' in result.output
 
-    recorder = Betamax(client)
+    session = stub_session(cname_server)
 
-    obj = {'session': client, 'url': ddi_url, 'json': False}
-    jobj ={'session': client, 'url': ddi_url, 'json': True}
+    obj = {'session': session, 'url': ddi_url, 'json': False}
+    jobj ={'session': session, 'url': ddi_url, 'json': True}
 
-    with recorder.use_cassette('cli_cname_delete'):
-        cli_result = runner.invoke(cname, ['delete', ddi_cname, '--yes'], obj=obj)
-        cli_json_result = runner.invoke(cname, ['delete', ddi_cname, '--yes'], obj=jobj)
-        failed_cli_result = runner.invoke(cname, ['delete', errant_ddi_cname, '--yes'], obj=obj)
-        failed_json_cli_result = runner.invoke(cname, ['delete', errant_ddi_cname, '--yes'], obj=jobj)
+    cli_result = runner.invoke(cname, ['delete', ddi_cname, '--yes'], obj=obj)
+    cli_json_result = runner.invoke(cname, ['delete', ddi_cname, '--yes'], obj=jobj)
+    failed_cli_result = runner.invoke(cname, ['delete', errant_ddi_cname, '--yes'], obj=obj)
+    failed_json_cli_result = runner.invoke(cname, ['delete', errant_ddi_cname, '--yes'], obj=jobj)
 
     assert cli_result.exit_code == 0
     assert f'CNAME: {ddi_cname} deleted.' in cli_result.stdout
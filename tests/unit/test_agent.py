@@ -0,0 +1,28 @@
+from ddi.agent import *
+from ddi.credentials import get_agent_password
+
+import threading
+import time
+
+
+def test_serve_agent(tmp_path):
+    path = str(tmp_path / 'agent.sock')
+
+    thread = threading.Thread(target=serve_agent,
+                              args=({'test_user': 'test_password'}, 10, path))
+    thread.start()
+
+    for _ in range(50):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+
+    assert os.stat(path).st_mode & 0o077 == 0
+    assert get_agent_password('test_user', path=path) == 'test_password'
+    assert get_agent_password('other_user', path=path) is None
+
+    assert agent_request({'op': 'stop'}, path=path) == {'stopped': True}
+    thread.join(timeout=5)
+
+    assert not os.path.exists(path)
+    assert get_agent_password('test_user', path=path) is None
@@ -0,0 +1,104 @@
+from ddi.cache import *
+
+import jsend
+
+
+def test_identity_cache(tmp_path):
+    path = str(tmp_path / 'cache.json')
+
+    cache = IdentityCache(path=path)
+    cache.set('host', 'Host.example.com', '42')
+    assert cache.get('host', 'host.example.com') == '42'
+    assert cache.get('alias', 'host.example.com') is None
+    cache.save()
+
+    assert IdentityCache(path=path).get('host', 'host.example.com') == '42'
+    assert IdentityCache(path=path, ttl=0).get('host',
+                                                'host.example.com') is None
+
+    cache.discard('host', 'host.example.com')
+    assert cache.get('host', 'host.example.com') is None
+
+
+def test_cached_mutation():
+    cache = IdentityCache()
+    cache.set('host', 'host.example.com', 'stale')
+    lookups = []
+
+    def lookup():
+        lookups.append(True)
+        return jsend.success({'results': [{'ip_id': '42'}]})
+
+    def mutate(ip_id):
+        if ip_id == '42':
+            return jsend.success({'results': [{'ret_oid': ip_id}]})
+        return jsend.fail({'results': [], 'status_code': 400})
+
+    result = cached_mutation('host', 'host.example.com', lookup, mutate,
+                             cache=cache)
+    assert jsend.is_success(result)
+    assert len(lookups) == 1
+    assert cache.get('host', 'host.example.com') == '42'
+
+    result = cached_mutation('host', 'host.example.com', lookup, mutate,
+                             cache=cache)
+    assert jsend.is_success(result)
+    assert len(lookups) == 1
+
+
+def test_cached_mutation_not_repeated():
+    cache = IdentityCache()
+    cache.set('host', 'host.example.com', '42')
+    calls = []
+
+    def mutate(ip_id):
+        calls.append(ip_id)
+        return jsend.fail({'results': [], 'status_code': 503})
+
+    # The first attempt may have been carried out, so it is not repeated.
+    result = cached_mutation('host', 'host.example.com', lambda: 1 / 0,
+                             mutate, cache=cache)
+
+    assert result['data']['status_code'] == 503
+    assert calls == ['42']
+
+
+def test_identity_cache_servers(tmp_path):
+    path = str(tmp_path / 'cache.json')
+
+    cache = IdentityCache(path=path, server='https://a.example.com/')
+    cache.set('host', 'host.example.com', '42')
+    cache.save()
+
+    assert IdentityCache(path=path, server='https://b.example.com/').get(
+        'host', 'host.example.com') is None
+    assert IdentityCache(path=path, server='https://a.example.com/').get(
+        'host', 'host.example.com') == '42'
+
+
+def test_alias_not_reused_as_host(stub_session):
+    from ddi.cname import add_cnames
+    from ddi.host import delete_host
+
+    url = 'https://ddi.example.com/'
+
+    def route(method, url, params):
+        if method == 'GET' and "name='web1.example.com'" in params['WHERE']:
+            return [{'ip_id': '42', 'name': 'web1.example.com'}]
+        if method == 'GET':
+            return None, 204
+        return {'ret_oid': '42'}
+
+    session = stub_session(route)
+    cache = IdentityCache()
+
+    add_cnames(['www.example.com'], 'web1.example.com', session, url,
+               cache=cache)
+    assert cache.get('alias', 'www.example.com') == '42'
+
+    # There is no host called www.example.com, the alias entry must not make
+    # the deletion go ahead against web1.
+    result = delete_host('www.example.com', session, url, cache=cache)
+
+    assert jsend.is_fail(result)
+    assert not any(method == 'DELETE' for method, _, _ in session.requests)
@@ -0,0 +1,66 @@
+from click.testing import CliRunner
+from ddi.main import cli
+
+import pytest
+
+
+class StubKeyring:
+    name = 'stub'
+
+    def __init__(self):
+        self.passwords = {}
+
+    def set_password(self, service, username, password):
+        self.passwords[service, username] = password
+
+
+@pytest.fixture()
+def offline_env(tmp_path, monkeypatch):
+    monkeypatch.delenv('DDI_SERVER', raising=False)
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path))
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+
+
+@pytest.mark.parametrize('args, output', [
+    (['agent', 'status'], 'No credential agent is running.'),
+    (['agent', 'stop'], 'No credential agent is running.'),
+    (['completion'], 'Shell completion commands.'),
+    (['host'], 'Usage:'),
+])
+def test_offline_commands(offline_env, args, output):
+    result = CliRunner().invoke(cli, ['-U', 'test_user'] + args, input='')
+
+    assert 'Server:' not in result.output
+    assert output in result.output
+
+
+def test_offline_agent_start(offline_env, monkeypatch):
+    served = []
+    monkeypatch.setattr('ddi.agent.get_keyring_password', lambda u: 'secret')
+    monkeypatch.setattr('ddi.agent.serve_agent',
+                        lambda credentials, ttl: served.append(credentials))
+
+    result = CliRunner().invoke(cli, ['-U', 'test_user', 'agent', 'start'],
+                                input='')
+
+    assert result.exit_code == 0, result.output
+    assert served == [{'test_user': 'secret'}]
+
+
+def test_offline_password_set(offline_env, monkeypatch):
+    stub = StubKeyring()
+    monkeypatch.setattr('keyring.get_keyring', lambda: stub)
+
+    result = CliRunner().invoke(cli, ['-U', 'test_user', 'password', 'set'],
+                                input='secret\nsecret\n')
+
+    assert result.exit_code == 0, result.output
+    assert stub.passwords == {('ddi', 'test_user'): 'secret'}
+
+
+def test_online_command_requires_server(offline_env):
+    result = CliRunner().invoke(cli, ['-U', 'test_user', 'host', 'info',
+                                      'web1.example.com'], input='')
+
+    assert 'Server:' in result.output
+    assert result.exit_code != 0
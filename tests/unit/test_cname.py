@@ -68,20 +68,82 @@ def test_add_cname(client):
         assert jsend.is_success(result)
 
 
-def test_get_cname(client):
-    recorder = Betamax(client)
-    with recorder.use_cassette('ddi_get_cname'):
-        result = get_cname_info(cname=ddi_cname, session=client, url=ddi_url)
+def cname_server(method, url, params):
+    """A server where ddi_host carries ddi_cname after another alias."""
+    if method == 'DELETE':
+        return {'ret_oid': '389885'}
+
+    host = {'ip_id': '389885', 'name': ddi_host, 'ip_addr': 'ac171704',
+            'ip_alias': f'other.{domain_name},{ddi_cname}'}
+    where = params['WHERE']
+
+    # Only a match on a later position can find the alias.
+    if f"'%,{ddi_cname}'" in where:
+        return [host]
+    return None, 204
+
+
+def test_get_cname(stub_session):
+    session = stub_session(cname_server)
+    result = get_cname_info(cname=ddi_cname, session=session, url=ddi_url)
 
     assert isinstance(result, dict)
     assert jsend.is_success(result)
     assert result['data']['results'][0]['name'] == ddi_host
+    # The alias is not the host's first, so it took the scanning query.
+    assert len(session.requests) == 2
 
 
-def test_delete_cname(client):
-    recorder = Betamax(client)
-    with recorder.use_cassette('ddi_delete_cname'):
-        result = delete_cname(cname=ddi_cname, session=client, url=ddi_url)
+def test_get_cname_with_index(stub_session):
+    session = stub_session(cname_server)
+    result = get_cname_info(cname=f'gone.{domain_name}', session=session,
+                            url=ddi_url, alias_index={ddi_cname: '389885'})
+
+    assert jsend.is_fail(result)
+    # The index does not know the alias, which may be newer than the index.
+    assert len(session.requests) == 2
+
+
+def test_get_cname_with_stale_index(stub_session):
+    session = stub_session(cname_server)
+    result = get_cname_info(cname=ddi_cname, session=session, url=ddi_url,
+                            alias_index={ddi_cname: '1'})
+
+    assert jsend.is_success(result)
+    assert result['data']['results'][0]['ip_id'] == '389885'
+    # The indexed host, the leading alias query and the scan.
+    assert len(session.requests) == 3
+
+
+def test_alias_index_path():
+    assert alias_index_path('https://a.example.com/') != \
+        alias_index_path('https://b.example.com/')
+
+
+def test_delete_cname(stub_session):
+    session = stub_session(cname_server)
+    result = delete_cname(cname=ddi_cname, session=session, url=ddi_url)
 
     assert isinstance(result, dict)
     assert jsend.is_success(result)
+    assert session.requests[-1] == ('DELETE', ddi_url + 'rest/ip_alias_delete',
+                                    {'ip_id': '389885', 'ip_name': ddi_cname})
+
+
+def test_split_aliases():
+    assert split_aliases('Web.example.com, web2.example.com') == \
+        ['web.example.com', 'web2.example.com']
+    assert split_aliases('') == []
+
+
+def test_match_alias():
+    result = jsend.success({'results': [
+        {'ip_id': '1', 'ip_alias': 'web2.example.com'},
+        {'ip_id': '2', 'ip_alias': 'www.example.com,web.example.com'},
+    ]})
+
+    matched = match_alias('web.example.com', result)
+
+    assert jsend.is_success(matched)
+    assert [r['ip_id'] for r in matched['data']['results']] == ['2']
+    assert jsend.is_fail(match_alias('web', result))
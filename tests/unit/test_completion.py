@@ -0,0 +1,40 @@
+from ddi.completion import *
+
+import subprocess
+import sys
+
+
+def test_search_index(tmp_path):
+    path = str(tmp_path / 'index')
+    write_index([{'name': 'Web1.example.com', 'ip_addr': '0a000001',
+                  'ip_alias': 'www.example.com'},
+                 {'name': 'web2.example.com', 'ip_addr': '0a000002'},
+                 {'name': 'db.example.com', 'ip_addr': '0b000001'}],
+                path=path)
+
+    assert search_index(HOST, 'WE', path=path) == ['web1.example.com',
+                                                  'web2.example.com']
+    assert search_index(ALIAS, '', path=path) == ['www.example.com']
+    assert search_index(ADDRESS, '10.0', path=path) == ['10.0.0.1',
+                                                       '10.0.0.2']
+    assert search_index(HOST, 'x', path=str(tmp_path / 'missing')) == []
+
+
+def test_search_index_large(tmp_path):
+    path = str(tmp_path / 'index')
+    write_index([{'name': f'host{i}.example.com', 'ip_addr': f'{i:08x}'}
+                 for i in range(5000)], path=path)
+
+    assert search_index(HOST, 'host4999', path=path) == ['host4999.example.com']
+    assert search_index(HOST, 'host12', path=path, limit=3) == [
+        'host12.example.com', 'host120.example.com', 'host1200.example.com']
+    assert search_index(ALIAS, '', path=path) == []
+
+    open(path, 'w').close()
+    assert search_index(HOST, '', path=path) == []
+
+
+def test_completion_does_not_import_requests():
+    code = 'import ddi.main, sys; sys.exit("requests" in sys.modules)'
+
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
@@ -107,3 +107,26 @@ def test_delete_host(client):
     assert isinstance(result, dict)
     assert jsend.is_success(result)
     assert 'ret_oid' in result['data']['results'][0]
+
+
+def test_bulk_delete_declined(stub_session, tmp_path, monkeypatch):
+    from click.testing import CliRunner
+
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path))
+
+    def route(method, url, params):
+        if method == 'GET' and params.get('offset', 0) == 0:
+            return [{'ip_id': '1', 'name': 'web1.example.com'}]
+        return None, 204
+
+    session = stub_session(route)
+    obj = {'cache': None, 'json': False, 'session': session,
+           'url': 'https://ddi.example.com/'}
+
+    result = CliRunner().invoke(host, ['delete', '--where', "name='web1'"],
+                                input='n\n', obj=obj)
+
+    assert result.exit_code == 1
+    assert not any(method == 'DELETE' for method, _, _ in session.requests)
+    # A declined deletion leaves no journal for --resume to pick up.
+    assert not list((tmp_path / 'ddi' / 'journals').iterdir())
@@ -90,3 +90,67 @@ def test_get_ipv4_info(client):
 
     assert isinstance(failed_result, dict)
     assert jsend.is_fail(failed_result)
+
+
+def test_unused_ranges():
+    first, last = address_range('10.1.0.0/29')
+
+    assert unused_ranges(first, last, ['0a010001', '0a010002', '0a010006']) \
+        == ['10.1.0.0', '10.1.0.3-10.1.0.5', '10.1.0.7']
+
+
+def test_find_free_ipv4(stub_session):
+    """Two /24 subnets, the first of which is much fuller."""
+    used = {'ac171700': '200', 'ac171800': '10'}
+
+    def route(method, url, params):
+        if 'ip_block_subnet_list' in url:
+            start = params['WHERE'].split("'")[1]
+            return [{'subnet_id': start, 'start_ip_addr': start,
+                     'end_ip_addr': start[:6] + 'ff',
+                     'subnet_ip_used_size': used[start],
+                     'subnet_ip_free_size': '54'}]
+        return [{'hostaddr': params['subnet_id']}]
+
+    subnets = ['172.23.23.0', '172.23.24.0']
+    session = stub_session(route)
+
+    def pick(policy):
+        r = find_free_ipv4(subnets, session, 'https://ddi.example.com/',
+                           policy=policy)
+        return r['data']['results'][0]['hostaddr']
+
+    assert pick('first-fit') == 'ac171700'
+    assert pick('least-utilized') == 'ac171800'
+    assert {pick('round-robin'), pick('round-robin')} == {'ac171700',
+                                                          'ac171800'}
+
+
+def test_info_unused_single_address():
+    from click.testing import CliRunner
+
+    result = CliRunner().invoke(ipv4, ['info', '--unused', '10.1.0.0/30',
+                                       '10.1.0.9'], obj={})
+
+    assert result.exit_code == 2
+    assert '--unused only applies' in result.output
+
+
+def test_lookup_offline(tmp_path):
+    from click.testing import CliRunner
+    from ddi.cli import cli
+    from ddi.table import write_table
+
+    table = str(tmp_path / 'table')
+    write_table([{'ip_id': '1', 'name': 'a.example.com', 'ip_addr': '0a000001'}],
+                path=table)
+    lines = b'10.0.0.1 GET /\r\nbogus\n10.0.0.2 GET /\n10.0.0.1 POST /'
+
+    result = CliRunner().invoke(cli, ['ipv4', 'lookup', '--table', table],
+                                input=lines)
+
+    assert result.exit_code == 0, result.output
+    assert result.stdout_bytes.split(b'\n') == [
+        b'10.0.0.1 GET /\ta.example.com\t10.0.0.1/32\t\t\t',
+        b'bogus\t\t\t\t\t', b'10.0.0.2 GET /\t\t\t\t\t',
+        b'10.0.0.1 POST /\ta.example.com\t10.0.0.1/32\t\t\t', b'']
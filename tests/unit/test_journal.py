@@ -0,0 +1,44 @@
+from ddi.journal import *
+
+
+def test_journal_resume(tmp_path):
+    path = str(tmp_path / 'journals' / 'job.ndjson')
+
+    with Journal(path, sync_every=2) as journal:
+        journal.start([{'ip_id': '1'}, {'ip_id': '2'}, {'ip_id': '3'}])
+        journal.record('1')
+        journal.record('2', {'status': 'success'})
+
+    with open(path, 'a') as f:
+        f.write('{"key": "3", "res')
+
+    resumed = Journal(path, resume=True)
+    resumed.record('4')
+    resumed.close()
+
+    journal = Journal(path, resume=True)
+    assert journal.plan == [{'ip_id': '1'}, {'ip_id': '2'}, {'ip_id': '3'}]
+    assert '1' in journal and '3' not in journal and '4' in journal
+    assert journal.done['2'] == {'status': 'success'}
+
+    journal.remove()
+    assert not os.path.exists(path)
+
+
+def test_journal_start_over(tmp_path):
+    path = str(tmp_path / 'job.ndjson')
+
+    with Journal(path) as journal:
+        journal.record('1')
+
+    journal = Journal(path)
+    journal.close()
+
+    assert journal.plan is None
+    assert Journal(path, resume=True).done == {}
+
+
+def test_journal_path():
+    assert journal_path('apply', 'a') == journal_path('apply', 'a')
+    assert journal_path('apply', 'a') != journal_path('apply', 'b')
+    assert journal_path('apply', 'a').endswith('.ndjson')
@@ -0,0 +1,36 @@
+from ddi.logs import *
+
+
+def test_configure_logging_replaces_handler():
+    try:
+        first = configure_logging()
+        second = configure_logging(debug=True, levels={'ddi.test': 'ERROR'})
+
+        handlers = logging.getLogger().handlers
+        assert second in handlers and first not in handlers
+        assert logging.getLogger().level == logging.DEBUG
+        assert logging.getLogger('ddi.test').level == logging.ERROR
+    finally:
+        stop_logging()
+        logging.getLogger('ddi.test').setLevel(logging.NOTSET)
+
+
+def test_json_formatter():
+    record = logging.LogRecord('ddi.test', logging.INFO, __file__, 1,
+                               'Found %s hosts.', (3,), None)
+
+    entry = json.loads(JSONFormatter().format(record))
+
+    assert entry['message'] == 'Found 3 hosts.'
+    assert (entry['level'], entry['name']) == ('INFO', 'ddi.test')
+
+
+def test_sampling_filter():
+    sampler = SamplingFilter(3)
+
+    def record(level):
+        return logging.LogRecord('ddi.test', level, __file__, 1, 'x', (), None)
+
+    assert [sampler.filter(record(logging.DEBUG)) for _ in range(6)] == [
+        True, False, False, True, False, False]
+    assert sampler.filter(record(logging.WARNING))
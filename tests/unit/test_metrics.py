@@ -0,0 +1,20 @@
+from ddi.metrics import *
+
+
+def test_render_metrics(tmp_path):
+    usage = {'cidr': '10.0.0.0/24', 'free': 200, 'site_name': 'UCB',
+             'size': 256, 'subnet_id': '7', 'subnet_name': 'Lab "A"',
+             'used': 54, 'used_percent': 21.3}
+
+    text = render_metrics([usage], 0.5, 1700000000)
+
+    assert 'ddi_subnet_used_ratio{cidr="10.0.0.0/24",site_name="UCB",' \
+           'subnet_name="Lab \\"A\\""} 0.213\n' in text
+    assert '# TYPE ddi_subnet_free_addresses gauge\n' in text
+    assert text.endswith('ddi_metrics_last_success_timestamp_seconds '
+                         '1700000000\n')
+
+    path = str(tmp_path / 'subnets.prom')
+    write_textfile(text, path)
+    assert open(path).read() == text
+    assert os.listdir(tmp_path) == ['subnets.prom']
@@ -0,0 +1,41 @@
+from ddi.pool import *
+
+import pytest
+
+
+def test_free_address_pool(stub_session):
+    """A subnet with four free addresses, one of which is secretly taken."""
+
+    def route(method, url, params):
+        if 'ip_block_subnet_list' in url:
+            return [{'subnet_id': '1832'}]
+        if 'ip_find_free_address' in url:
+            return [{'hostaddr': f'172.23.23.{i}'} for i in range(2, 6)]
+        return [{'ip_id': '1', 'ip_addr': 'ac171703'}]
+
+    with FreeAddressPool(stub_session(route), 'https://ddi.example.com/',
+                         size=2) as pool:
+        first = pool.take('172.23.23.0')
+        second = pool.take('172.23.23.0')
+        pool.invalidate('172.23.23.0', '172.23.23.4')
+        third = pool.take('172.23.23.0')
+
+        # 172.23.23.3 is in use and 4 was invalidated, so the pool has run
+        # dry.
+        with pytest.raises(PoolEmptyError):
+            pool.take('172.23.23.0', timeout=0.2)
+
+    assert {first, second, third} == {'172.23.23.2', '172.23.23.4',
+                                      '172.23.23.5'}
+
+
+def test_verify_free(stub_session):
+    addresses = ['172.23.23.2', '172.23.23.3']
+    url = 'https://ddi.example.com/'
+
+    assert verify_free(addresses, stub_session(lambda *a: (None, 204)),
+                       url) == addresses
+
+    # A server error says nothing about whether the addresses are in use.
+    with pytest.raises(ResultError):
+        verify_free(addresses, stub_session(lambda *a: ({}, 500)), url)
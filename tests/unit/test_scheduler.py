@@ -0,0 +1,126 @@
+from ddi.scheduler import *
+from ddi.session import ScheduledSession
+
+import requests
+import time
+
+
+def test_aimd_limiter_increase():
+    limiter = AIMDLimiter(initial=2, maximum=4, latency_target=1.0)
+
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.01, False)
+
+    assert limiter.limit == 4
+
+
+def test_aimd_limiter_decrease():
+    limiter = AIMDLimiter(initial=8, maximum=8)
+
+    limiter.acquire()
+    limiter.release(0.01, True)
+    assert limiter.limit == 4
+
+    # A second failure from the same round trip is not counted again.
+    limiter.acquire()
+    limiter.release(0.01, True)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=50, burst=1)
+
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    assert time.monotonic() - start >= 0.09
+
+
+def test_run_concurrently():
+    results = list(run_concurrently(lambda x: x * 2, range(100), workers=4))
+
+    assert results == [(x, x * 2) for x in range(100)]
+
+
+class CountingAdapter(requests.adapters.BaseAdapter):
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request.method, request.url))
+        time.sleep(0.05)
+        r = requests.Response()
+        r.status_code = 200
+        r._content = b'{}'
+        r.request = request
+        return r
+
+    def close(self):
+        pass
+
+
+def test_scheduled_session_merges_gets():
+    session = ScheduledSession(max_concurrency=8)
+    adapter = CountingAdapter()
+    session.mount('http://', adapter)
+
+    def get(_):
+        return session.get('http://ddi/rest/x', params={'WHERE': 'a'})
+
+    results = [r for _, r in run_concurrently(get, range(8), workers=8)]
+
+    assert len(adapter.sent) == 1
+    assert all(r is results[0] for r in results)
+
+    session.get('http://ddi/rest/x', params={'WHERE': 'a'})
+    assert len(adapter.sent) == 1
+
+    session.post('http://ddi/rest/y')
+    session.get('http://ddi/rest/x', params={'WHERE': 'a'})
+    assert len(adapter.sent) == 3
+
+
+class SlowFirstAdapter(CountingAdapter):
+    def send(self, request, **kwargs):
+        self.timeouts = getattr(self, 'timeouts', []) + [kwargs['timeout']]
+        if len(self.timeouts) == 1:
+            time.sleep(1)
+        return super().send(request, **kwargs)
+
+
+def test_scheduled_session_hedges_reads():
+    session = ScheduledSession(hedge=90)
+    adapter = SlowFirstAdapter()
+    session.mount('http://', adapter)
+    for _ in range(10):
+        session.latencies.record(0.05)
+
+    start = time.monotonic()
+    session.get('http://ddi/rest/x')
+
+    assert time.monotonic() - start < 0.5
+    assert len(adapter.timeouts) == 2
+
+
+def test_scheduled_session_deadline():
+    session = ScheduledSession(timeout=30, deadline=0.2)
+    adapter = SlowFirstAdapter()
+    session.mount('http://', adapter)
+
+    try:
+        session.get('http://ddi/rest/x')
+    except DeadlineExceeded:
+        pass
+
+    assert adapter.timeouts[0] <= 0.2
+
+    try:
+        session.post('http://ddi/rest/y')
+    except DeadlineExceeded:
+        pass
+    else:
+        raise AssertionError('The deadline was not enforced.')
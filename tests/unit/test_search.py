@@ -0,0 +1,43 @@
+from ddi.search import *
+
+HOSTS = [{'ip_id': '1', 'name': 'Web1.example.com',
+          'ip_alias': 'www.example.com'},
+         {'ip_id': '2', 'name': 'web2.example.com', 'ip_alias': ''},
+         {'ip_id': '3', 'name': 'db.example.com', 'ip_alias': ''}]
+
+
+def keys(matches):
+    return [m['key'] for m in matches]
+
+
+def test_name_index_search(tmp_path):
+    index = NameIndex(str(tmp_path / 'index.json'))
+    index.add(HOSTS)
+    index.save(compact=True)
+
+    index = NameIndex(str(tmp_path / 'index.json'))
+    assert index.indexed == 4
+
+    assert keys(index.search('WEB')) == ['web1.example.com', 'web2.example.com']
+    assert keys(index.search('b2.ex', mode='substring')) == ['web2.example.com']
+    assert keys(index.search('w*[1].example.*', mode='glob')) == [
+        'web1.example.com']
+    assert index.search('ww.exampel', mode='fuzzy')[0] == {
+        'ip_id': '1', 'key': 'www.example.com', 'name': 'web1.example.com',
+        'score': 0.571}
+
+
+def test_name_index_incremental(tmp_path):
+    index = NameIndex(str(tmp_path / 'index.json'))
+    index.add(HOSTS[:2])
+    index.save(compact=True)
+
+    index.add(HOSTS[2:])
+    index.save()
+
+    index = NameIndex(str(tmp_path / 'index.json'))
+    assert (index.indexed, len(index.entries), index.max_id) == (3, 4, 3)
+    assert keys(index.search('db')) == ['db.example.com']
+    assert keys(index.search('example.com', mode='substring')) == [
+        'db.example.com', 'web1.example.com', 'web2.example.com',
+        'www.example.com']
@@ -0,0 +1,73 @@
+from ddi.snapshot import *
+
+import pytest
+
+
+def ndjson(*records):
+    return [json.dumps(r) for r in records]
+
+
+def test_diff_snapshots():
+    old = ndjson({'ip_id': '2', 'name': 'a'}, {'ip_id': '10', 'name': 'b'},
+                 {'ip_id': '11', 'name': 'c', 'last_seen': '1'})
+    new = ndjson({'ip_id': '10', 'name': 'b2'},
+                 {'ip_id': '11', 'name': 'c', 'last_seen': '2'},
+                 {'ip_id': '12', 'name': 'd'})
+
+    events = list(diff_snapshots(old, new, ignore=('last_seen',)))
+
+    assert [(e['event'], e['key']) for e in events] == [
+        ('removed', '2'), ('changed', '10'), ('added', '12')]
+    assert events[1]['changes'] == {'name': ['b', 'b2']}
+
+
+def test_diff_snapshots_unsorted():
+    with pytest.raises(SnapshotOrderError):
+        list(diff_snapshots(ndjson({'ip_id': '10'}, {'ip_id': '2'}), []))
+
+
+def test_diff_snapshots_duplicate_names():
+    old = ndjson({'ip_id': '1', 'name': 'www', 'ip_addr': '10.0.0.1'},
+                 {'ip_id': '2', 'name': 'www', 'ip_addr': '10.0.0.2'})
+    new = ndjson({'ip_id': '2', 'name': 'www', 'ip_addr': '10.0.0.3'},
+                 {'ip_id': '3', 'name': 'www', 'ip_addr': '10.0.0.4'})
+
+    events = list(diff_snapshots(old, new, key='name'))
+
+    assert [(e['event'], e.get('record', {}).get('ip_id')) for e in events] \
+        == [('removed', '1'), ('changed', None), ('added', '3')]
+    assert events[1]['changes'] == {'ip_addr': ['10.0.0.2', '10.0.0.3']}
+
+
+def test_diff_snapshots_server_collation():
+    # Ordered as a server might collate them, not as Python would.
+    old = ndjson({'ip_id': '1', 'name': 'b-host'}, {'ip_id': '2', 'name': 'b_host'},
+                 {'ip_id': '3', 'name': 'B2'})
+    new = ndjson({'ip_id': '3', 'name': 'B2'}, {'ip_id': '2', 'name': 'b_host'})
+
+    events = list(diff_snapshots(old, new, key='name'))
+
+    assert [(e['event'], e['key']) for e in events] == [('removed', 'b-host')]
+
+
+def test_sort_records_spills_runs():
+    records = [{'name': f'host{i % 7}-{i}'} for i in range(50)]
+
+    assert list(sort_records(iter(records), 'name', run_size=8)) \
+        == sorted(records, key=lambda r: r['name'])
+
+
+def test_diff_cli_offline(tmp_path):
+    from click.testing import CliRunner
+    from ddi.cli import cli
+
+    old = tmp_path / 'old.ndjson'
+    new = tmp_path / 'new.ndjson'
+    old.write_text('\n'.join(ndjson({'ip_id': '1', 'name': 'a'})) + '\n')
+    new.write_text('')
+
+    result = CliRunner().invoke(cli, ['snapshot', 'diff', str(old), str(new)],
+                                env={'DDI_SERVER': None})
+
+    assert result.exit_code == 0, result.output
+    assert result.output == '- 1 a\n'
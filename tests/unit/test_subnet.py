@@ -73,3 +73,15 @@ def test_get_subnet_info(client):
 
     assert isinstance(failed_result, dict)
     assert jsend.is_fail(failed_result)
+
+
+def test_subnet_usage():
+    usage = subnet_usage({'subnet_id': '1832', 'subnet_name': 'cu-biot-seel4',
+                          'start_ip_addr': 'ac171700',
+                          'end_ip_addr': 'ac1717ff', 'subnet_size': '256',
+                          'subnet_ip_used_size': '2',
+                          'subnet_ip_free_size': '252', 'site_name': 'UCB'})
+
+    assert usage['cidr'] == '172.23.23.0/24'
+    assert usage['free'] == 252
+    assert usage['used_percent'] == 0.8
@@ -0,0 +1,101 @@
+from ddi.sync import *
+
+
+def existing_host(method, url, params):
+    """A server knowing about a single host with one alias."""
+    return [{'ip_id': '42', 'name': 'web1.example.com', 'ip_addr': 'ac171704',
+             'ip_alias': 'old.example.com',
+             'subnet_start_ip_addr': 'ac171700',
+             'subnet_end_ip_addr': 'ac1717ff',
+             'ip_class_parameters': 'hostname=web1&ucb_buildings=SEEL'}]
+
+
+def test_plan_changes(stub_session):
+    desired = {'hosts': [
+        {'name': 'web1.example.com', 'ip': '172.23.23.4',
+         'parameters': {'ucb_buildings': 'TEST'},
+         'aliases': ['www.example.com']},
+        {'name': 'web2.example.com', 'subnet': '172.23.23.0'},
+        {'name': 'gone.example.com', 'state': 'absent'},
+    ]}
+
+    changes = plan_changes(desired, stub_session(existing_host), 'https://ddi.example.com/')
+    actions = [(c['action'], c.get('alias', c['name'])) for c in changes]
+
+    assert actions == [('update_host', 'web1.example.com'),
+                       ('add_alias', 'www.example.com'),
+                       ('delete_alias', 'old.example.com'),
+                       ('add_host', 'web2.example.com')]
+    assert changes[0]['current'] == {'ucb_buildings': 'SEEL'}
+
+
+def test_plan_no_changes(stub_session):
+    desired = {'hosts': [
+        {'name': 'web1.example.com', 'subnet': '172.23.23.0',
+         'parameters': {'ucb_buildings': 'SEEL'},
+         'aliases': ['old.example.com']},
+    ]}
+
+    assert plan_changes(desired, stub_session(existing_host),
+                        'https://ddi.example.com/') == []
+
+
+def test_apply_changes_journal(tmp_path):
+    journal = Journal(str(tmp_path / 'apply.ndjson'))
+    done = {'status': 'success', 'data': {'results': []}}
+    journal.record('add_alias web1.example.com www.example.com', done)
+
+    changes = [{'action': 'add_alias', 'name': 'web1.example.com',
+                'ip_id': '42', 'alias': 'www.example.com'}]
+
+    # The session is never used as the only change is already journaled.
+    applied = apply_changes(changes, None, 'https://ddi.example.com/',
+                            journal=journal)
+    journal.close()
+
+    assert applied == [dict(changes[0], result=done)]
+
+
+def test_apply_changes_assigns_distinct_addresses(stub_session):
+    def route(method, url, params):
+        if 'ip_block_subnet_list' in url:
+            return [{'subnet_id': '7'}]
+        if 'ip_find_free_address' in url:
+            # The server offers the same first free addresses until hosts
+            # are actually added.
+            return [{'hostaddr': f'172.23.23.{i}'} for i in range(2, 6)]
+        if method == 'GET':
+            return None, 204
+        return [{'ret_oid': params['name']}]
+
+    session = stub_session(route)
+    changes = [{'action': 'add_host', 'name': f'web{i}.example.com',
+                'subnets': ['172.23.23.0'], 'parameters': {}, 'aliases': []}
+               for i in (1, 2)]
+
+    applied = apply_changes(changes, session, 'https://ddi.example.com/')
+
+    added = [sent['hostaddr'] for method, _, sent in session.requests
+             if method == 'POST']
+    assert all(jsend.is_success(c['result']) for c in applied)
+    assert len(added) == 2 and len(set(added)) == 2
+
+
+def test_assign_addresses_many(stub_session):
+    def route(method, url, params):
+        if 'ip_block_subnet_list' in url:
+            return [{'subnet_id': '7'}]
+        if 'ip_find_free_address' in url:
+            begin = int(params.get('begin_addr', '172.23.23.1').split('.')[3])
+            return [{'hostaddr': f'172.23.23.{i}'} for i in
+                    range(begin, min(begin + params['max_find'], 255))] or None
+        return None, 204
+
+    adds = [{'action': 'add_host', 'name': f'web{i}.example.com',
+             'subnets': ['172.23.23.0']} for i in range(60)]
+
+    assigned = assign_addresses(adds, stub_session(route),
+                                'https://ddi.example.com/', timeout=2)
+
+    assert len(assigned) == 60
+    assert len(set(assigned.values())) == 60
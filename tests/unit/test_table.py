@@ -0,0 +1,49 @@
+from ddi.table import *
+
+import pytest
+
+HOSTS = [{'ip_id': '2', 'name': 'b.example.com', 'ip_addr': 'ac171705',
+          'subnet_start_ip_addr': 'ac171700', 'subnet_end_ip_addr': 'ac1717ff',
+          'ip_class_parameters': 'ucb_buildings=SEEL&ucb_dept_aff=TEST'},
+         {'ip_id': '1', 'name': 'a.example.com', 'ip_addr': '0a000001'}]
+
+
+def test_address_table(tmp_path):
+    path = str(tmp_path / 'table')
+
+    assert write_table(HOSTS, path=path) == 2
+
+    with AddressTable(path) as table:
+        assert list(table.addresses) == [0x0a000001, 0xac171705]
+        assert table.lookup(parse_address('172.23.23.5')) == \
+            b'b.example.com\t172.23.23.0/24\tSEEL\tTEST\t'
+        assert table.lookup(parse_address('10.0.0.1')) == \
+            b'a.example.com\t10.0.0.1/32\t\t\t'
+        assert table.lookup(parse_address('10.0.0.2')) is None
+
+
+def test_address_table_invalid(tmp_path):
+    path = tmp_path / 'table'
+    path.write_bytes(b'not a table at all')
+
+    with pytest.raises(AddressTableError):
+        AddressTable(str(path))
+
+
+def test_address_table_truncated(tmp_path):
+    path = str(tmp_path / 'table')
+    write_table(HOSTS, path=path)
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for size in (0, 4, HEADER.size + 4, len(data) - 1):
+        with open(path, 'wb') as f:
+            f.write(data[:size])
+        with pytest.raises(AddressTableError):
+            AddressTable(path)
+
+
+def test_parse_address():
+    assert parse_address(b'10.0.0.1') == 0x0a000001
+    assert parse_address('10.1') is None
+    assert parse_address('10.0.0.256') is None
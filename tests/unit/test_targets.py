@@ -0,0 +1,52 @@
+from ddi.targets import *
+
+import time
+
+
+def target(name, site=None):
+    return {'name': name, 'session': None, 'site': site, 'url': name}
+
+
+def test_fan_out_timeout():
+    def query(session, url):
+        if url == 'slow':
+            time.sleep(5)
+        return jsend.success({'results': [{'name': url}]})
+
+    start = time.monotonic()
+    pairs = fan_out(query, [target('fast'), target('slow')], timeout=0.2)
+
+    assert time.monotonic() - start < 2
+    assert jsend.is_success(pairs[0][1])
+    assert jsend.is_error(pairs[1][1])
+
+
+def test_merge_results():
+    pairs = [(target('a', site='UCB'),
+              jsend.success({'results': [{'name': 'x', 'site_name': 'UCB'},
+                                         {'name': 'y', 'site_name': 'DEN'}]})),
+             (target('b'), jsend.fail({'results': []})),
+             (target('c'), jsend.fail({'results': [], 'status_code': 204}))]
+
+    r = merge_results(pairs)
+
+    assert jsend.is_success(r)
+    assert r['data']['results'] == [{'name': 'x', 'site_name': 'UCB',
+                                     'ddi_target': 'a'}]
+    assert r['data']['failed_targets'] == ['b']
+    assert r['data']['missing_targets'] == ['c']
+    assert jsend.is_fail(merge_results(pairs[1:]))
+
+
+def test_fan_out_same_server_sites():
+    targets = [dict(target(target_name('https://ddi/', site)), site=site,
+                    url='https://ddi/') for site in ('UCB', 'DEN')]
+
+    def query(session, url):
+        return jsend.success({'results': [{'name': 'x', 'site_name': 'UCB'},
+                                          {'name': 'y', 'site_name': 'DEN'}]})
+
+    r = merge_results(fan_out(query, targets))
+
+    assert [(h['name'], h['ddi_target']) for h in r['data']['results']] == [
+        ('x', 'https://ddi/ (UCB)'), ('y', 'https://ddi/ (DEN)')]
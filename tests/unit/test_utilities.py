@@ -1,5 +1,7 @@
 from ddi.utilites import *
 
+import pytest
+
 
 def test_hexlify_address():
     assert hexlify_address('127.0.0.1') == b'7f000001'
@@ -7,3 +9,103 @@ def test_hexlify_address():
 
 def test_unhexlify_address():
     assert unhexlify_address('7f000001') == '127.0.0.1'
+
+
+def test_cidr_to_hex_range():
+    assert cidr_to_hex_range('10.1.0.0/22') == ('0a010000', '0a0103ff')
+    assert cidr_to_hex_range('127.0.0.1') == ('7f000001', '7f000001')
+
+
+def test_iter_json_array():
+    data = b'[{"name": "a.example.com"}, 1.5, "x,]"] '
+    chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+
+    assert list(iter_json_array(chunks)) == [{'name': 'a.example.com'}, 1.5,
+                                             'x,]']
+    assert list(iter_json_array([b'{"a": 1}'])) == [{'a': 1}]
+    assert list(iter_json_array([b'{"a": "\xc3', b'\xa9"}'])) == [{'a': 'é'}]
+    assert list(iter_json_array([b'not json'])) == []
+    assert list(iter_json_array([])) == []
+
+
+def test_iter_json_array_truncated():
+    for body in (b'[{"a": 1}, {"a": 2}', b'[{"a": 1}, {"a": ', b'[1, 2, '):
+        records = []
+        with pytest.raises(ResultError):
+            for record in iter_json_array([body[:5], body[5:]]):
+                records.append(record)
+        assert records[0] in ({'a': 1}, 1)
+
+
+def test_host_record():
+    host_data = {'ip_id': '389885', 'name': 'ddi-test-host.example.com',
+                 'ip_addr': 'ac171704', 'ip_alias': 'ddi-test-cname',
+                 'subnet_start_ip_addr': 'ac171700',
+                 'subnet_end_ip_addr': 'ac1717ff',
+                 'ip_class_parameters': 'hostname=ddi-test&ucb_ph_no=555-1212'}
+
+    record = HostRecord.from_dict(dict(host_data))
+
+    assert record.ip_addr == 0xac171704
+    assert record.address == '172.23.23.4'
+    assert str(record.subnet) == '172.23.23.0/24'
+    assert record.parameter('ucb_ph_no') == '555-1212'
+    assert record.parameter('ucb_buildings') == ''
+
+    host_dict = record.to_dict()
+    assert host_dict['ip_addr'] == '172.23.23.4'
+    assert host_dict['subnet_start_ip_addr'] == '172.23.23.0'
+    assert host_dict['subnet_end_ip_addr'] == '172.23.23.255'
+    assert host_dict['subnet_cidr'] == '172.23.23.0/24'
+    assert host_dict['subnet_netmask'] == '255.255.255.0'
+    assert host_dict['ip_class_parameters'] == {'hostname': ['ddi-test'],
+                                                'ucb_ph_no': ['555-1212']}
+    assert host_dict['subnet_class_parameters'] == {}
+
+
+def test_host_record_external():
+    record = HostRecord.from_dict({'ip_addr': '7f000001',
+                                   'subnet_start_ip_addr': '0',
+                                   'subnet_end_ip_addr': '0'})
+
+    assert str(record.subnet) == '127.0.0.1/32'
+    assert record.to_dict()['subnet_netmask'] == '255.255.255.255'
+
+
+def test_address_range():
+    assert address_range('10.1.0.0/22') == (0x0a010000, 0x0a0103ff)
+    assert address_range('10.1.0.10-10.1.0.50') == (0x0a01000a, 0x0a010032)
+    assert address_range('10.1.0.10') == (0x0a01000a, 0x0a01000a)
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+def test_read_targets():
+    lines = ['a.example.com\n', '\n', '# comment\n', '  b.example.com  \n']
+
+    assert list(read_targets(lines)) == ['a.example.com', 'b.example.com']
+
+
+def test_stream_lookups():
+    queries = []
+
+    def lookup_batch(batch, session, url):
+        queries.append(batch)
+        if 'bad.example.com' in batch:
+            raise ResultError({'status': 'error'})
+        return [{'name': n.upper()} for n in batch if n != 'c.example.com']
+
+    targets = ['a.example.com', 'b.example.com', 'c.example.com',
+               'bad.example.com']
+    results = list(stream_lookups(iter(targets), lookup_batch,
+                                  lambda r: r['name'].lower(), None, '',
+                                  batch_size=3))
+
+    assert queries[0] == targets[:3]
+    assert results == [('a.example.com', [{'name': 'A.EXAMPLE.COM'}]),
+                       ('b.example.com', [{'name': 'B.EXAMPLE.COM'}]),
+                       ('c.example.com', []),
+                       ('bad.example.com', None)]
@@ -0,0 +1,39 @@
+from ddi.watch import *
+
+
+def test_diff_hashes():
+    events, hashes = diff_hashes({}, {'1': {'name': 'a'}})
+    assert [e['event'] for e in events] == ['added']
+
+    events, _ = diff_hashes(hashes, {'1': {'name': 'a', 'seen': '2'},
+                                     '2': {'name': 'b'}}, ignore=('seen',))
+    assert [(e['event'], e['key']) for e in events] == [('added', '2')]
+
+    events, _ = diff_hashes(hashes, {'1': {'name': 'c'}})
+    assert [e['event'] for e in events] == ['changed']
+    assert diff_hashes(hashes, {})[0] == [{'event': 'removed', 'key': '1'}]
+
+
+def test_watch_events(stub_session):
+    a = {'ip_id': '1', 'name': 'a.example.com'}
+    b = {'ip_id': '2', 'name': 'b.example.com'}
+    c = dict(b, name='c.example.com')
+    # One subnet whose hosts are replaced between polls.
+    polls = [[a], [a, b], [c], [dict(c, name='d.example.com')]]
+
+    def route(method, url, params):
+        if 'ip_block_subnet_list' in url:
+            return [{'subnet_id': '7',
+                     'subnet_ip_used_size': str(len(polls[0]))}]
+        return polls.pop(0)
+
+    session = stub_session(route)
+
+    events = list(watch_events(('10.0.0.0/24',), (), session, 'http://ddi/',
+                               interval=0, count=4))
+
+    assert [(e['event'], e['key']) for e in events] == [
+        ('added', '2'), ('removed', '1'), ('changed', '2')]
+    assert events[0]['source'] == 'subnet 10.0.0.0/24'
+    # The usage of the last poll did not change so its hosts were not listed.
+    assert sum('ip_address_list' in r[1] for r in session.requests) == 3